@@ -4,3 +4,20 @@ from django.apps import AppConfig
 class BookingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'booking'
+
+    def ready(self):
+        from django.conf import settings
+        from evfinder import scheduler
+        from . import availability, events, rollups, timeseries
+        from .signals import booking_status_changed, payment_status_changed
+        from .tasks import expire_pending_bookings
+
+        booking_status_changed.connect(availability.bookings_changed, dispatch_uid='booking.availability')
+        booking_status_changed.connect(rollups.bookings_changed, dispatch_uid='booking.rollups')
+        booking_status_changed.connect(timeseries.bookings_changed, dispatch_uid='booking.timeseries')
+        payment_status_changed.connect(timeseries.payments_changed, dispatch_uid='booking.timeseries')
+        booking_status_changed.connect(events.bookings_changed, dispatch_uid='booking.events')
+        payment_status_changed.connect(events.payments_changed, dispatch_uid='booking.events')
+
+        scheduler.register('expire_bookings', settings.BOOKING_EXPIRY_INTERVAL, expire_pending_bookings)
+        scheduler.register('prune_availability', 6 * 60 * 60, availability.prune)
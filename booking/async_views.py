@@ -0,0 +1,26 @@
+"""
+Async (ASGI) version of my-bookings: the same validators, page and
+serializer as BookingViewSet.my_bookings, with the ORM awaited.
+"""
+from evfinder.asyncapi import authenticate, check_permissions, read_view, render
+from evfinder.conditional import aconditional_response
+from .views import BookingViewSet, alist_validators
+
+my_bookings_fallback = BookingViewSet.as_view({"get": "my_bookings"})
+
+
+@read_view(my_bookings_fallback)
+async def my_bookings(request):
+    request = await authenticate(request)
+    view = BookingViewSet(request=request, args=(), kwargs={}, format_kwarg=None, action="my_bookings")
+    check_permissions(request, view.get_permissions(), view)
+
+    qs = view.get_queryset().filter(user=request.user)
+    etag = await alist_validators(request, qs, **BookingViewSet.MY_BOOKINGS_EXTRA)
+
+    async def build():
+        page = await view.paginator.apaginate_queryset(qs, request, view)
+        serializer = view.get_serializer(page, many=True)
+        return render(view.paginator.get_paginated_response(serializer.data).data)
+
+    return await aconditional_response(request, etag, None, build)
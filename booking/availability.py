@@ -0,0 +1,228 @@
+import math
+from collections import defaultdict
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+
+from stations import cache as station_cache
+from stations.models import Station
+from .models import Booking, StationDayAvailability
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+MAX_OCCUPANCY = 255
+
+# Statuses counted in the index: the status half of
+# BookingQuerySet.active(). A PENDING booking stops holding at
+# expires_at, but the index only learns that when the expiry sweep flips
+# it; readers subtract those with lapsed().
+HOLDING = {Booking.STATUS_PENDING, Booking.STATUS_CONFIRMED}
+
+
+def _slot_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    minutes = value.hour * 60 + value.minute
+    return datetime.combine(value.date(), time(), dt_timezone.utc) + timedelta(
+        minutes=minutes - minutes % SLOT_MINUTES
+    )
+
+
+def day_slots(start_at, end_at):
+    """
+    Yield (day, first_slot, last_slot_exclusive) for every UTC day the
+    window touches. Partial slots count as occupied.
+    """
+    current = _slot_start(start_at)
+    while current < end_at:
+        day = current.date()
+        midnight = datetime.combine(day, time(), dt_timezone.utc)
+        day_end = midnight + timedelta(days=1)
+        first = int((current - midnight).total_seconds() // 60) // SLOT_MINUTES
+        if end_at >= day_end:
+            last = SLOTS_PER_DAY
+        else:
+            last = math.ceil((end_at - midnight).total_seconds() / 60 / SLOT_MINUTES)
+        yield day, first, last
+        current = day_end
+
+
+def _deltas(changes):
+    deltas = defaultdict(lambda: [0] * SLOTS_PER_DAY)
+    for change in changes:
+        if change.start_at is None or change.end_at is None:
+            continue
+        sign = (change.new_status in HOLDING) - (change.old_status in HOLDING)
+        if not sign:
+            continue
+        for day, first, last in day_slots(change.start_at, change.end_at):
+            slots = deltas[(change.station_id, day)]
+            for slot in range(first, last):
+                slots[slot] += sign
+    return deltas
+
+
+def _apply_day(station_id, day, delta):
+    try:
+        with transaction.atomic():
+            row, _ = StationDayAvailability.objects.select_for_update().get_or_create(
+                station_id=station_id, day=day,
+                defaults={"occupancy": bytes(SLOTS_PER_DAY)},
+            )
+    except IntegrityError:
+        row = StationDayAvailability.objects.select_for_update().get(station_id=station_id, day=day)
+
+    occupancy = bytearray(row.occupancy)
+    for slot, change in enumerate(delta):
+        if change:
+            occupancy[slot] = min(MAX_OCCUPANCY, max(0, occupancy[slot] + change))
+    row.occupancy = bytes(occupancy)
+    row.save(update_fields=["occupancy"])
+
+
+def apply_changes(changes):
+    deltas = _deltas(changes)
+    if not deltas:
+        return
+    with transaction.atomic():
+        # Stable order so concurrent writers lock rows in the same sequence
+        for (station_id, day), delta in sorted(deltas.items()):
+            _apply_day(station_id, day, delta)
+
+
+def current_slot_stations(changes, now=None):
+    """
+    Stations whose occupancy in the current slot the changes move.
+    """
+    start = _slot_start(now or datetime.now(dt_timezone.utc))
+    end = start + timedelta(minutes=SLOT_MINUTES)
+    return {
+        change.station_id
+        for change in changes
+        if change.start_at is not None and change.end_at is not None
+        and change.start_at < end and change.end_at > start
+        and (change.new_status in HOLDING) != (change.old_status in HOLDING)
+    }
+
+
+def bookings_changed(sender, changes, **kwargs):
+    apply_changes(changes)
+    # Cached station responses quote surge for the current slot; later
+    # slots are picked up when the cache band rolls over to them
+    station_ids = current_slot_stations(changes)
+    if station_ids:
+        station_cache.bump(station_ids)
+
+
+def lapsed(station_ids, start_at, end_at):
+    """
+    (station_id, start_at, end_at) of PENDING bookings past expires_at
+    that overlap the window: still counted in the index until the sweep
+    runs, but no longer holding a connector. `station_ids` None means
+    every station. Read through the (status, expires_at) index, so the
+    cost grows with abandoned bookings the sweep hasn't expired; with
+    BACKGROUND_TASKS_ENABLED off, run expire_bookings from cron.
+    """
+    rows = Booking.objects.expired_pending().filter(start_at__lt=end_at, end_at__gt=start_at)
+    if station_ids is not None:
+        rows = rows.filter(station_id__in=list(station_ids))
+    return rows.values_list("station_id", "start_at", "end_at")
+
+
+def without_lapsed(occupancy, lapsed_rows):
+    """
+    `occupancy` ({(station_id, day): bytes}) with the lapsed() bookings
+    taken out.
+    """
+    occupancy = dict(occupancy)
+    for station_id, start_at, end_at in lapsed_rows:
+        for day, first, last in day_slots(start_at, end_at):
+            slots = occupancy.get((station_id, day))
+            if slots is None:
+                continue
+            slots = bytearray(slots)
+            for slot in range(first, last):
+                slots[slot] = max(0, slots[slot] - 1)
+            occupancy[(station_id, day)] = bytes(slots)
+    return occupancy
+
+
+def free_windows(station_ids, start_at, end_at):
+    """
+    Free windows per station in [start_at, end_at): runs of slots where
+    fewer connectors are reserved than the station has. Three queries,
+    regardless of booking history.
+    """
+    start_at = _slot_start(start_at)
+    capacity = dict(
+        Station.objects.filter(pk__in=station_ids, is_active=True).values_list("id", "connector_count")
+    )
+    days = sorted({day for day, _, _ in day_slots(start_at, end_at)})
+    rows = StationDayAvailability.objects.filter(station_id__in=capacity, day__in=days)
+    occupancy = without_lapsed(
+        {(row.station_id, row.day): bytes(row.occupancy) for row in rows},
+        lapsed(capacity, start_at, end_at),
+    )
+
+    empty = bytes(SLOTS_PER_DAY)
+    slot_length = timedelta(minutes=SLOT_MINUTES)
+    result = {}
+    for station_id, connectors in capacity.items():
+        windows = []
+        open_at = None
+        slot_at = start_at
+        for day, first, last in day_slots(start_at, end_at):
+            slots = occupancy.get((station_id, day), empty)
+            midnight = datetime.combine(day, time(), dt_timezone.utc)
+            for slot in range(first, last):
+                slot_at = midnight + slot * slot_length
+                free = slots[slot] < connectors
+                if free and open_at is None:
+                    open_at = slot_at
+                elif not free and open_at is not None:
+                    windows.append((open_at, slot_at))
+                    open_at = None
+        if open_at is not None:
+            windows.append((open_at, slot_at + slot_length))
+        result[station_id] = {"connectors": connectors, "free": windows}
+    return result
+
+
+def rebuild(station_ids=None):
+    """
+    Recompute occupancy from the bookings in a HOLDING status that end in
+    the future, as apply_changes() would have counted them (lapsed
+    PENDING ones included). Returns the number of day rows written.
+    """
+    now = datetime.now(dt_timezone.utc)
+    bookings = Booking.objects.filter(status__in=HOLDING, end_at__gt=now, start_at__isnull=False)
+    rows = StationDayAvailability.objects.filter(day__gte=now.date())
+    if station_ids is not None:
+        bookings = bookings.filter(station_id__in=station_ids)
+        rows = rows.filter(station_id__in=station_ids)
+
+    occupancy = defaultdict(lambda: bytearray(SLOTS_PER_DAY))
+    for station_id, start_at, end_at in bookings.values_list("station_id", "start_at", "end_at").iterator():
+        for day, first, last in day_slots(max(start_at, now), end_at):
+            slots = occupancy[(station_id, day)]
+            for slot in range(first, last):
+                slots[slot] = min(MAX_OCCUPANCY, slots[slot] + 1)
+
+    with transaction.atomic():
+        rows.delete()
+        StationDayAvailability.objects.bulk_create(
+            [
+                StationDayAvailability(station_id=station_id, day=day, occupancy=bytes(slots))
+                for (station_id, day), slots in occupancy.items()
+            ],
+            batch_size=1000,
+        )
+    return len(occupancy)
+
+
+def prune(keep_days=1):
+    """
+    Drop occupancy rows for days that are over.
+    """
+    cutoff = datetime.now(dt_timezone.utc).date() - timedelta(days=keep_days)
+    deleted, _ = StationDayAvailability.objects.filter(day__lt=cutoff).delete()
+    return deleted
@@ -0,0 +1,42 @@
+"""
+Push notifications for a user's bookings and payments (channel
+'user:<id>'), published from booking_status_changed and
+payment_status_changed once the write commits. Clients watching the
+expiry countdown or a payment confirmation get the new status instead
+of polling my-bookings.
+"""
+from evfinder import events
+
+
+def channel(user_id):
+    return f'user:{user_id}'
+
+
+def bookings_changed(sender, changes, **kwargs):
+    # new_status is None for a deleted booking
+    events.publish([
+        (channel(change.user_id), 'booking', {
+            'id': change.booking_id,
+            'station_id': change.station_id,
+            'status': change.new_status,
+            'old_status': change.old_status,
+            'start_at': change.start_at,
+            'end_at': change.end_at,
+            'amount': change.amount,
+        })
+        for change in changes
+    ])
+
+
+def payments_changed(sender, changes, **kwargs):
+    events.publish([
+        (channel(change.user_id), 'payment', {
+            'id': change.payment_id,
+            'booking_id': change.booking_id,
+            'station_id': change.station_id,
+            'status': change.new_status,
+            'old_status': change.old_status,
+            'amount': change.amount,
+        })
+        for change in changes
+    ])
@@ -0,0 +1,99 @@
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.utils import timezone
+
+from booking.models import Booking
+from booking.reservations import SlotUnavailable, reserve
+from stations.models import Station
+from users.models import Users
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer one station with concurrent reservations and report "
+        "reservations/sec and whether any window was oversold"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=16)
+        parser.add_argument("--attempts", type=int, default=200, help="Attempts per thread")
+        parser.add_argument("--connectors", type=int, default=4)
+        parser.add_argument("--windows", type=int, default=50, help="Distinct one-hour windows to compete for")
+        parser.add_argument("--keep", action="store_true", help="Keep the benchmark rows afterwards")
+
+    def handle(self, *args, **options):
+        tag = uuid.uuid4().hex[:8]
+        owner = Users.objects.create_user(
+            username=f"bench-owner-{tag}", email=f"bench-owner-{tag}@example.invalid",
+            password=None, role="chargerowner",
+        )
+        users = [
+            Users.objects.create_user(
+                username=f"bench-{tag}-{i}", email=f"bench-{tag}-{i}@example.invalid",
+                password=None, role="evowner",
+            )
+            for i in range(options["threads"])
+        ]
+        station = Station.objects.create(
+            owner=owner, name=f"bench-{tag}", latitude=0, longitude=0,
+            connector_count=options["connectors"],
+        )
+
+        base = timezone.now().replace(minute=0, second=0, microsecond=0) + timedelta(days=1)
+        windows = [(base + timedelta(hours=i), base + timedelta(hours=i + 1)) for i in range(options["windows"])]
+
+        results = {"reserved": 0, "conflicts": 0, "errors": 0}
+        lock = threading.Lock()
+
+        def worker(index, user):
+            local = {"reserved": 0, "conflicts": 0, "errors": 0}
+            try:
+                for attempt in range(options["attempts"]):
+                    start_at, end_at = windows[(index + attempt) % len(windows)]
+                    try:
+                        reserve(user, station.pk, start_at, end_at)
+                        local["reserved"] += 1
+                    except SlotUnavailable:
+                        local["conflicts"] += 1
+                    except Exception:
+                        local["errors"] += 1
+            finally:
+                connection.close()
+                with lock:
+                    for key, value in local.items():
+                        results[key] += value
+
+        threads = [threading.Thread(target=worker, args=(i, user)) for i, user in enumerate(users)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        oversold = [
+            start_at for start_at, end_at in windows
+            if Booking.objects.overlapping(station.pk, start_at, end_at).count() > station.connector_count
+        ]
+        attempts = options["threads"] * options["attempts"]
+
+        self.stdout.write(f"database:          {connections['default'].vendor}")
+        self.stdout.write(f"attempts:          {attempts} in {elapsed:.2f}s ({attempts / elapsed:.0f}/s)")
+        self.stdout.write(f"reserved:          {results['reserved']} ({results['reserved'] / elapsed:.0f}/s)")
+        self.stdout.write(f"conflicts:         {results['conflicts']}")
+        self.stdout.write(f"errors:            {results['errors']}")
+        self.stdout.write(f"capacity:          {len(windows) * station.connector_count}")
+        if oversold:
+            self.stdout.write(self.style.ERROR(f"OVERSOLD windows:  {len(oversold)}"))
+        else:
+            self.stdout.write(self.style.SUCCESS("oversold windows:  0"))
+
+        if not options["keep"]:
+            station.delete()
+            owner.delete()
+            Users.objects.filter(pk__in=[user.pk for user in users]).delete()
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from booking.tasks import expire_pending_bookings
+
+
+class Command(BaseCommand):
+    help = "Expire PENDING bookings past expires_at and fail their unpaid payments"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--loop", action="store_true", help="Keep sweeping every --interval seconds")
+        parser.add_argument("--interval", type=float, default=30.0)
+
+    def handle(self, *args, **options):
+        while True:
+            expired = expire_pending_bookings(batch_size=options["batch_size"])
+            self.stdout.write(f"Expired {expired} bookings")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
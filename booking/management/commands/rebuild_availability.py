@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from booking import availability
+
+
+class Command(BaseCommand):
+    help = "Recompute per-station connector occupancy from the bookings that hold a connector"
+
+    def handle(self, *args, **options):
+        rows = availability.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {rows} station-day rows"))
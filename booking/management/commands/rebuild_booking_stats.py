@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from booking import rollups
+
+
+class Command(BaseCommand):
+    help = "Rebuild (or with --verify, check) the per-station booking counters and daily buckets"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--verify", action="store_true", help="Only report mismatches, don't write")
+
+    def handle(self, *args, **options):
+        if options["verify"]:
+            mismatches = rollups.verify()
+            for key, expected, actual in mismatches:
+                self.stdout.write(f"{key}: expected {expected}, stored {actual}")
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f"{len(mismatches)} mismatched rows"))
+            else:
+                self.stdout.write(self.style.SUCCESS("Booking stats are consistent"))
+            return
+
+        stations, days = rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {stations} station rows and {days} daily rows"))
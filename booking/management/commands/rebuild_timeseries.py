@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from booking import timeseries
+
+
+class Command(BaseCommand):
+    help = "Recompute the hourly station time-series buckets from bookings and payments"
+
+    def handle(self, *args, **options):
+        buckets = timeseries.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {buckets} hourly buckets"))
@@ -1,12 +1,44 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
 from datetime import timedelta
 import uuid
 from stations.models import *
+from django.db.models import Case, F, Q, Value, When
+from django.db.models.functions import Now
 
+from .signals import change_for, payment_change_for, send_changes, send_payment_changes
 
 
+class BookingQuerySet(models.QuerySet):
+
+    def active(self):
+        """
+        Bookings that hold their connector: confirmed, or pending and not
+        yet past expires_at.
+        """
+        return self.filter(
+            Q(status=Booking.STATUS_CONFIRMED)
+            | Q(status=Booking.STATUS_PENDING, expires_at__gt=Now())
+        )
+
+    def overlapping(self, station_id, start_at, end_at):
+        return self.active().filter(station_id=station_id, start_at__lt=end_at, end_at__gt=start_at)
+
+    def expired_pending(self):
+        return self.filter(status=Booking.STATUS_PENDING, expires_at__lte=Now())
+
+    def with_current_status(self):
+        """
+        Annotate `effective_status`: EXPIRED for PENDING rows past
+        expires_at that the expiry sweep hasn't reached yet.
+        """
+        return self.annotate(effective_status=Case(
+            When(status=Booking.STATUS_PENDING, expires_at__lte=Now(), then=Value(Booking.STATUS_EXPIRED)),
+            default=F('status'),
+            output_field=models.CharField(),
+        ))
+
 
 class Booking(models.Model):
     STATUS_PENDING = "PENDING"     # created, awaiting payment confirmation
@@ -27,22 +59,75 @@ class Booking(models.Model):
     user = models.ForeignKey(Users, on_delete=models.CASCADE, related_name="bookings")
     station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name="bookings")
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     expires_at = models.DateTimeField()
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING) 
     amount = models.DecimalField(max_digits=10, decimal_places=2,null=True)
 
+    # Reserved charging window and connector (null on legacy bookings)
+    start_at = models.DateTimeField(null=True, blank=True)
+    end_at = models.DateTimeField(null=True, blank=True)
+    connector = models.PositiveSmallIntegerField(null=True, blank=True)
+
+    objects = BookingQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['user', 'created_at', 'id']),
+            models.Index(fields=['status', 'expires_at']),
+            models.Index(fields=['user', 'updated_at']),
+            models.Index(fields=['station', 'start_at', 'end_at']),
+        ]
+
     def save(self, *args, **kwargs):
         if not self.expires_at:
             self.expires_at = self.created_at + timedelta(minutes=5) if self.created_at else timezone.now() + timedelta(minutes=5)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = set(update_fields) | {"updated_at"}
         super().save(*args, **kwargs)
 
     def is_expired(self):
         return timezone.now() >= self.expires_at and self.status in (self.STATUS_PENDING,)
 
+    def current_status(self):
+        status = self.__dict__.get('effective_status')
+        if status is not None:
+            return status
+        return self.STATUS_EXPIRED if self.is_expired() else self.status
+
+    def set_status(self, status):
+        """
+        Move from the loaded status to `status`, notifying
+        booking_status_changed. The update is conditional on the row
+        still having that status (and, for a pending booking being
+        confirmed, not having expired), so a concurrent sweep or confirm
+        is never overwritten. Returns False, changing nothing, when the
+        race was lost.
+        """
+        old_status = self.status
+        if status == old_status:
+            return False
+        rows = Booking.objects.filter(pk=self.pk, status=old_status)
+        if old_status == self.STATUS_PENDING and status == self.STATUS_CONFIRMED:
+            rows = rows.filter(expires_at__gt=Now())
+        with transaction.atomic():
+            if rows.update(status=status, updated_at=Now()) != 1:
+                return False
+            send_changes([change_for(self, old_status, status)])
+        self.status = status
+        return True
+
     def mark_expired_if_needed(self):
         if self.is_expired():
+            # Conditional update so a concurrent sweep or confirm is never overwritten
+            expired = Booking.objects.filter(pk=self.pk, status=self.STATUS_PENDING).update(
+                status=self.STATUS_EXPIRED, updated_at=Now()
+            )
+            if expired:
+                send_changes([change_for(self, self.STATUS_PENDING, self.STATUS_EXPIRED)])
             self.status = self.STATUS_EXPIRED
-            self.save(update_fields=["status"])
 
     def __str__(self):
         return f"Booking {self.id} by {self.user}"
@@ -64,10 +149,107 @@ class Payment(models.Model):
     booking = models.OneToOneField(Booking, on_delete=models.CASCADE, related_name="payment")
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     gateway_order_id = models.CharField(max_length=200, blank=True, null=True)  # fake order id
     gateway_payment_id = models.CharField(max_length=200, blank=True, null=True)  # fake payment id
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_CREATED)
     metadata = models.JSONField(null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
+
+    @classmethod
+    def open(cls, booking, **fields):
+        """
+        Create a payment for `booking`, notifying payment_status_changed.
+        """
+        with transaction.atomic():
+            payment = cls.objects.create(booking=booking, **fields)
+            send_payment_changes([payment_change_for(payment, booking, None, payment.status)])
+        return payment
+
+    def set_status(self, status):
+        old_status = self.status
+        with transaction.atomic():
+            self.status = status
+            self.save()
+            send_payment_changes([payment_change_for(self, self.booking, old_status, status)])
+
     def __str__(self):
         return f"Payment {self.id} ({self.status})"
+
+
+class StationDayAvailability(models.Model):
+    """
+    Connector occupancy of one station for one UTC day: one byte per
+    15-minute slot holding how many connectors are reserved in it.
+    Maintained by booking.availability from booking status changes.
+    """
+    station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name="availability")
+    day = models.DateField()
+    occupancy = models.BinaryField()
+
+    class Meta:
+        unique_together = ("station", "day")
+
+    def __str__(self):
+        return f"{self.station_id} {self.day}"
+
+
+class StationBookingStats(models.Model):
+    """
+    All-time booking counters per station, maintained by booking.rollups.
+    """
+    station = models.OneToOneField(Station, on_delete=models.CASCADE, primary_key=True, related_name="booking_stats")
+    total = models.IntegerField(default=0)
+    confirmed = models.IntegerField(default=0)
+    pending = models.IntegerField(default=0)
+    expired = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    def __str__(self):
+        return f"{self.station_id}: {self.total}"
+
+
+class StationDailyBookingStats(models.Model):
+    """
+    The same counters bucketed by the local day the booking was created.
+    """
+    station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name="daily_booking_stats")
+    day = models.DateField()
+    total = models.IntegerField(default=0)
+    confirmed = models.IntegerField(default=0)
+    pending = models.IntegerField(default=0)
+    expired = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ("station", "day")
+
+    def __str__(self):
+        return f"{self.station_id} {self.day}: {self.total}"
+
+
+class StationHourlyStats(models.Model):
+    """
+    Hourly time-series buckets per station, keyed by the local hour the
+    booking/payment was created. Coarser granularities are summed from
+    these rows. Maintained by booking.timeseries.
+    """
+    station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name="hourly_stats")
+    hour = models.DateTimeField()
+    bookings = models.IntegerField(default=0)
+    confirmed = models.IntegerField(default=0)
+    expired = models.IntegerField(default=0)
+    cancelled = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    payments_paid = models.IntegerField(default=0)
+    payments_failed = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ("station", "hour")
+
+    def __str__(self):
+        return f"{self.station_id} {self.hour}"
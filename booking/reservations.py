@@ -0,0 +1,67 @@
+import random
+import time
+
+from django.db import OperationalError, transaction
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from stations.models import Station
+from .models import Booking
+from .signals import change_for, send_changes
+
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 0.02
+
+
+class SlotUnavailable(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = "No connector is free at this station for the requested time."
+    default_code = "slot_unavailable"
+
+
+def reserve(user, station_id, start_at, end_at, amount=None):
+    """
+    Atomically reserve a free connector at a station for [start_at, end_at).
+
+    The station row is locked with SELECT ... FOR UPDATE, so concurrent
+    reservations for the same station are serialized and the overlap check
+    and insert can't interleave. Lock waits/deadlocks are retried with
+    jittered backoff. Raises SlotUnavailable when every connector is taken.
+    """
+    for attempt in range(MAX_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                return _reserve_locked(user, station_id, start_at, end_at, amount)
+        except OperationalError:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(BACKOFF_SECONDS * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+def _reserve_locked(user, station_id, start_at, end_at, amount):
+    capacity = (
+        Station.objects
+        .select_for_update()
+        .values_list("connector_count", flat=True)
+        .get(pk=station_id)
+    )
+
+    taken = set(
+        Booking.objects
+        .overlapping(station_id, start_at, end_at)
+        .values_list("connector", flat=True)
+    )
+    connector = next((n for n in range(1, capacity + 1) if n not in taken), None)
+    if connector is None:
+        raise SlotUnavailable()
+
+    booking = Booking.objects.create(
+        user=user,
+        station_id=station_id,
+        start_at=start_at,
+        end_at=end_at,
+        connector=connector,
+        amount=amount,
+    )
+    send_changes([change_for(booking, None, booking.status)])
+    return booking
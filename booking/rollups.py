@@ -0,0 +1,162 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import Booking, StationBookingStats, StationDailyBookingStats
+
+COUNTERS = ("total", "confirmed", "pending", "expired", "revenue")
+
+# Status -> counter it is counted under
+STATUS_COUNTERS = {
+    Booking.STATUS_CONFIRMED: "confirmed",
+    Booking.STATUS_PENDING: "pending",
+    Booking.STATUS_EXPIRED: "expired",
+}
+
+
+def _empty():
+    return {name: 0 for name in COUNTERS}
+
+
+def _change_deltas(change):
+    delta = _empty()
+    if change.old_status is None:
+        delta["total"] += 1
+    if change.new_status is None:
+        delta["total"] -= 1
+
+    if change.old_status in STATUS_COUNTERS:
+        delta[STATUS_COUNTERS[change.old_status]] -= 1
+    if change.new_status in STATUS_COUNTERS:
+        delta[STATUS_COUNTERS[change.new_status]] += 1
+
+    amount = change.amount or Decimal("0")
+    if change.old_status == Booking.STATUS_CONFIRMED:
+        delta["revenue"] -= amount
+    if change.new_status == Booking.STATUS_CONFIRMED:
+        delta["revenue"] += amount
+    return delta
+
+
+def upsert_counters(model, lookup, delta):
+    values = {name: value for name, value in delta.items() if value}
+    if not values:
+        return
+
+    updates = {name: F(name) + value for name, value in values.items()}
+    if model.objects.filter(**lookup).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **values)
+    except IntegrityError:
+        # Another writer created the row first
+        model.objects.filter(**lookup).update(**updates)
+
+
+def apply_changes(changes):
+    totals = defaultdict(_empty)
+    daily = defaultdict(_empty)
+
+    for change in changes:
+        delta = _change_deltas(change)
+        day = timezone.localdate(change.created_at)
+        for name, value in delta.items():
+            totals[change.station_id][name] += value
+            daily[(change.station_id, day)][name] += value
+
+    with transaction.atomic():
+        # Stable order so concurrent writers lock rows in the same sequence
+        for station_id, delta in sorted(totals.items()):
+            upsert_counters(StationBookingStats, {"station_id": station_id}, delta)
+        for (station_id, day), delta in sorted(daily.items()):
+            upsert_counters(StationDailyBookingStats, {"station_id": station_id, "day": day}, delta)
+
+
+def bookings_changed(sender, changes, **kwargs):
+    apply_changes(changes)
+
+
+def _aggregates():
+    return {
+        "total": Count("id"),
+        "confirmed": Count("id", filter=Q(status=Booking.STATUS_CONFIRMED)),
+        "pending": Count("id", filter=Q(status=Booking.STATUS_PENDING)),
+        "expired": Count("id", filter=Q(status=Booking.STATUS_EXPIRED)),
+        "revenue": Sum("amount", filter=Q(status=Booking.STATUS_CONFIRMED)),
+    }
+
+
+def compute():
+    """
+    Recompute (totals, daily) from the bookings table:
+    {station_id: counters} and {(station_id, day): counters}.
+    """
+    totals = {}
+    for row in Booking.objects.order_by().values("station_id").annotate(**_aggregates()):
+        row["revenue"] = row["revenue"] or Decimal("0")
+        totals[row.pop("station_id")] = row
+
+    daily = {}
+    rows = (
+        Booking.objects.order_by()
+        .annotate(day=TruncDate("created_at", tzinfo=timezone.get_current_timezone()))
+        .values("station_id", "day")
+        .annotate(**_aggregates())
+    )
+    for row in rows:
+        row["revenue"] = row["revenue"] or Decimal("0")
+        daily[(row.pop("station_id"), row.pop("day"))] = row
+    return totals, daily
+
+
+def stored():
+    totals = {
+        row.pop("station_id"): row
+        for row in StationBookingStats.objects.values("station_id", *COUNTERS)
+    }
+    daily = {}
+    for row in StationDailyBookingStats.objects.values("station_id", "day", *COUNTERS):
+        daily[(row.pop("station_id"), row.pop("day"))] = row
+    return totals, daily
+
+
+def _drop_zero(rows):
+    return {key: row for key, row in rows.items() if any(row.values())}
+
+
+def verify():
+    """
+    Keys whose stored counters differ from a recomputation.
+    """
+    expected_totals, expected_daily = compute()
+    actual_totals, actual_daily = stored()
+
+    mismatches = []
+    for expected, actual in ((expected_totals, actual_totals), (expected_daily, actual_daily)):
+        expected = _drop_zero(expected)
+        actual = _drop_zero(actual)
+        for key in sorted(set(expected) | set(actual), key=str):
+            if expected.get(key) != actual.get(key):
+                mismatches.append((key, expected.get(key), actual.get(key)))
+    return mismatches
+
+
+def rebuild(batch_size=1000):
+    totals, daily = compute()
+    with transaction.atomic():
+        StationBookingStats.objects.all().delete()
+        StationDailyBookingStats.objects.all().delete()
+        StationBookingStats.objects.bulk_create(
+            [StationBookingStats(station_id=station_id, **row) for station_id, row in totals.items()],
+            batch_size=batch_size,
+        )
+        StationDailyBookingStats.objects.bulk_create(
+            [StationDailyBookingStats(station_id=station_id, day=day, **row) for (station_id, day), row in daily.items()],
+            batch_size=batch_size,
+        )
+    return len(totals), len(daily)
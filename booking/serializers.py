@@ -1,13 +1,14 @@
-from rest_framework import serializers
-from .models import Booking
-
+from datetime import timedelta
 
+from django.conf import settings
+from django.utils import timezone
 from rest_framework import serializers
 from .models import Booking
 
 class BookingSerializer(serializers.ModelSerializer):
     station_name = serializers.CharField(source="station.name", read_only=True)
     user_name = serializers.CharField(source="user.username", read_only=True)
+    status = serializers.CharField(source="current_status", read_only=True)
 
     class Meta:
         model = Booking
@@ -18,16 +19,45 @@ class BookingSerializer(serializers.ModelSerializer):
             "user_name",        # Output
             "amount",
             "status",
+            "start_at",
+            "end_at",
+            "connector",
             "created_at",
             "expires_at",
         ]
         extra_kwargs = {
+            "amount": {"read_only": True},
+            "connector": {"read_only": True},
             "station": {"write_only": True, "required": True},
-            "status": {"read_only": True},
             "created_at": {"read_only": True},
             "expires_at": {"read_only": True},
         }
 
+    def validate(self, attrs):
+        # The connector was reserved for this station and window; moving it needs a new booking
+        if self.instance is not None:
+            for field in ("station", "start_at", "end_at"):
+                if field in attrs and attrs[field] != getattr(self.instance, field):
+                    raise serializers.ValidationError({field: "Cannot be changed after booking."})
+
+        # Defaults keep older clients (no window) working: charge from now
+        start_at = attrs.get("start_at") or getattr(self.instance, "start_at", None) or timezone.now()
+        end_at = (
+            attrs.get("end_at")
+            or getattr(self.instance, "end_at", None)
+            or start_at + timedelta(minutes=settings.BOOKING_DEFAULT_MINUTES)
+        )
+
+        if end_at <= start_at:
+            raise serializers.ValidationError({"end_at": "end_at must be after start_at."})
+
+        if end_at - start_at > timedelta(minutes=settings.BOOKING_MAX_MINUTES):
+            raise serializers.ValidationError({"end_at": "Booking window is too long."})
+
+        attrs["start_at"] = start_at
+        attrs["end_at"] = end_at
+        return attrs
+
 
 
 from rest_framework import serializers
@@ -0,0 +1,51 @@
+from collections import namedtuple
+
+from django.dispatch import Signal
+
+# One booking moving between statuses. old_status is None for a new
+# booking and new_status is None for a deleted one.
+BookingChange = namedtuple(
+    "BookingChange",
+    ["booking_id", "station_id", "old_status", "new_status", "start_at", "end_at", "amount", "created_at", "user_id"],
+)
+
+# Sent inside the writing transaction with `changes`, a list of
+# BookingChange, whenever bookings are created, change status or are
+# deleted, including the bulk expiry sweep. Receivers maintain derived
+# data (availability, rollups) and must be set-based.
+booking_status_changed = Signal()
+
+
+def change_for(booking, old_status, new_status):
+    return BookingChange(
+        booking.pk, booking.station_id, old_status, new_status,
+        booking.start_at, booking.end_at, booking.amount, booking.created_at, booking.user_id,
+    )
+
+
+def send_changes(changes):
+    changes = [change for change in changes if change.old_status != change.new_status]
+    if changes:
+        booking_status_changed.send(sender=BookingChange, changes=changes)
+
+
+PaymentChange = namedtuple(
+    "PaymentChange",
+    ["payment_id", "station_id", "old_status", "new_status", "amount", "created_at", "booking_id", "user_id"],
+)
+
+# Same contract as booking_status_changed, for Payment.status.
+payment_status_changed = Signal()
+
+
+def payment_change_for(payment, booking, old_status, new_status):
+    return PaymentChange(
+        payment.pk, booking.station_id, old_status, new_status, payment.amount, payment.created_at,
+        booking.pk, booking.user_id,
+    )
+
+
+def send_payment_changes(changes):
+    changes = [change for change in changes if change.old_status != change.new_status]
+    if changes:
+        payment_status_changed.send(sender=PaymentChange, changes=changes)
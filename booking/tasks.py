@@ -0,0 +1,60 @@
+from django.db import connection, transaction
+from django.db.models.functions import Now
+from django.utils import timezone
+
+from .models import Booking, Payment
+from .signals import BookingChange, PaymentChange, send_changes, send_payment_changes
+
+
+def expire_pending_bookings(batch_size=500):
+    """
+    Flip PENDING bookings past expires_at to EXPIRED and fail their
+    CREATED payments, one set-based UPDATE per batch. The cost follows the
+    number of rows that actually expire, via the (status, expires_at) index.
+    Returns the number of bookings expired.
+    """
+    total = 0
+    while True:
+        now = timezone.now()
+        with transaction.atomic():
+            due = (
+                Booking.objects
+                .filter(status=Booking.STATUS_PENDING, expires_at__lte=now)
+                .order_by("expires_at")
+            )
+            # Lock the batch so rows confirmed concurrently aren't reported as expired
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            rows = list(
+                due.values_list("id", "station_id", "start_at", "end_at", "amount", "created_at", "user_id")[:batch_size]
+            )
+            if not rows:
+                break
+
+            ids = [row[0] for row in rows]
+            expired = (
+                Booking.objects
+                .filter(id__in=ids, status=Booking.STATUS_PENDING)
+                .update(status=Booking.STATUS_EXPIRED, updated_at=Now())
+            )
+            unpaid = Payment.objects.filter(booking_id__in=ids, status=Payment.STATUS_CREATED)
+            failed = list(unpaid.values_list(
+                "id", "booking__station_id", "amount", "created_at", "booking_id", "booking__user_id",
+            ))
+            unpaid.update(status=Payment.STATUS_FAILED, updated_at=Now())
+
+            send_changes([
+                BookingChange(pk, station_id, Booking.STATUS_PENDING, Booking.STATUS_EXPIRED,
+                              start_at, end_at, amount, created_at, user_id)
+                for pk, station_id, start_at, end_at, amount, created_at, user_id in rows
+            ])
+            send_payment_changes([
+                PaymentChange(pk, station_id, Payment.STATUS_CREATED, Payment.STATUS_FAILED, amount, created_at,
+                              booking_id, user_id)
+                for pk, station_id, amount, created_at, booking_id, user_id in failed
+            ])
+
+        total += expired
+        if len(rows) < batch_size:
+            break
+    return total
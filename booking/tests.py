@@ -1,3 +1,467 @@
-from django.test import TestCase
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import OperationalError, router, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+import numpy as np
+
+from evfinder.db_router import ReplicaRoutingMiddleware
+from evfinder.testing import AsyncRoutesMixin, EventsMixin, ReplicaDatabaseMixin, SharedCacheMixin
+from stations import pricing
+from stations.models import Station
+from users.models import Users
+from users.tokens import UserRefreshToken
+from . import availability, events, rollups, timeseries
+from .availability import free_windows
+from .models import Booking, Payment, StationBookingStats, StationDayAvailability, StationHourlyStats
+from . import reservations
+from .reservations import SlotUnavailable, reserve
+
+
+class BookingTestCase(TestCase):
+
+    def setUp(self):
+        self.owner = Users.objects.create_user(username='owner', email='owner@example.com', password='pw', role='chargerowner')
+        self.user = Users.objects.create_user(username='ev', email='ev@example.com', password='pw')
+        self.station = Station.objects.create(owner=self.owner, name='Hub', latitude=12.97, longitude=77.59, connector_count=1)
+        self.start = (timezone.now() + timedelta(days=1)).replace(minute=0, second=0, microsecond=0)
+
+    def book(self, hours=(0, 1), user=None):
+        return reserve(
+            user or self.user, self.station.pk,
+            self.start + timedelta(hours=hours[0]), self.start + timedelta(hours=hours[1]), amount=100,
+        )
+
+    def stats(self):
+        return StationBookingStats.objects.get(station=self.station)
+
+
+class CreateBookingTests(BookingTestCase):
+
+    def test_amount_is_quoted_by_the_server(self):
+        pricing.reset_schedules()
+        self.addCleanup(pricing.reset_schedules)
+        Station.objects.filter(pk=self.station.pk).update(price=40)
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.post('/api/bookings/', {
+            'station': self.station.pk, 'amount': '0.01',
+            'start_at': self.start.isoformat(), 'end_at': (self.start + timedelta(minutes=90)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Booking.objects.get().amount, Decimal('60.00'))
+
+
+class ReservationTests(BookingTestCase):
+
+    def other_user(self, n=2):
+        return Users.objects.create_user(username=f'ev{n}', email=f'ev{n}@example.com', password='pw')
+
+    def test_overlapping_window_is_refused(self):
+        self.book((0, 2))
+        with self.assertRaises(SlotUnavailable):
+            self.book((1, 3), user=self.other_user())
+
+    def test_adjacent_windows_share_a_connector(self):
+        first = self.book((0, 1))
+        second = self.book((1, 2), user=self.other_user())
+        self.assertEqual(first.connector, second.connector)
+
+    def test_each_connector_is_booked_once(self):
+        Station.objects.filter(pk=self.station.pk).update(connector_count=2)
+        connectors = {self.book().connector, self.book(user=self.other_user()).connector}
+        self.assertEqual(connectors, {1, 2})
+        with self.assertRaises(SlotUnavailable):
+            self.book(user=self.other_user(3))
+
+    def test_released_connectors_are_reused(self):
+        booking = self.book()
+        booking.set_status(Booking.STATUS_CANCELLED)
+        self.assertEqual(self.book(user=self.other_user()).connector, booking.connector)
+
+    def test_lock_conflicts_are_retried(self):
+        attempts = []
+        locked = reservations._reserve_locked
+
+        def deadlock_once(*args):
+            attempts.append(args)
+            if len(attempts) == 1:
+                raise OperationalError('deadlock found when trying to get lock')
+            return locked(*args)
+
+        with mock.patch.object(reservations, '_reserve_locked', deadlock_once), \
+                mock.patch.object(reservations, 'BACKOFF_SECONDS', 0):
+            booking = self.book()
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(Booking.objects.filter(pk=booking.pk).count(), 1)
+
+
+class SetStatusTests(BookingTestCase):
+
+    def test_confirm(self):
+        booking = self.book()
+        self.assertTrue(booking.set_status(Booking.STATUS_CONFIRMED))
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, Booking.STATUS_CONFIRMED)
+        self.assertEqual((self.stats().pending, self.stats().confirmed), (0, 1))
+
+    def test_confirm_loses_to_the_expiry_sweep(self):
+        booking = self.book()
+        # The sweep expires the row after the view loaded it
+        stale = Booking.objects.get(pk=booking.pk)
+        booking.set_status(Booking.STATUS_EXPIRED)
+
+        self.assertFalse(stale.set_status(Booking.STATUS_CONFIRMED))
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, Booking.STATUS_EXPIRED)
+        self.assertEqual((self.stats().pending, self.stats().confirmed, self.stats().expired), (0, 0, 1))
+
+    def test_confirm_past_expiry_is_refused(self):
+        booking = self.book()
+        Booking.objects.filter(pk=booking.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertFalse(booking.set_status(Booking.STATUS_CONFIRMED))
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, Booking.STATUS_PENDING)
+
+    def test_concurrent_confirms_apply_once(self):
+        booking = self.book()
+        other = Booking.objects.get(pk=booking.pk)
+        self.assertTrue(booking.set_status(Booking.STATUS_CONFIRMED))
+        self.assertFalse(other.set_status(Booking.STATUS_CONFIRMED))
+        self.assertEqual(self.stats().confirmed, 1)
+
+
+class AvailabilityTests(BookingTestCase):
+
+    def window(self):
+        return free_windows([self.station.pk], self.start, self.start + timedelta(hours=1))[self.station.pk]['free']
+
+    def occupied(self):
+        ids = np.array([self.station.pk])
+        return pricing.occupancy_at(ids, self.start + timedelta(minutes=30))[0]
+
+    def test_booking_holds_its_slots(self):
+        self.book()
+        self.assertEqual(self.window(), [])
+        self.assertEqual(self.occupied(), 1)
+
+    def test_lapsed_pending_booking_frees_its_slots_before_the_sweep(self):
+        booking = self.book()
+        Booking.objects.filter(pk=booking.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(self.window(), [(self.start, self.start + timedelta(hours=1))])
+        self.assertEqual(self.occupied(), 0)
+        # The slot can be booked again straight away
+        self.book(user=Users.objects.create_user(username='ev2', email='ev2@example.com', password='pw'))
+
+
+    def test_completed_booking_frees_its_slots(self):
+        self.book().set_status(Booking.STATUS_COMPLETED)
+        self.assertEqual(self.occupied(), 0)
+        self.book(user=Users.objects.create_user(username='ev2', email='ev2@example.com', password='pw'))
+
+    def test_rebuild_matches_the_maintained_index(self):
+        Station.objects.filter(pk=self.station.pk).update(connector_count=3)
+        self.book((0, 2))
+        self.book((1, 3)).set_status(Booking.STATUS_CONFIRMED)
+        self.book((0, 1)).set_status(Booking.STATUS_CANCELLED)
+        confirmed = self.book((2, 4))
+        confirmed.set_status(Booking.STATUS_CONFIRMED)
+        confirmed.set_status(Booking.STATUS_COMPLETED)
+        lapsed = self.book((3, 5))
+        Booking.objects.filter(pk=lapsed.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        def index():
+            return {(row.day, bytes(row.occupancy)) for row in StationDayAvailability.objects.filter(station=self.station)}
+
+        maintained = index()
+        availability.rebuild([self.station.pk])
+        self.assertEqual(index(), maintained)
+
+
+class RollupTests(BookingTestCase):
+
+    def counters(self):
+        stats = self.stats()
+        return {name: getattr(stats, name) for name in rollups.COUNTERS}
+
+    def rebuild(self, *args):
+        out = StringIO()
+        call_command('rebuild_booking_stats', *args, stdout=out)
+        return out.getvalue()
+
+    def test_counters_follow_status_changes(self):
+        confirmed = self.book((0, 1))
+        confirmed.set_status(Booking.STATUS_CONFIRMED)
+        self.book((1, 2)).set_status(Booking.STATUS_EXPIRED)
+        self.book((2, 3)).set_status(Booking.STATUS_CANCELLED)
+        self.book((3, 4))
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.delete(f'/api/bookings/{self.book((4, 5)).pk}/').status_code, 204)
+
+        self.assertEqual(self.counters(), {'total': 4, 'confirmed': 1, 'pending': 1, 'expired': 1, 'revenue': 100})
+        self.assertIn('consistent', self.rebuild('--verify'))
+
+    def test_rebuild_matches_the_maintained_counters(self):
+        self.book((0, 1)).set_status(Booking.STATUS_CONFIRMED)
+        self.book((1, 2))
+        maintained = rollups.stored()
+
+        StationBookingStats.objects.update(total=0, revenue=0)
+        self.assertIn('1 mismatched rows', self.rebuild('--verify'))
+        self.rebuild()
+        self.assertEqual(rollups.stored(), maintained)
+
+
+@override_settings(TIME_ZONE='Asia/Kolkata')
+class TimeseriesTests(BookingTestCase):
+    # UTC+05:30: local hours start at half past the UTC hour
+
+    def book_at(self, created_at, hours, status=None):
+        with mock.patch('django.utils.timezone.now', return_value=created_at):
+            booking = self.book(hours)
+        if status:
+            # The expiry check runs against the database clock
+            Booking.objects.filter(pk=booking.pk).update(expires_at=timezone.now() + timedelta(minutes=5))
+            self.assertTrue(booking.set_status(status))
+
+    def hourly(self):
+        return {
+            timezone.localtime(row.hour).strftime('%d %H:%M'): (row.bookings, row.confirmed)
+            for row in StationHourlyStats.objects.filter(station=self.station)
+        }
+
+    def test_buckets_follow_local_hours_and_days(self):
+        midnight = datetime(2026, 3, 1, 18, 30, tzinfo=dt_timezone.utc)
+        self.book_at(midnight - timedelta(minutes=40), (0, 1))
+        self.book_at(midnight - timedelta(minutes=10), (1, 2), Booking.STATUS_CONFIRMED)
+        self.book_at(midnight + timedelta(minutes=10), (2, 3))
+
+        self.assertEqual(self.hourly(), {'01 23:00': (2, 1), '02 00:00': (1, 0)})
+
+        day = timeseries.local_day_start(datetime(2026, 3, 1).date())
+        days = timeseries.series([self.station.pk], day, day + timedelta(days=2), 'day', ['bookings'])[self.station.pk]
+        self.assertEqual([timezone.localtime(t).day for t in days['t']], [1, 2])
+        self.assertEqual(days['bookings'], [2, 1])
+
+    def test_rebuild_matches_the_maintained_buckets(self):
+        midnight = datetime(2026, 3, 1, 18, 30, tzinfo=dt_timezone.utc)
+        for minutes, hours in ((-50, (0, 1)), (-5, (1, 2)), (5, (2, 3))):
+            self.book_at(midnight + timedelta(minutes=minutes), hours, Booking.STATUS_CONFIRMED)
+        maintained = self.hourly()
+
+        timeseries.rebuild()
+        self.assertEqual(self.hourly(), maintained)
+
+
+class BookingEventTests(EventsMixin, BookingTestCase):
+
+    def test_status_changes_reach_the_user_only(self):
+        mine = self.subscribe(events.channel(self.user.pk))
+        other = self.subscribe(events.channel(self.owner.pk))
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = self.book()
+            Payment.open(booking, amount=booking.amount, status=Payment.STATUS_CREATED)
+            booking.set_status(Booking.STATUS_CONFIRMED)
+
+        received = [(event.type, json.loads(event.data)) for event in self.received(mine)]
+        self.assertEqual(
+            [(type, data['status'], data['old_status']) for type, data in received],
+            [('booking', Booking.STATUS_PENDING, None), ('payment', Payment.STATUS_CREATED, None),
+             ('booking', Booking.STATUS_CONFIRMED, Booking.STATUS_PENDING)],
+        )
+        self.assertEqual({data['id'] for type, data in received if type == 'booking'}, {str(booking.pk)})
+        self.assertEqual(self.received(other), [])
+
+    def test_nothing_is_published_before_commit(self):
+        mine = self.subscribe(events.channel(self.user.pk))
+        with self.captureOnCommitCallbacks(execute=False):
+            self.book()
+        self.assertEqual(self.received(mine), [])
+
+
+class StationCacheTests(SharedCacheMixin, BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.client = APIClient()
+
+    def detail(self):
+        return self.client.get(f'/api/stations/{self.station.pk}/')
+
+    def test_booking_in_the_current_slot_refreshes_the_quote(self):
+        before = self.detail()
+        self.start = timezone.now() - timedelta(minutes=5)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book()
+
+        after = self.detail()
+        self.assertEqual(after['X-Cache'], 'MISS')
+        self.assertNotEqual(after['ETag'], before['ETag'])
+
+    def test_later_booking_keeps_the_cache(self):
+        before = self.detail()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book()
+        self.assertEqual(self.detail()['ETag'], before['ETag'])
+
+
+class MyBookingsValidatorTests(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def my_bookings(self, **headers):
+        return self.client.get('/api/bookings/my-bookings/', **headers)
+
+    def test_lapsed_booking_changes_the_etag(self):
+        booking = self.book()
+        response = self.my_bookings()
+        self.assertNotIn('Last-Modified', response)
+        self.assertEqual(self.my_bookings(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        # Expires without a write: reported as EXPIRED from now on
+        Booking.objects.filter(pk=booking.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+        stale = self.my_bookings(HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(stale.json()['results'][0]['status'], Booking.STATUS_EXPIRED)
+
+    def test_deleted_booking_changes_the_etag(self):
+        self.book()
+        kept = self.book((2, 3))
+        etag = self.my_bookings()['ETag']
+        Booking.objects.exclude(pk=kept.pk).delete()
+        self.assertEqual(self.my_bookings(HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class AsyncMyBookingsTests(AsyncRoutesMixin, BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.book()
+        self.book((2, 3))
+        self.client = APIClient()
+
+    def login(self, user):
+        self.token = str(UserRefreshToken.for_user(user).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_matches_the_drf_view(self):
+        for user, query in ((self.user, ''), (self.user, '?page_size=1'), (self.owner, '')):
+            with self.subTest(user=user.username, query=query):
+                self.login(user)
+                path = f'/api/bookings/my-bookings/{query}'
+                drf, native = self.client.get(path), self.asgi('get', path)
+                self.assertEqual(native.status_code, drf.status_code)
+                self.assertEqual(native.json(), drf.json())
+                if drf.status_code == 200:
+                    self.assertEqual(native['ETag'], drf['ETag'])
+
+    def test_anonymous(self):
+        drf, native = self.client.get('/api/bookings/my-bookings/'), self.asgi('get', '/api/bookings/my-bookings/')
+        self.assertEqual((native.status_code, native.json()), (drf.status_code, drf.json()))
+
+
+class PaymentViewTests(BookingTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_confirm_payment(self):
+        booking = self.book()
+        payment = Payment.open(booking, amount=booking.amount, status=Payment.STATUS_CREATED)
+
+        response = self.client.post(f'/api/payments/{payment.pk}/confirm/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, Booking.STATUS_CONFIRMED)
+
+        # Paying again neither re-confirms nor counts twice
+        self.assertEqual(self.client.post(f'/api/payments/{payment.pk}/confirm/').status_code, 400)
+        self.assertEqual(self.stats().confirmed, 1)
+
+    def test_fake_pay_after_expiry(self):
+        booking = self.book()
+        Booking.objects.filter(pk=booking.pk).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        response = self.client.post(f'/api/bookings/{booking.pk}/fake-pay/', {'confirm': True}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Booking.objects.get(pk=booking.pk).status, Booking.STATUS_EXPIRED)
+        self.assertEqual(self.stats().confirmed, 0)
+
+
+class ReplicaRoutingTests(ReplicaDatabaseMixin, SharedCacheMixin, TransactionTestCase):
+    # Not TestCase: its wrapping transaction would keep every read on the primary
+
+    def setUp(self):
+        super().setUp()
+        self.owner = Users.objects.create_user(username='owner', email='owner@example.com', password='pw', role='chargerowner')
+        self.user = Users.objects.create_user(username='ev', email='ev@example.com', password='pw')
+        self.station = Station.objects.create(owner=self.owner, name='Hub', latitude=12.97, longitude=77.59)
+        start = (timezone.now() + timedelta(days=1)).replace(minute=0, second=0, microsecond=0)
+        self.booking = reserve(self.user, self.station.pk, start, start + timedelta(hours=1), amount=100)
+        # Forget the fresh-change marks that send station reads to the primary
+        cache.clear()
+        self.client = APIClient()
+
+    def station_names(self):
+        return [station['name'] for station in self.client.get('/api/stations/').json()['results']]
+
+    def my_bookings(self):
+        return self.client.get('/api/bookings/my-bookings/').json()['results']
+
+    def test_safe_reads_go_to_the_replica(self):
+        # The replica is empty; the primary has the station
+        self.assertEqual(self.station_names(), [])
+        self.assertEqual(self.client.get(f'/api/stations/{self.station.pk}/').status_code, 404)
+
+    def test_writes_stay_on_the_primary(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.post('/api/stations/', {'name': 'New', 'latitude': 13.0, 'longitude': 77.6}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Station.objects.using('default').filter(name='New').exists())
+        self.assertFalse(Station.objects.using(self.replica).exists())
+
+    def test_reads_inside_a_transaction_stay_on_the_primary(self):
+        request = RequestFactory().get('/api/stations/')
+        request.resolver_match = resolve('/api/stations/')
+        request.user = AnonymousUser()
+
+        def view(request):
+            routed = [router.db_for_read(Station)]
+            with transaction.atomic():
+                routed.append(router.db_for_read(Station))
+            return routed
+
+        self.assertEqual(ReplicaRoutingMiddleware(view)(request), [self.replica, 'default'])
+
+    def test_my_bookings_after_fake_pay_reads_the_primary(self):
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.my_bookings(), [])
+
+        response = self.client.post(f'/api/bookings/{self.booking.pk}/fake-pay/', {'confirm': True}, format='json')
+        self.assertEqual(response.status_code, 200)
+        [booking] = self.my_bookings()
+        self.assertEqual(booking['status'], Booking.STATUS_CONFIRMED)
+
+        # Other users are not pinned
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.station_names(), [])
+
+    def test_per_process_pin_cache_reads_the_primary(self):
+        # A pin in one worker's locmem would not reach the next request's worker
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            self.assertEqual(self.station_names(), ['Hub'])
@@ -0,0 +1,154 @@
+from collections import defaultdict
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDay, TruncHour, TruncMonth
+from django.utils import timezone
+
+from .models import Booking, Payment, StationHourlyStats
+from .rollups import upsert_counters
+
+METRICS = ("bookings", "confirmed", "expired", "cancelled", "revenue", "payments_paid", "payments_failed")
+
+BOOKING_STATUS_METRICS = {
+    Booking.STATUS_CONFIRMED: "confirmed",
+    Booking.STATUS_EXPIRED: "expired",
+    Booking.STATUS_CANCELLED: "cancelled",
+}
+PAYMENT_STATUS_METRICS = {
+    Payment.STATUS_PAID: "payments_paid",
+    Payment.STATUS_FAILED: "payments_failed",
+}
+
+GRANULARITIES = {
+    "hour": TruncHour,
+    "day": TruncDay,
+    "month": TruncMonth,
+}
+
+
+def bucket(value):
+    """
+    Start of the local hour containing `value`.
+    """
+    return timezone.localtime(value).replace(minute=0, second=0, microsecond=0)
+
+
+def _empty():
+    return {name: 0 for name in METRICS}
+
+
+def _apply(deltas):
+    with transaction.atomic():
+        # Stable order so concurrent writers lock rows in the same sequence
+        for (station_id, hour), delta in sorted(deltas.items()):
+            upsert_counters(StationHourlyStats, {"station_id": station_id, "hour": hour}, delta)
+
+
+def bookings_changed(sender, changes, **kwargs):
+    deltas = defaultdict(_empty)
+    for change in changes:
+        delta = deltas[(change.station_id, bucket(change.created_at))]
+        if change.old_status is None:
+            delta["bookings"] += 1
+        if change.new_status is None:
+            delta["bookings"] -= 1
+        if change.old_status in BOOKING_STATUS_METRICS:
+            delta[BOOKING_STATUS_METRICS[change.old_status]] -= 1
+        if change.new_status in BOOKING_STATUS_METRICS:
+            delta[BOOKING_STATUS_METRICS[change.new_status]] += 1
+
+        amount = change.amount or Decimal("0")
+        if change.old_status == Booking.STATUS_CONFIRMED:
+            delta["revenue"] -= amount
+        if change.new_status == Booking.STATUS_CONFIRMED:
+            delta["revenue"] += amount
+    _apply(deltas)
+
+
+def payments_changed(sender, changes, **kwargs):
+    deltas = defaultdict(_empty)
+    for change in changes:
+        delta = deltas[(change.station_id, bucket(change.created_at))]
+        if change.old_status in PAYMENT_STATUS_METRICS:
+            delta[PAYMENT_STATUS_METRICS[change.old_status]] -= 1
+        if change.new_status in PAYMENT_STATUS_METRICS:
+            delta[PAYMENT_STATUS_METRICS[change.new_status]] += 1
+    _apply(deltas)
+
+
+def series(station_ids, start, end, granularity, metrics):
+    """
+    Columnar series for each station over [start, end):
+    {station_id: {"t": [...], metric: [...], ...}}. Day and month
+    buckets are summed from the hourly rows in the local time zone.
+    """
+    trunc = GRANULARITIES[granularity]
+    rows = (
+        StationHourlyStats.objects
+        .filter(station_id__in=station_ids, hour__gte=start, hour__lt=end)
+        .annotate(t=trunc("hour", tzinfo=timezone.get_current_timezone()))
+        .values("station_id", "t")
+        .annotate(**{metric: Sum(metric) for metric in metrics})
+        .order_by("station_id", "t")
+    )
+
+    result = {station_id: {"t": [], **{metric: [] for metric in metrics}} for station_id in station_ids}
+    for row in rows:
+        columns = result[row["station_id"]]
+        columns["t"].append(row["t"])
+        for metric in metrics:
+            columns[metric].append(row[metric])
+    return result
+
+
+def local_day_start(day):
+    return timezone.make_aware(datetime.combine(day, time()))
+
+
+def rebuild(batch_size=1000):
+    """
+    Recompute every hourly bucket from the bookings and payments tables.
+    """
+    tz = timezone.get_current_timezone()
+    buckets = defaultdict(_empty)
+
+    booking_rows = (
+        Booking.objects.order_by()
+        .annotate(h=TruncHour("created_at", tzinfo=tz))
+        .values("station_id", "h")
+        .annotate(
+            bookings=Count("id"),
+            confirmed=Count("id", filter=Q(status=Booking.STATUS_CONFIRMED)),
+            expired=Count("id", filter=Q(status=Booking.STATUS_EXPIRED)),
+            cancelled=Count("id", filter=Q(status=Booking.STATUS_CANCELLED)),
+            revenue=Sum("amount", filter=Q(status=Booking.STATUS_CONFIRMED)),
+        )
+    )
+    for row in booking_rows:
+        counters = buckets[(row.pop("station_id"), row.pop("h"))]
+        for name, value in row.items():
+            counters[name] = value or 0
+
+    payment_rows = (
+        Payment.objects.order_by()
+        .annotate(h=TruncHour("created_at", tzinfo=tz))
+        .values("booking__station_id", "h")
+        .annotate(
+            payments_paid=Count("id", filter=Q(status=Payment.STATUS_PAID)),
+            payments_failed=Count("id", filter=Q(status=Payment.STATUS_FAILED)),
+        )
+    )
+    for row in payment_rows:
+        counters = buckets[(row.pop("booking__station_id"), row.pop("h"))]
+        counters.update(row)
+
+    with transaction.atomic():
+        StationHourlyStats.objects.all().delete()
+        StationHourlyStats.objects.bulk_create(
+            [StationHourlyStats(station_id=station_id, hour=hour, **counters) for (station_id, hour), counters in buckets.items()],
+            batch_size=batch_size,
+        )
+    return len(buckets)
@@ -1,6 +1,6 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path, include
-from .views import  BookingViewSet, PaymentViewSet,OwnerStationSummaryView,StationBookingList
+from .views import  BookingViewSet, PaymentViewSet,OwnerStationSummaryView,StationBookingList,StationAvailabilityView,StationTimeSeriesView
 
 router = DefaultRouter()
 # router.register(r"stations", StationViewSet, basename="station")
@@ -12,6 +12,8 @@ urlpatterns = [
     path("", include(router.urls)),
     path("summary/", OwnerStationSummaryView.as_view(), name="owner-station-summary"),
     path("bookings/stations/<int:station_id>/", StationBookingList.as_view()),
+    path("availability/", StationAvailabilityView.as_view(), name="station-availability"),
+    path("timeseries/", StationTimeSeriesView.as_view(), name="station-timeseries"),
 
 
 ]
@@ -9,12 +9,47 @@ from django.utils import timezone
 from .models import Booking
 from .serializers import BookingSerializer
 from .permissions import IsEvUser
+from .reservations import reserve
+from stations import pricing
+from .signals import change_for, send_changes
+from django.db import transaction
 from .models import Payment
+from evfinder.pagination import BookingPagination, PaymentPagination
+from evfinder.conditional import conditional_response, make_etag
+from django.db.models import Count, Max, Q
+from django.db.models.functions import Now
+
+
+def list_validators(request, qs, **extra):
+    """
+    ETag for a list from one aggregate over its rows: any insert, update
+    or delete changes the count or MAX(updated_at), and `extra` covers
+    changes made without a write.
+
+    No Last-Modified: a deleted row or a PENDING booking lapsing to
+    EXPIRED (with_current_status) changes the list without raising
+    MAX(updated_at), so If-Modified-Since alone would get a stale 304.
+    """
+    stats = qs.order_by().aggregate(last=Max("updated_at"), count=Count("id"), **extra)
+    return make_etag(request.user.pk, request.get_full_path(), sorted(stats.items()))
+
+
+async def alist_validators(request, qs, **extra):
+    stats = await qs.order_by().aaggregate(last=Max("updated_at"), count=Count("id"), **extra)
+    return make_etag(request.user.pk, request.get_full_path(), sorted(stats.items()))
 
 
 class BookingViewSet(viewsets.ModelViewSet):
-    queryset = Booking.objects.select_related("station", "user").all().order_by("-created_at")
+    queryset = Booking.objects.select_related("station", "user").with_current_status().order_by("-created_at")
     serializer_class = BookingSerializer
+    pagination_class = BookingPagination
+    replica_reads = True
+
+    # Rows past expires_at change their reported status without a write,
+    # so my-bookings' validators count them too
+    MY_BOOKINGS_EXTRA = {
+        "lazily_expired": Count("id", filter=Q(status=Booking.STATUS_PENDING, expires_at__lte=Now())),
+    }
 
     def get_permissions(self):
         if self.action in ("create", "fake_pay", "my_bookings"):
@@ -22,7 +57,22 @@ class BookingViewSet(viewsets.ModelViewSet):
         return [IsAuthenticated()]
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        data = serializer.validated_data
+        # Charged at the server-side time-of-use quote, never the client's figure
+        amount = pricing.quote_booking(data["station"], data["start_at"], data["end_at"])
+        serializer.instance = reserve(
+            self.request.user,
+            data["station"].pk,
+            data["start_at"],
+            data["end_at"],
+            amount=amount,
+        )
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        change = change_for(instance, instance.status, None)
+        instance.delete()
+        send_changes([change])
 
     def get_queryset(self):
         user = self.request.user
@@ -55,8 +105,8 @@ class BookingViewSet(viewsets.ModelViewSet):
 
         fake_order_id = f"fake_order_{uuid.uuid4().hex[:12]}"
 
-        payment = Payment.objects.create(
-            booking=booking,
+        payment = Payment.open(
+            booking,
             amount=booking.amount,
             gateway_order_id=fake_order_id,
             status=Payment.STATUS_CREATED
@@ -65,12 +115,12 @@ class BookingViewSet(viewsets.ModelViewSet):
         confirm = request.data.get("confirm", False)
 
         if str(confirm).lower() in ("true", "1"):
-            payment.gateway_payment_id = f"fake_pay_{uuid.uuid4().hex[:12]}"
-            payment.status = Payment.STATUS_PAID
-            payment.save()
-
-            booking.status = Booking.STATUS_CONFIRMED
-            booking.save(update_fields=["status"])
+            with transaction.atomic():
+                if not booking.set_status(Booking.STATUS_CONFIRMED):
+                    payment.set_status(Payment.STATUS_FAILED)
+                    return Response({"detail": "Booking expired or changed meanwhile."}, status=409)
+                payment.gateway_payment_id = f"fake_pay_{uuid.uuid4().hex[:12]}"
+                payment.set_status(Payment.STATUS_PAID)
 
             return Response({
                 "payment_order_id": payment.gateway_order_id,
@@ -87,12 +137,16 @@ class BookingViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=["GET"], url_path="my-bookings")
     def my_bookings(self, request):
+        # Expiry is handled by the booking expiry sweep; this read never writes
         qs = self.get_queryset().filter(user=request.user)
-        for b in qs:
-            b.mark_expired_if_needed()
+        etag = list_validators(request, qs, **self.MY_BOOKINGS_EXTRA)
+
+        def build():
+            page = self.paginate_queryset(qs)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
 
-        serializer = self.get_serializer(qs, many=True)
-        return Response(serializer.data)
+        return conditional_response(request, etag, None, build)
  
 
 from rest_framework import viewsets, status
@@ -112,13 +166,22 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaymentPagination
 
 
     def get_queryset(self):
         user = self.request.user
+        payments = Payment.objects.select_related("booking__station", "booking__user")
         if user.role == "owner":
-            return Payment.objects.all()
-        return Payment.objects.filter(booking__user=user)
+            return payments
+        return payments.filter(booking__user=user)
+
+    def list(self, request, *args, **kwargs):
+        qs = self.filter_queryset(self.get_queryset())
+        etag = list_validators(request, qs)
+        return conditional_response(
+            request, etag, None, lambda: super(PaymentViewSet, self).list(request, *args, **kwargs)
+        )
     
     @action(detail=False, methods=["POST"], url_path="create")
     def create_payment(self, request):
@@ -132,8 +195,8 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
 
         fake_order_id = f"fake_order_{uuid.uuid4().hex[:10]}"
 
-        payment = Payment.objects.create(
-            booking=booking,
+        payment = Payment.open(
+            booking,
             amount=booking.amount,
             gateway_order_id=fake_order_id,
             status=Payment.STATUS_CREATED
@@ -153,16 +216,19 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
 
         booking.mark_expired_if_needed()
         if booking.status == Booking.STATUS_EXPIRED:
-            payment.status = Payment.STATUS_FAILED
-            payment.save()
+            payment.set_status(Payment.STATUS_FAILED)
             return Response({"detail": "Booking expired. Payment failed."}, status=400)
 
-        payment.gateway_payment_id = f"fake_pay_{uuid.uuid4().hex[:10]}"
-        payment.status = Payment.STATUS_PAID
-        payment.save()
+        if booking.status == Booking.STATUS_CONFIRMED:
+            return Response({"detail": "Already paid & confirmed."}, status=400)
 
-        booking.status = Booking.STATUS_CONFIRMED
-        booking.save()
+        with transaction.atomic():
+            # Confirm first: a lost race must not leave a PAID payment
+            if not booking.set_status(Booking.STATUS_CONFIRMED):
+                payment.set_status(Payment.STATUS_FAILED)
+                return Response({"detail": "Booking expired or changed meanwhile. Payment failed."}, status=409)
+            payment.gateway_payment_id = f"fake_pay_{uuid.uuid4().hex[:10]}"
+            payment.set_status(Payment.STATUS_PAID)
 
         return Response({
             "detail": "Payment Success",
@@ -175,13 +241,16 @@ class PaymentViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 
-from django.db.models import Count, Sum, Q
+from datetime import date
+from django.db.models import Count, F, Sum, Q
 from rest_framework.views import APIView
+from .models import StationBookingStats, StationDailyBookingStats
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 
 class OwnerStationSummaryView(APIView):
     permission_classes = [IsAuthenticated]
+    replica_reads = True
 
     def get(self, request):
         user = request.user
@@ -189,17 +258,51 @@ class OwnerStationSummaryView(APIView):
         if user.role != "chargerowner":
             return Response({"detail": "Not allowed"}, status=403)
 
+        date_from = request.query_params.get("from")
+        date_to = request.query_params.get("to")
+
+        # All-time → one counter row per station
+        if not date_from and not date_to:
+            data = (
+                StationBookingStats.objects
+                .filter(station__owner=user, total__gt=0)
+                .values("station__id", "station__name")
+                .annotate(
+                    total_bookings=F("total"),
+                    paid_bookings=F("confirmed"),
+                    pending_bookings=F("pending"),
+                    expired_bookings=F("expired"),
+                    total_revenue=F("revenue"),
+                )
+                .values(
+                    "station__id", "station__name", "total_bookings", "paid_bookings",
+                    "pending_bookings", "expired_bookings", "total_revenue",
+                )
+                .order_by("-total_bookings")
+            )
+            return Response(data)
+
+        # Date range → sum the per-day buckets
+        days = StationDailyBookingStats.objects.filter(station__owner=user)
+        try:
+            if date_from:
+                days = days.filter(day__gte=date.fromisoformat(date_from))
+            if date_to:
+                days = days.filter(day__lte=date.fromisoformat(date_to))
+        except ValueError:
+            return Response({"detail": "from/to must be YYYY-MM-DD"}, status=400)
+
         data = (
-            Booking.objects
-            .filter(station__owner=user)
+            days
             .values("station__id", "station__name")
             .annotate(
-                total_bookings=Count("id"),
-                paid_bookings=Count("id", filter=Q(status="CONFIRMED")),
-                pending_bookings=Count("id", filter=Q(status="PENDING")),
-                expired_bookings=Count("id", filter=Q(status="EXPIRED")),
-                total_revenue=Sum("amount", filter=Q(status="CONFIRMED"))
+                total_bookings=Sum("total"),
+                paid_bookings=Sum("confirmed"),
+                pending_bookings=Sum("pending"),
+                expired_bookings=Sum("expired"),
+                total_revenue=Sum("revenue"),
             )
+            .filter(total_bookings__gt=0)
             .order_by("-total_bookings")
         )
 
@@ -217,7 +320,147 @@ class StationBookingList(APIView):
         if user.role != "chargerowner":
             return Response({"detail": "Not allowed"}, status=403)
 
-        qs = Booking.objects.filter(station__id=station_id, station__owner=user)
+        qs = (
+            Booking.objects
+            .filter(station__id=station_id, station__owner=user)
+            .select_related("station", "user")
+            .with_current_status()
+        )
+
+        paginator = BookingPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        serializer = BookingSerializer(page, many=True, context={"request": request})
+        return paginator.get_paginated_response(serializer.data)
+
+
+from datetime import timedelta
+from django.utils.dateparse import parse_datetime
+from rest_framework.permissions import AllowAny
+from .availability import free_windows
+
+
+class StationAvailabilityView(APIView):
+    """
+    Free charging windows for up to MAX_STATIONS stations in one call,
+    answered from the per-day occupancy index instead of booking rows.
+    """
+    permission_classes = [AllowAny]
+
+    MAX_STATIONS = 50
+    DEFAULT_HOURS = 6
+    MAX_HOURS = 48
+
+    def get(self, request):
+        raw_ids = request.query_params.get("stations", "")
+        ids = [int(pk) for pk in raw_ids.split(",") if pk.strip().isdigit()]
+
+        if not ids:
+            return Response({"detail": "stations is required (comma separated ids)"}, status=400)
+
+        if len(ids) > self.MAX_STATIONS:
+            return Response({"detail": f"At most {self.MAX_STATIONS} stations per request"}, status=400)
+
+        start = request.query_params.get("start")
+        start_at = parse_datetime(start) if start else timezone.now()
+        if start_at is None:
+            return Response({"detail": "start must be an ISO 8601 datetime"}, status=400)
+        if timezone.is_naive(start_at):
+            start_at = timezone.make_aware(start_at)
+
+        try:
+            hours = float(request.query_params.get("hours", self.DEFAULT_HOURS))
+        except ValueError:
+            return Response({"detail": "hours must be numeric"}, status=400)
+        hours = max(0.25, min(hours, self.MAX_HOURS))
+        end_at = start_at + timedelta(hours=hours)
+
+        windows = free_windows(ids, start_at, end_at)
+
+        return Response({
+            "start": start_at,
+            "end": end_at,
+            "stations": {
+                station_id: {
+                    "connectors": info["connectors"],
+                    "free": [{"start": s, "end": e} for s, e in info["free"]],
+                }
+                for station_id, info in windows.items()
+            },
+        })
+
+
+from . import timeseries
+from stations.models import Station
+
+
+class StationTimeSeriesView(APIView):
+    """
+    Revenue/booking/payment series for several stations and date ranges
+    in one call, summed from the hourly rollups and returned as columns.
+
+    ?stations=1,2&granularity=hour|day|month&ranges=2025-01-01/2025-01-31,...
+    &metrics=revenue,bookings
+    """
+    permission_classes = [IsAuthenticated]
+    replica_reads = True
+
+    MAX_STATIONS = 50
+    MAX_RANGES = 5
+    MAX_HOURLY_DAYS = 31
+
+    def get(self, request):
+        user = request.user
+        is_admin = user.is_staff or user.role == "admin"
+
+        if user.role != "chargerowner" and not is_admin:
+            return Response({"detail": "Not allowed"}, status=403)
 
-        serializer = BookingSerializer(qs, many=True, context={"request": request})
-        return Response(serializer.data)
+        ids = [int(pk) for pk in request.query_params.get("stations", "").split(",") if pk.strip().isdigit()]
+        if not ids:
+            return Response({"detail": "stations is required (comma separated ids)"}, status=400)
+        if len(ids) > self.MAX_STATIONS:
+            return Response({"detail": f"At most {self.MAX_STATIONS} stations per request"}, status=400)
+
+        granularity = request.query_params.get("granularity", "day")
+        if granularity not in timeseries.GRANULARITIES:
+            return Response({"detail": "granularity must be hour, day or month"}, status=400)
+
+        metrics = [m for m in request.query_params.get("metrics", "").split(",") if m] or list(timeseries.METRICS)
+        unknown = set(metrics) - set(timeseries.METRICS)
+        if unknown:
+            return Response({"detail": f"Unknown metrics: {', '.join(sorted(unknown))}"}, status=400)
+
+        ranges = []
+        for item in request.query_params.get("ranges", "").split(","):
+            if not item:
+                continue
+            try:
+                first, last = (date.fromisoformat(part) for part in item.split("/"))
+            except ValueError:
+                return Response({"detail": "ranges must be YYYY-MM-DD/YYYY-MM-DD pairs"}, status=400)
+            if last < first:
+                return Response({"detail": f"Range {item} ends before it starts"}, status=400)
+            if granularity == "hour" and (last - first).days >= self.MAX_HOURLY_DAYS:
+                return Response({"detail": f"Hourly ranges are limited to {self.MAX_HOURLY_DAYS} days"}, status=400)
+            ranges.append((first, last))
+
+        if not ranges:
+            today = timezone.localdate()
+            ranges = [(today - timedelta(days=29), today)]
+        if len(ranges) > self.MAX_RANGES:
+            return Response({"detail": f"At most {self.MAX_RANGES} ranges per request"}, status=400)
+
+        stations = Station.objects.filter(pk__in=ids)
+        if not is_admin:
+            stations = stations.filter(owner=user)
+        allowed = list(stations.values_list("id", flat=True))
+
+        result = []
+        for first, last in ranges:
+            start = timeseries.local_day_start(first)
+            end = timeseries.local_day_start(last + timedelta(days=1))
+            data = timeseries.series(allowed, start, end, granularity, metrics)
+            for station_id in allowed:
+                result.append({"station": station_id, "from": first, "to": last, **data[station_id]})
+
+        return Response({"granularity": granularity, "metrics": metrics, "series": result})
@@ -12,5 +12,19 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'evfinder.settings')
+# Async views for the hot read paths; everything else as under WSGI
+os.environ.setdefault('DJANGO_ROOT_URLCONF', 'evfinder.asgi_urls')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from evfinder import scheduler, streams  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # Django serves HTTP; the event stream also accepts WebSockets
+    if scope['type'] == 'websocket':
+        return await streams.websocket(scope, receive, send)
+    return await django_application(scope, receive, send)
+
+
+scheduler.start()
@@ -0,0 +1,25 @@
+"""
+URLconf for the ASGI deployment (see evfinder/asgi.py).
+
+The async read endpoints take their paths ahead of evfinder.urls, which
+serves everything else; each one hands non-GET methods on its path to
+the DRF view that owns it. Names match the DRF routes, so metrics label
+both deployments alike.
+"""
+from django.urls import include, path
+
+from booking import async_views as booking_views
+from evfinder import streams
+from stations import async_views as station_views
+from users import async_views as user_views
+
+urlpatterns = [
+    path('api/stations/', station_views.station_list, name='station-list'),
+    path('api/stations/nearby/', station_views.station_nearby, name='station-nearby'),
+    path('api/stations/<int:pk>/', station_views.station_detail, name='station-detail'),
+    path('api/bookings/my-bookings/', booking_views.my_bookings, name='booking-my-bookings'),
+    path('api/signup-send-otp/', user_views.signup_send_otp, name='signup-send-otp'),
+    path('api/send-otp/', user_views.send_otp, name='send_otp'),
+    path('api/events/', streams.event_stream, name='events'),
+    path('', include('evfinder.urls')),
+]
@@ -0,0 +1,113 @@
+"""
+Building blocks for native async API views.
+
+DRF views are synchronous, so the async endpoints are plain Django
+async views. They reuse the DRF pieces that do no I/O (Request parsing,
+permissions, serializers, the JSON renderer) and await everything that
+does: authentication, the cache and the ORM.
+
+`read_view` puts an async GET/HEAD handler in front of the DRF view for
+the same path; other methods go to the DRF view, so a URL keeps its
+full behaviour. The DRF view's class and actions are kept on the
+wrapper, so its flags (e.g. `replica_reads`) still apply and metrics
+label it like the DRF view.
+"""
+import functools
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+_renderer = JSONRenderer()
+
+
+def render(data, status=200):
+    return HttpResponse(_renderer.render(data), status=status, content_type='application/json')
+
+
+def error_response(exc):
+    if isinstance(exc.detail, (list, dict)):
+        data = exc.detail
+    else:
+        data = {'detail': exc.detail}
+    response = render(data, status=exc.status_code)
+    if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+        response['WWW-Authenticate'] = 'Bearer realm="api"'
+    wait = getattr(exc, 'wait', None)
+    if wait:
+        response['Retry-After'] = '%d' % wait
+    return response
+
+
+async def authenticate(request):
+    """
+    Wrap `request` as a DRF Request and authenticate it through the
+    configured authenticators' `aauthenticate`. Raises
+    AuthenticationFailed like DRF does.
+    """
+    drf_request = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES])
+    for authenticator_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        result = await authenticator_class().aauthenticate(drf_request)
+        if result is not None:
+            drf_request.user, drf_request.auth = result
+            return drf_request
+    drf_request.user, drf_request.auth = AnonymousUser(), None
+    return drf_request
+
+
+def check_permissions(request, permissions, view=None):
+    for permission in permissions:
+        if not permission.has_permission(request, view):
+            if not request.user.is_authenticated:
+                raise exceptions.NotAuthenticated()
+            raise exceptions.PermissionDenied(getattr(permission, 'message', None))
+
+
+async def check_throttles(request, throttles, view=None):
+    waits = []
+    for throttle in throttles:
+        # Throttle state lives in the (sync) cache API
+        if not await sync_to_async(throttle.allow_request)(request, view):
+            waits.append(throttle.wait())
+    if waits:
+        raise exceptions.Throttled(max((wait for wait in waits if wait is not None), default=None))
+
+
+def _async_view(handler, methods, fallback=None):
+    @functools.wraps(handler)
+    async def view(request, *args, **kwargs):
+        if request.method not in methods:
+            if fallback is not None:
+                return await sync_to_async(fallback)(request, *args, **kwargs)
+            return error_response(exceptions.MethodNotAllowed(request.method))
+        try:
+            return await handler(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return error_response(exc)
+
+    # Token-authenticated API, like every DRF view
+    view.csrf_exempt = True
+    if fallback is not None:
+        view.cls = getattr(fallback, 'cls', None)
+        view.actions = getattr(fallback, 'actions', None)
+    return view
+
+
+def read_view(fallback):
+    """
+    Serve GET/HEAD with the decorated coroutine and every other method
+    with the DRF view `fallback`.
+    """
+    def decorator(handler):
+        return _async_view(handler, ('GET', 'HEAD'), fallback)
+    return decorator
+
+
+def api_view(methods):
+    def decorator(handler):
+        return _async_view(handler, tuple(methods))
+    return decorator
@@ -0,0 +1,17 @@
+"""
+Cache helpers for features whose correctness depends on every worker
+process seeing the same cache (version counters, invalidation records).
+"""
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+PROCESS_LOCAL_BACKENDS = (LocMemCache, DummyCache)
+
+
+def is_shared(alias):
+    """
+    Whether the cache `alias` is shared between processes (Redis,
+    Memcached, the database or file cache) rather than private to this one.
+    """
+    return not isinstance(caches[alias], PROCESS_LOCAL_BACKENDS)
@@ -0,0 +1,71 @@
+"""
+Conditional GET helpers (ETag / Last-Modified).
+
+Views compute cheap validators first (version counters or one indexed
+aggregate) and only build the real response when the client's copy is
+stale, so a 304 never runs the serializer or fetches full rows.
+"""
+import hashlib
+from datetime import datetime
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+
+
+def make_etag(*parts):
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def _timestamp(last_modified):
+    if last_modified is None:
+        return None
+    if isinstance(last_modified, datetime):
+        return int(last_modified.timestamp())
+    return int(last_modified)
+
+
+def conditional_response(request, etag, last_modified, build):
+    """
+    Answer with 304 when `etag`/`last_modified` match the request's
+    If-None-Match/If-Modified-Since, otherwise call `build()` and stamp
+    the validators on its response.
+    """
+    timestamp = _timestamp(last_modified)
+
+    if request.method in ('GET', 'HEAD'):
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is not None:
+            _stamp(response, etag, timestamp)
+            return response
+
+    response = build()
+    if response.status_code == 200:
+        _stamp(response, etag, timestamp)
+    return response
+
+
+async def aconditional_response(request, etag, last_modified, build):
+    """
+    conditional_response() for async views; `build` is a coroutine
+    function.
+    """
+    timestamp = _timestamp(last_modified)
+
+    if request.method in ('GET', 'HEAD'):
+        response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+        if response is not None:
+            _stamp(response, etag, timestamp)
+            return response
+
+    response = await build()
+    if response.status_code == 200:
+        _stamp(response, etag, timestamp)
+    return response
+
+
+def _stamp(response, etag, timestamp):
+    if etag:
+        response['ETag'] = etag
+    if timestamp is not None:
+        response['Last-Modified'] = http_date(timestamp)
@@ -0,0 +1,183 @@
+"""
+Primary/replica database routing.
+
+Writes always go to `default`. Reads go to a replica (DATABASE_REPLICAS)
+only during a safe-method request to a view that sets
+`replica_reads = True`, and only while none of these hold:
+
+- the request has already written, or a transaction is open on the
+  primary;
+- the user wrote within DATABASE_REPLICA_LAG_SECONDS (read-your-writes:
+  ReplicaRoutingMiddleware pins them to the primary after any write);
+- the code runs inside use_primary().
+
+The pins live in DATABASE_PIN_CACHE_ALIAS, which must be shared between
+workers: with a per-process cache (locmem, the default) a user's next
+request could land on a worker that never saw the pin, so replicas are
+only used when evfinder.caching.is_shared() holds for it.
+
+A request sticks to one replica so its reads see one snapshot.
+Management commands, the scheduler and every other view read from the
+primary.
+"""
+import contextlib
+import contextvars
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.functional import SimpleLazyObject, empty
+
+from .caching import is_shared
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_KEY = 'db:pin:{}'
+
+_request_state = contextvars.ContextVar('db_request_state', default=None)
+_force_primary = contextvars.ContextVar('db_force_primary', default=False)
+
+
+def _alias():
+    return getattr(settings, 'DATABASE_PIN_CACHE_ALIAS', 'default')
+
+
+def get_cache():
+    return caches[_alias()]
+
+
+def enabled():
+    return bool(settings.DATABASE_REPLICAS) and is_shared(_alias())
+
+
+def _user(request):
+    # The user DRF authenticated, or None while it is still the lazy
+    # session user (resolving that would cost a query)
+    user = request.__dict__.get('user')
+    if user is None or (isinstance(user, SimpleLazyObject) and user._wrapped is empty):
+        return None
+    return user
+
+
+class RequestState:
+
+    def __init__(self, request):
+        self.request = request
+        self.replica = None
+        self.wrote = False
+        self.pinned = None
+
+    def replica_alias(self):
+        """
+        The replica this request reads from, or None. Decided once the URL
+        has resolved (the view's `replica_reads` flag), then sticky.
+        """
+        if self.replica is None:
+            match = getattr(self.request, 'resolver_match', None)
+            if match is None:
+                return None
+            opted_in = getattr(getattr(match.func, 'cls', None), 'replica_reads', False)
+            if opted_in and self.request.method in SAFE_METHODS and enabled():
+                self.replica = random.choice(settings.DATABASE_REPLICAS)
+            else:
+                self.replica = False
+        return self.replica or None
+
+    def is_pinned(self):
+        if self.pinned is None:
+            user = _user(self.request)
+            if user is None:
+                # Not authenticated yet; decide once we know who it is
+                return True
+            self.pinned = bool(user.is_authenticated and get_cache().get(PIN_KEY.format(user.pk)))
+        return self.pinned
+
+
+@contextlib.contextmanager
+def use_primary():
+    """
+    Read from the primary inside this block, e.g. for data that may have
+    changed more recently than the replicas' lag.
+    """
+    token = _force_primary.set(True)
+    try:
+        yield
+    finally:
+        _force_primary.reset(token)
+
+
+def pin(user):
+    get_cache().set(PIN_KEY.format(user.pk), 1, settings.DATABASE_REPLICA_LAG_SECONDS)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        state = _request_state.get()
+        if state is None or state.wrote or _force_primary.get():
+            return DEFAULT_DB_ALIAS
+        replica = state.replica_alias()
+        if replica is None or connections[DEFAULT_DB_ALIAS].in_atomic_block or state.is_pinned():
+            return DEFAULT_DB_ALIAS
+        return replica
+
+    def db_for_write(self, model, **hints):
+        state = _request_state.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Tracks the request for PrimaryReplicaRouter and pins the user to the
+    primary after a request that wrote. Runs natively under both WSGI
+    and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        state = RequestState(request)
+        token = _request_state.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+        if state.wrote:
+            self._pin(request)
+        return response
+
+    async def __acall__(self, request):
+        state = RequestState(request)
+        token = _request_state.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request_state.reset(token)
+
+        if state.wrote:
+            self._pin(request)
+        return response
+
+    def _pin(self, request):
+        user = _user(request)
+        if user is not None and user.is_authenticated:
+            pin(user)
@@ -0,0 +1,303 @@
+"""
+Publish/subscribe for push notifications (booking, payment and station
+status changes) delivered over Server-Sent Events and WebSockets.
+
+Writers call publish() inside their transaction; events go out once it
+commits. Subscribers are async streams (evfinder.streams) that hold a
+Subscription to a few channels, e.g. 'user:42' or 'station:7'.
+
+Each process fans events out to its own subscribers from one registry,
+so an idle subscriber costs a small object and a parked coroutine, and
+an event is encoded once however many subscribers receive it.
+
+EVENTS_BROKER picks how events reach other processes:
+
+- 'local': they don't. Right for a single ASGI process and for tests.
+- 'cache': through a sequence counter and a short-lived event log in the
+  shared cache (EVENTS_CACHE_ALIAS, e.g. Redis). Any process can publish;
+  each subscribing process runs one poller thread, whatever its number
+  of subscribers.
+"""
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+SEQUENCE_KEY = 'events:seq'
+EVENT_KEY = 'events:{}'
+
+
+class Event:
+    __slots__ = ('id', 'channel', 'type', 'data')
+
+    def __init__(self, id, channel, type, data):
+        self.id = id
+        self.channel = channel
+        self.type = type
+        # Already-encoded JSON, shared by every subscriber
+        self.data = data
+
+    def sse(self):
+        return f'id: {self.id}\nevent: {self.type}\ndata: {self.data}\n\n'
+
+    def json(self):
+        return f'{{"id": {self.id}, "type": {json.dumps(self.type)}, "data": {self.data}}}'
+
+
+class Subscription:
+    """
+    A subscriber's queue of pending events. Owned by one event loop;
+    brokers deliver to it from any thread. When the subscriber falls
+    more than EVENTS_QUEUE_SIZE events behind it is closed with
+    `overflowed` set, and should resync and reconnect.
+    """
+    __slots__ = ('broker', 'channels', 'loop', 'pending', 'waiter', 'closed', 'overflowed', 'maxlen')
+
+    def __init__(self, broker, channels, loop, maxlen):
+        self.broker = broker
+        self.channels = frozenset(channels)
+        self.loop = loop
+        self.pending = deque()
+        self.waiter = None
+        self.closed = False
+        self.overflowed = False
+        self.maxlen = maxlen
+
+    def _push(self, event):
+        # Runs on self.loop
+        if self.closed:
+            return
+        if len(self.pending) >= self.maxlen:
+            self.overflowed = True
+            self.close()
+            return
+        self.pending.append(event)
+        self._wake()
+
+    def _wake(self):
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+    async def get(self, timeout=None):
+        """
+        The next event, or None on timeout or once closed.
+        """
+        if not self.pending and not self.closed:
+            self.waiter = self.loop.create_future()
+            timer = self.loop.call_later(timeout, self._wake) if timeout is not None else None
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+                if timer is not None:
+                    timer.cancel()
+        return self.pending.popleft() if self.pending else None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broker.unsubscribe(self)
+            self._wake()
+
+
+class LocalBroker:
+    """
+    In-process fan-out: events reach the subscribers of this process only.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.channels = defaultdict(set)
+        self.ids = itertools.count(1)
+
+    def subscribe(self, channels, loop):
+        subscription = Subscription(self, channels, loop, settings.EVENTS_QUEUE_SIZE)
+        with self.lock:
+            for channel in subscription.channels:
+                self.channels[channel].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.channels[channel]
+
+    def subscriber_count(self):
+        with self.lock:
+            return len({subscription for subscribers in self.channels.values() for subscription in subscribers})
+
+    def publish(self, messages):
+        """
+        Deliver (channel, type, data) messages; data must be JSON-encodable.
+        """
+        self.dispatch([
+            Event(next(self.ids), channel, type, _encode(data)) for channel, type, data in messages
+        ])
+
+    def dispatch(self, events):
+        by_loop = defaultdict(list)
+        with self.lock:
+            for event in events:
+                for subscription in self.channels.get(event.channel, ()):
+                    by_loop[subscription.loop].append((subscription, event))
+        # One wake-up per event loop, however many subscribers it serves
+        for loop, deliveries in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver, deliveries)
+            except RuntimeError:
+                # Loop closed under a subscriber that never unsubscribed
+                pass
+
+
+def _deliver(deliveries):
+    for subscription, event in deliveries:
+        subscription._push(event)
+
+
+def _encode(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+
+
+class CacheBroker(LocalBroker):
+    """
+    Shares events between processes through the cache: publishing
+    reserves sequence numbers and stores each event under its number for
+    EVENTS_CACHE_TTL seconds; a poller thread per subscribing process
+    reads the new numbers and fans the events out locally.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.poller = None
+        self.stopping = threading.Event()
+
+    def get_cache(self):
+        return caches[getattr(settings, 'EVENTS_CACHE_ALIAS', 'default')]
+
+    def _sequence(self, cache):
+        sequence = cache.get(SEQUENCE_KEY)
+        if sequence is None:
+            cache.add(SEQUENCE_KEY, 0, None)
+            sequence = cache.get(SEQUENCE_KEY, 0)
+        return sequence
+
+    def publish(self, messages):
+        if not messages:
+            return
+        cache = self.get_cache()
+        try:
+            last = cache.incr(SEQUENCE_KEY, len(messages))
+        except ValueError:
+            cache.add(SEQUENCE_KEY, 0, None)
+            last = cache.incr(SEQUENCE_KEY, len(messages))
+        first = last - len(messages) + 1
+        cache.set_many({
+            EVENT_KEY.format(number): (channel, type, _encode(data))
+            for number, (channel, type, data) in zip(range(first, last + 1), messages)
+        }, settings.EVENTS_CACHE_TTL)
+
+    def subscribe(self, channels, loop):
+        subscription = super().subscribe(channels, loop)
+        with self.lock:
+            if self.poller is None:
+                # Start from the sequence as of now, so events published
+                # before the thread gets going still reach this subscriber
+                seen = self._sequence(self.get_cache())
+                self.poller = threading.Thread(target=self._poll, args=(seen,), name='evfinder-events', daemon=True)
+                self.poller.start()
+        return subscription
+
+    def stop(self):
+        self.stopping.set()
+        with self.lock:
+            poller, self.poller = self.poller, None
+        if poller is not None:
+            poller.join()
+
+    def _poll(self, seen):
+        cache = self.get_cache()
+        interval = settings.EVENTS_POLL_INTERVAL
+        # Publishers reserve a number before they store the event; wait
+        # this long for a gap to fill before skipping it
+        patience = max(1, int(1.0 / interval))
+        waited = 0
+        while not self.stopping.wait(interval):
+            try:
+                latest = self._sequence(cache)
+                if latest < seen:
+                    # Counter evicted or reset; start again from its value
+                    seen = latest
+                    continue
+                if latest == seen:
+                    continue
+                numbers = range(seen + 1, latest + 1)
+                stored = cache.get_many([EVENT_KEY.format(number) for number in numbers])
+                events = []
+                for number in numbers:
+                    message = stored.get(EVENT_KEY.format(number))
+                    if message is None:
+                        if waited < patience:
+                            waited += 1
+                            break
+                        logger.warning("Event %s never arrived; skipped", number)
+                    else:
+                        events.append(Event(number, *message))
+                    seen = number
+                    waited = 0
+                self.dispatch(events)
+            except Exception:
+                logger.exception("Polling the event log failed")
+                time.sleep(interval)
+
+
+BROKERS = {'local': LocalBroker, 'cache': CacheBroker}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = BROKERS[settings.EVENTS_BROKER]()
+    return _broker
+
+
+def reset_broker():
+    global _broker
+    with _broker_lock:
+        broker, _broker = _broker, None
+    if isinstance(broker, CacheBroker):
+        broker.stop()
+
+
+def publish(messages):
+    """
+    Publish (channel, type, data) messages once the current transaction
+    commits (at once outside a transaction).
+    """
+    if messages:
+        transaction.on_commit(lambda: _publish(messages))
+
+
+def _publish(messages):
+    try:
+        get_broker().publish(messages)
+    except Exception:
+        # Notifications are best-effort; the write already committed
+        logger.exception("Publishing %d events failed", len(messages))
@@ -0,0 +1,270 @@
+"""
+Per-endpoint performance metrics, served in Prometheus text format at
+/metrics.
+
+With METRICS_ENABLED, MetricsMiddleware records every request under its
+route (the URL name), method and viewset action:
+
+- evfinder_request_duration_seconds: latency up to the response (the
+  first byte, for streams)
+- evfinder_requests_total: by status code as well
+- evfinder_db_queries, evfinder_db_seconds: SQL statements and time per
+  request, measured by a connection execute wrapper
+- evfinder_serializer_seconds, evfinder_serializer_queries: time spent
+  producing serializer `.data` and the queries issued meanwhile (N+1
+  lookups in a serializer show up here)
+- evfinder_response_bytes: body size of non-streaming responses
+
+Per-request state lives in a context variable, so queries that async
+views run in worker threads are counted too. Disabled, the middleware
+removes itself at startup and nothing is wrapped or patched.
+
+The numbers are per process: scrape every worker, or run one per
+container.
+"""
+import bisect
+import contextvars
+import secrets
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import Http404, HttpResponse
+from rest_framework.serializers import BaseSerializer
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+LABELS = ('route', 'method', 'action')
+
+_current = contextvars.ContextVar('metrics_request', default=None)
+_lock = threading.Lock()
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_seconds', 'serializer_seconds', 'serializer_queries', 'serializing')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializer_queries = 0
+        self.serializing = False
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+
+    def inc(self, values, amount=1):
+        self.series[values] = self.series.get(values, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for values, total in sorted(self.series.items()):
+            yield f'{self.name}{_labels(self.labels, values)} {total}'
+
+
+class Histogram:
+
+    def __init__(self, name, help, labels, buckets):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, values, value):
+        series = self.series.get(values)
+        if series is None:
+            # One count per bucket plus +Inf, then the sum
+            series = self.series[values] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for values, series in sorted(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                yield f'{self.name}_bucket{_labels(self.labels, values, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labels, values)} {series[-1]}'
+            yield f'{self.name}_count{_labels(self.labels, values)} {cumulative}'
+
+
+REQUESTS = Counter('evfinder_requests_total', 'Requests by endpoint and status.', LABELS + ('status',))
+DURATION = Histogram('evfinder_request_duration_seconds', 'Request latency.', LABELS, LATENCY_BUCKETS)
+DB_QUERIES = Histogram('evfinder_db_queries', 'SQL statements per request.', LABELS, QUERY_BUCKETS)
+DB_SECONDS = Histogram('evfinder_db_seconds', 'SQL time per request.', LABELS, LATENCY_BUCKETS)
+SERIALIZER_SECONDS = Histogram(
+    'evfinder_serializer_seconds', 'Time producing serializer data per request.', LABELS, LATENCY_BUCKETS,
+)
+SERIALIZER_QUERIES = Histogram(
+    'evfinder_serializer_queries', 'SQL statements issued while serializing, per request.', LABELS, QUERY_BUCKETS,
+)
+RESPONSE_BYTES = Histogram('evfinder_response_bytes', 'Response body size.', LABELS, BYTES_BUCKETS)
+
+METRICS = (REQUESTS, DURATION, DB_QUERIES, DB_SECONDS, SERIALIZER_SECONDS, SERIALIZER_QUERIES, RESPONSE_BYTES)
+
+
+def _execute(execute, sql, params, many, context):
+    state = _current.get()
+    if state is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        state.db_seconds += time.perf_counter() - started
+        state.queries += 1
+
+
+def _wrap_connection(connection, **kwargs):
+    if _execute not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_execute)
+
+
+def _timed_data(data):
+    def timed(self):
+        state = _current.get()
+        if state is None or state.serializing:
+            # Nested serializers count towards the outermost one
+            return data(self)
+        state.serializing = True
+        queries = state.queries
+        started = time.perf_counter()
+        try:
+            return data(self)
+        finally:
+            state.serializer_seconds += time.perf_counter() - started
+            state.serializer_queries += state.queries - queries
+            state.serializing = False
+
+    timed.metrics_timed = True
+    return timed
+
+
+def install():
+    """
+    Wrap every database connection and serializer `.data`. Idempotent.
+    """
+    connection_created.connect(_wrap_connection, dispatch_uid='evfinder.metrics')
+    for connection in connections.all(initialized_only=True):
+        _wrap_connection(connection)
+    if not getattr(BaseSerializer.data.fget, 'metrics_timed', False):
+        BaseSerializer.data = property(_timed_data(BaseSerializer.data.fget))
+
+
+def endpoint(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        # Keep unknown URLs from creating a series each
+        return ('unmatched', request.method, '')
+    actions = getattr(match.func, 'actions', None) or {}
+    return (match.view_name or match.route, request.method, actions.get(request.method.lower(), ''))
+
+
+def record(request, response, state, seconds):
+    labels = endpoint(request)
+    size = None if response.streaming else len(response.content)
+    with _lock:
+        REQUESTS.inc(labels + (str(response.status_code),))
+        DURATION.observe(labels, seconds)
+        DB_QUERIES.observe(labels, state.queries)
+        DB_SECONDS.observe(labels, state.db_seconds)
+        SERIALIZER_SECONDS.observe(labels, state.serializer_seconds)
+        SERIALIZER_QUERIES.observe(labels, state.serializer_queries)
+        if size is not None:
+            RESPONSE_BYTES.observe(labels, size)
+
+
+def render():
+    with _lock:
+        lines = [line for metric in METRICS for line in metric.render()]
+    return '\n'.join(lines) + '\n'
+
+
+def reset():
+    with _lock:
+        for metric in METRICS:
+            metric.series.clear()
+
+
+class MetricsMiddleware:
+    """
+    Records the metrics above for each request. Put it first in
+    MIDDLEWARE so the latency covers the whole stack. Runs natively under
+    both WSGI and ASGI.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', False):
+            raise MiddlewareNotUsed()
+        install()
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        state = RequestMetrics()
+        token = _current.set(state)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, state, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        state = RequestMetrics()
+        token = _current.set(state)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        record(request, response, state, time.perf_counter() - started)
+        return response
+
+
+def metrics_view(request):
+    """
+    The metrics in Prometheus text format; 404 unless METRICS_ENABLED.
+    With METRICS_TOKEN set, scrapers must send it as a bearer token.
+    """
+    if not getattr(settings, 'METRICS_ENABLED', False):
+        raise Http404()
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=401)
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
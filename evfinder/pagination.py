@@ -0,0 +1,196 @@
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on a composite (column, id) key.
+
+    Pages are fetched with `WHERE (col, id) > (last_col, last_id)` on an
+    indexed key, so no COUNT(*) is issued and the 100th page costs the
+    same as the first. `orderings` maps the `?ordering=` values a view
+    accepts to the key used for it.
+    """
+    page_size = 50
+    max_page_size = 100
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_param = 'ordering'
+
+    default_ordering = ('-created_at', '-id')
+    orderings = {
+        'created_at': ('created_at', 'id'),
+        '-created_at': ('-created_at', '-id'),
+    }
+
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        queryset, cursor = self._page_query(queryset, request)
+        return self._set_page(list(queryset), cursor)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        queryset, cursor = self._page_query(queryset, request)
+        return self._set_page([row async for row in queryset], cursor)
+
+    def _page_query(self, queryset, request):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.keys = self.get_keys(request, queryset)
+
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor.get('r'))
+
+        keys = self.keys
+        if self.reverse:
+            keys = tuple(_flip(key) for key in keys)
+
+        queryset = queryset.order_by(*keys)
+        if cursor:
+            queryset = queryset.filter(_after(keys, cursor['v']))
+        return queryset[:self.page_size + 1], cursor
+
+    def _set_page(self, rows, cursor):
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if self.reverse:
+            rows.reverse()
+            self.has_previous = has_more
+            self.has_next = True
+        else:
+            self.has_next = has_more
+            self.has_previous = cursor is not None
+
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_keys(self, request, queryset):
+        ordering = request.query_params.get(self.ordering_param)
+        if ordering in self.orderings:
+            return self.orderings[ordering]
+        # Search results default to relevance order
+        if 'search_rank' in queryset.query.annotations:
+            return ('-search_rank', '-id')
+        return self.default_ordering
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            values = cursor['v']
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if not isinstance(values, list) or len(values) != len(self.keys):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor
+
+    def encode_cursor(self, instance, reverse):
+        values = [_key_value(instance, key) for key in self.keys]
+        payload = json.dumps({'v': values, 'r': int(reverse)}, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(payload.encode('ascii')).decode('ascii')
+
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+def _flip(key):
+    return key[1:] if key.startswith('-') else '-' + key
+
+
+def _key_value(instance, key):
+    value = getattr(instance, key.lstrip('-'))
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return str(value)
+
+
+def _after(keys, values):
+    """
+    Rows strictly after `values` in `keys` order:
+    (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...
+    """
+    condition = Q()
+    equal = {}
+    for key, value in zip(keys, values):
+        field = key.lstrip('-')
+        lookup = 'lt' if key.startswith('-') else 'gt'
+        condition |= Q(**equal, **{f'{field}__{lookup}': value})
+        equal[field] = value
+    return condition
+
+
+class StationPagination(KeysetPagination):
+    max_page_size = 100
+    orderings = {
+        'created_at': ('created_at', 'id'),
+        '-created_at': ('-created_at', '-id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+        'rating_avg': ('rating_avg', 'id'),
+        '-rating_avg': ('-rating_avg', '-id'),
+        'rating_count': ('rating_count', 'id'),
+        '-rating_count': ('-rating_count', '-id'),
+    }
+
+
+class RatingPagination(KeysetPagination):
+    max_page_size = 100
+
+
+class BookingPagination(KeysetPagination):
+    max_page_size = 50
+
+
+class PaymentPagination(KeysetPagination):
+    max_page_size = 50
@@ -0,0 +1,83 @@
+"""
+Minimal in-process periodic task runner.
+
+Apps register their maintenance jobs in AppConfig.ready(); the WSGI/ASGI
+entry points start the runner thread when BACKGROUND_TASKS_ENABLED is set.
+Every registered job must be idempotent, since each worker process runs
+its own copy. The same jobs are also exposed as management commands for
+cron-style deployments.
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_tasks = {}
+_lock = threading.Lock()
+_thread = None
+_stop = threading.Event()
+
+
+class PeriodicTask:
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = 0.0
+
+    def run(self):
+        try:
+            self.func()
+        except Exception:
+            logger.exception("Periodic task %s failed", self.name)
+        finally:
+            self.next_run = time.monotonic() + self.interval
+
+
+def register(name, interval, func):
+    """
+    Register `func` to run every `interval` seconds.
+    """
+    with _lock:
+        _tasks[name] = PeriodicTask(name, interval, func)
+
+
+def run_pending():
+    now = time.monotonic()
+    for task in list(_tasks.values()):
+        if task.next_run <= now:
+            task.run()
+    # The runner thread owns its connections; don't keep them idle
+    connections.close_all()
+
+
+def _loop(tick):
+    while not _stop.wait(tick):
+        run_pending()
+
+
+def start(tick=1.0):
+    global _thread
+
+    if not getattr(settings, 'BACKGROUND_TASKS_ENABLED', False):
+        return
+    with _lock:
+        if _thread is not None:
+            return
+        _stop.clear()
+        _thread = threading.Thread(target=_loop, args=(tick,), name='evfinder-scheduler', daemon=True)
+        _thread.start()
+
+
+def stop():
+    global _thread
+
+    _stop.set()
+    with _lock:
+        if _thread is not None:
+            _thread.join()
+            _thread = None
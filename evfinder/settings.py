@@ -34,6 +34,7 @@ load_dotenv()
 
 INSTALLED_APPS = [
     'rest_framework',
+    'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
     'django.contrib.admin',
     'django.contrib.auth',
@@ -47,12 +48,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'evfinder.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'evfinder.db_router.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -61,6 +64,9 @@ ROOT_URLCONF = 'evfinder.urls'
 
 import os
 
+# evfinder/asgi.py switches to evfinder.asgi_urls (the async endpoints)
+ROOT_URLCONF = os.getenv('DJANGO_ROOT_URLCONF', ROOT_URLCONF)
+
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -107,10 +113,34 @@ DATABASES = {
         'PORT': os.getenv('DB_PORT'),
         'OPTIONS': {
             'init_command': "SET sql_mode='STRICT_TRANS_TABLES'"
-        }
+        },
+        # Persistent connections, checked before reuse in each request
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '60')),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas (evfinder.db_router): DB_REPLICA_HOSTS=host[:port],...
+# adds one alias per host with the primary's credentials.
+DATABASE_REPLICAS = []
+for number, address in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').split(',')), start=1):
+    host, _, port = address.strip().partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'],
+        'HOST': host,
+        'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['evfinder.db_router.PrimaryReplicaRouter']
+# Read-your-writes pins; replicas stay unused unless this cache is shared
+# between workers (not locmem)
+DATABASE_PIN_CACHE_ALIAS = 'default'
+# Upper bound on replica lag: users who wrote, and station data that
+# changed, within this window are read from the primary
+DATABASE_REPLICA_LAG_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -133,17 +163,58 @@ AUTH_PASSWORD_VALIDATORS = [
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'evfinder.pagination.KeysetPagination',
+    'PAGE_SIZE': 50,
+    # Proxy hops in front of the app whose X-Forwarded-For entry is trusted
+    # for the client IP; 0 means REMOTE_ADDR, which clients can't forge.
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')),
 }
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Override with locmem/filebased/console backends for tests and local runs
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
 
 EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
+EMAIL_TIMEOUT = 10
+
+# One-time codes (users.otp). 'cache' needs a cache shared by all workers
+# in production; 'local' keeps codes in-process (tests, single process).
+OTP_STORE = os.getenv('OTP_STORE', 'cache')
+OTP_CACHE_ALIAS = 'default'
+OTP_TTL_SECONDS = 5 * 60
+OTP_VERIFIED_TTL_SECONDS = 15 * 60
+OTP_MAX_ATTEMPTS = 5
+OTP_RETENTION_HOURS = 24            # legacy SignupOTP/EmailOTP rows kept this long
+
+# Rate limits (evfinder.throttling): per scope, buckets per client IP, per
+# account (email/username in the body) and global, as "N/period" (at most N
+# requests in any sliding second/minute/hour/day, or e.g. "3/10min").
+# THROTTLE_EXEMPT_IPS match REMOTE_ADDR, never X-Forwarded-For.
+THROTTLE_CACHE_ALIAS = 'default'
+THROTTLE_BUCKETS = {
+    'login': {'ip': '30/min', 'account': '5/min', 'global': '1200/min'},
+    'signup': {'ip': '10/hour', 'global': '300/min'},
+    'otp_send': {'ip': '10/hour', 'account': '3/10min', 'global': '300/min'},
+    'otp_verify': {'ip': '30/min', 'account': '10/min'},
+    'password_reset': {'ip': '10/hour', 'account': '5/hour'},
+}
+THROTTLE_EXEMPT_IPS = [ip for ip in os.getenv('THROTTLE_EXEMPT_IPS', '').split(',') if ip]
+THROTTLE_EXEMPT_ACCOUNTS = [a.lower() for a in os.getenv('THROTTLE_EXEMPT_ACCOUNTS', '').split(',') if a]
+
+# Transactional email outbox (users.outbox). Requests only enqueue rows;
+# the scheduler or `manage.py send_queued_email` delivers them.
+EMAIL_OUTBOX_BATCH_SIZE = 50
+EMAIL_OUTBOX_MAX_ATTEMPTS = 5
+EMAIL_OUTBOX_RETRY_SECONDS = 30     # first retry delay, doubled per attempt
+EMAIL_OUTBOX_CLAIM_SECONDS = 300    # a claimed row is retried if not finished by then
+EMAIL_OUTBOX_IDLE_SECONDS = 60      # close an unused SMTP connection after this
+EMAIL_OUTBOX_INTERVAL = 5           # seconds between scheduler deliveries
+EMAIL_OUTBOX_RETENTION_DAYS = 7     # sent rows kept this long
 
 
 # Internationalization
@@ -168,13 +239,87 @@ SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=10),       # Set your access token time
     "REFRESH_TOKEN_LIFETIME": timedelta(days=7),         # Set refresh token time
     "ROTATE_REFRESH_TOKENS": True,
+    "BLACKLIST_AFTER_ROTATION": True,
     "AUTH_HEADER_TYPES": ("Bearer",),
+    "TOKEN_REFRESH_SERIALIZER": "users.tokens.UserTokenRefreshSerializer",
 }
 
+# Per-user auth records (users.authentication). They must outlive any
+# access token, so keep this at least ACCESS_TOKEN_LIFETIME. The alias must
+# be a cache shared by all workers (Redis); with a per-process cache every
+# authenticated request loads the user row instead.
+AUTH_USER_CACHE_ALIAS = 'default'
+AUTH_USER_CACHE_SECONDS = int(SIMPLE_JWT["ACCESS_TOKEN_LIFETIME"].total_seconds())
+
+# Refresh-token revocation filter (users.revocation). Only used when
+# TOKEN_REVOCATION_CACHE_ALIAS is shared between processes (not locmem):
+# otherwise a revocation in one worker never reaches the others' filters,
+# so every refresh checks the blacklist table instead.
+TOKEN_REVOCATION_FILTER = True
+TOKEN_REVOCATION_CACHE_ALIAS = 'default'
+TOKEN_REVOCATION_FILTER_CAPACITY = 100000      # grows when exceeded
+TOKEN_REVOCATION_FILTER_ERROR_RATE = 0.001
+TOKEN_REVOCATION_SYNC_SECONDS = 1              # at most one sync per process per second
+TOKEN_REVOCATION_RESYNC_SECONDS = 30           # resync this often even if the version is unchanged
+TOKEN_REVOCATION_SYNC_OVERLAP_SECONDS = 60     # re-read window for late-committing revocations
+TOKEN_FLUSH_INTERVAL = 6 * 60 * 60             # prune expired outstanding/blacklisted tokens
 
 
 
 
+
+# Station search: 'auto' uses MySQL FULLTEXT when available and the
+# in-process inverted index otherwise; force with 'fulltext' or 'memory'.
+STATION_SEARCH_BACKEND = os.getenv('STATION_SEARCH_BACKEND', 'auto')
+
+# Cache: locmem per process by default; point CACHE_BACKEND/CACHE_LOCATION
+# at a shared cache (e.g. django.core.cache.backends.redis.RedisCache) in production.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Booking windows (booking.reservations)
+BOOKING_DEFAULT_MINUTES = 60
+BOOKING_MAX_MINUTES = 12 * 60
+
+# Time-of-use pricing (stations.pricing). Station.price is the base hourly
+# rate; tariff bands, the station's current type and occupancy scale it.
+PRICING_TYPE_MULTIPLIERS = {'bike': 0.6, 'car': 1.0, 'both': 1.0}
+PRICING_SURGE_THRESHOLD = 0.75      # occupied share of connectors where surge starts
+PRICING_SURGE_MAX = 1.5             # multiplier when every connector is taken
+
+# Versioned response cache for station reads (stations.cache). Only used
+# when the alias is shared by all workers; with locmem reads go uncached.
+STATION_CACHE_ALIAS = 'default'
+STATION_CACHE_TIMEOUT = 60
+
+# In-process periodic maintenance (evfinder.scheduler). Leave disabled when
+# the sweeps run from cron via the management commands instead.
+BACKGROUND_TASKS_ENABLED = os.getenv('BACKGROUND_TASKS_ENABLED', 'false').lower() == 'true'
+BOOKING_EXPIRY_INTERVAL = 30        # seconds between expire_bookings sweeps
+TEMP_TYPE_SWEEP_INTERVAL = 300      # seconds between clear_expired_temp_types sweeps
+
+# Push notifications over SSE/WebSocket (evfinder.events, evfinder.streams).
+# 'local' fans out within one process; with several ASGI processes use
+# 'cache' and point EVENTS_CACHE_ALIAS at a shared cache (e.g. Redis).
+EVENTS_BROKER = os.getenv('EVENTS_BROKER', 'local')
+EVENTS_CACHE_ALIAS = 'default'
+EVENTS_CACHE_TTL = 60               # seconds an event stays in the shared log
+EVENTS_POLL_INTERVAL = 0.25         # seconds between polls of the shared log
+EVENTS_QUEUE_SIZE = 100             # undelivered events before a subscriber is reset
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_RETRY_MS = 3000              # EventSource reconnect delay
+EVENTS_MAX_STATIONS = 50            # stations one stream may watch
+
+# Per-endpoint latency/SQL/serializer metrics at /metrics (evfinder.metrics).
+# Off, the middleware drops out at startup and costs nothing.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')   # bearer token scrapers must send, if set
+
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
@@ -0,0 +1,159 @@
+"""
+Push endpoints for evfinder.events, served by the ASGI app only: each
+open stream is a parked coroutine rather than a worker thread.
+
+- GET /api/events/ streams Server-Sent Events.
+- /ws/events/ is the same stream over a WebSocket, one JSON text frame
+  per event (evfinder.asgi routes websocket connections here).
+
+Both take `stations=1,2,3` to watch stations; an authenticated user
+also gets their own booking and payment events. Browsers can't set
+headers on EventSource or WebSocket, so the access token may be passed
+as `token=` instead of an Authorization header.
+
+A stream ends when its access token expires (reconnect with a fresh
+one) and, with a `reset` event, when the client falls too far behind;
+either way the client should refetch the state it shows.
+"""
+import asyncio
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import QueryDict, StreamingHttpResponse
+from rest_framework import exceptions
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+
+from booking import events as booking_events
+from stations import events as station_events
+from users.authentication import CachedJWTAuthentication
+from . import events
+from .asyncapi import api_view, authenticate
+
+WEBSOCKET_PATH = '/ws/events/'
+
+
+def channels_for(user, stations):
+    channels = []
+    if user.is_authenticated:
+        channels.append(booking_events.channel(user.pk))
+    if stations:
+        try:
+            ids = {int(station_id) for station_id in stations.split(',')}
+        except ValueError:
+            raise exceptions.ValidationError({'stations': ['Expected comma-separated station ids.']})
+        if len(ids) > settings.EVENTS_MAX_STATIONS:
+            raise exceptions.ValidationError(
+                {'stations': [f'Watch at most {settings.EVENTS_MAX_STATIONS} stations per stream.']}
+            )
+        channels.extend(station_events.channel(station_id) for station_id in sorted(ids))
+    if not channels:
+        raise exceptions.NotAuthenticated('Log in or pass stations= to watch.')
+    return channels
+
+
+def _deadline(token):
+    return token['exp'] if token is not None else None
+
+
+async def _next(subscription, deadline):
+    """
+    (event, expired): the next event, or None after a heartbeat interval
+    with nothing to send.
+    """
+    timeout = settings.EVENTS_HEARTBEAT_SECONDS
+    if deadline is not None:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return None, True
+        timeout = min(timeout, remaining)
+    return await subscription.get(timeout), False
+
+
+async def _sse(subscription, deadline):
+    try:
+        yield f'retry: {settings.EVENTS_RETRY_MS}\n\n'
+        while True:
+            event, expired = await _next(subscription, deadline)
+            if expired:
+                yield 'event: expired\ndata: {}\n\n'
+                return
+            if event is not None:
+                yield event.sse()
+            elif subscription.closed:
+                yield 'event: reset\ndata: {}\n\n'
+                return
+            else:
+                yield ': keepalive\n\n'
+    finally:
+        subscription.close()
+
+
+@api_view(['GET'])
+async def event_stream(request):
+    token = request.GET.get('token')
+    if token and 'HTTP_AUTHORIZATION' not in request.META:
+        request.META['HTTP_AUTHORIZATION'] = f'{jwt_settings.AUTH_HEADER_TYPES[0]} {token}'
+    request = await authenticate(request)
+    channels = channels_for(request.user, request.query_params.get('stations'))
+
+    subscription = events.get_broker().subscribe(channels, asyncio.get_running_loop())
+    response = StreamingHttpResponse(_sse(subscription, _deadline(request.auth)), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+async def websocket(scope, receive, send):
+    """
+    ASGI application for WebSocket connections.
+    """
+    if (await receive())['type'] != 'websocket.connect':
+        return
+    if scope['path'] != WEBSOCKET_PATH:
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+
+    query = QueryDict(scope.get('query_string', b''))
+    try:
+        user, token = await _websocket_user(query.get('token'))
+        channels = channels_for(user, query.get('stations'))
+    except exceptions.APIException as exc:
+        await send({'type': 'websocket.close', 'code': 4000 + exc.status_code})
+        return
+
+    subscription = events.get_broker().subscribe(channels, asyncio.get_running_loop())
+    await send({'type': 'websocket.accept'})
+    # Client frames are ignored; a disconnect ends the stream at once
+    listener = asyncio.ensure_future(_until_disconnect(receive))
+    listener.add_done_callback(lambda _: subscription.close())
+    deadline = _deadline(token)
+    try:
+        while True:
+            event, expired = await _next(subscription, deadline)
+            if expired:
+                await send({'type': 'websocket.close', 'code': 4401})
+                return
+            if event is not None:
+                await send({'type': 'websocket.send', 'text': event.json()})
+            elif subscription.closed:
+                if not listener.done():
+                    await send({'type': 'websocket.close', 'code': 4000, 'reason': 'reset'})
+                return
+    finally:
+        listener.cancel()
+        subscription.close()
+
+
+async def _websocket_user(raw_token):
+    if not raw_token:
+        return AnonymousUser(), None
+    authenticator = CachedJWTAuthentication()
+    token = authenticator.get_validated_token(raw_token.encode())
+    return await authenticator.aget_user(token), token
+
+
+async def _until_disconnect(receive):
+    while (await receive())['type'] != 'websocket.disconnect':
+        pass
@@ -0,0 +1,119 @@
+"""
+Test helpers shared by the apps' tests.py.
+"""
+import asyncio
+import tempfile
+
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test import override_settings
+
+from . import events
+
+
+def shared_cache(directory):
+    """
+    CACHES with a file-based default: shared between processes, so the
+    features that require evfinder.caching.is_shared() turn on.
+    """
+    return {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory}}
+
+
+class SharedCacheMixin:
+    """
+    Run each test against a fresh shared cache.
+    """
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(CACHES=shared_cache(directory.name))
+        override.enable()
+        self.addCleanup(override.disable)
+        super().setUp()
+
+
+REPLICA = 'replica'
+
+# Registered on import, before the test runner sets up the databases the
+# collected tests ask for
+connections.settings[REPLICA] = connections.configure_settings({
+    DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+    REPLICA: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'},
+})[REPLICA]
+
+
+class ReplicaDatabaseMixin:
+    """
+    Use an SQLite database as the only DATABASE_REPLICAS entry. Unlike a
+    TEST MIRROR it starts empty and never sees the primary's rows, so a
+    test can tell which database a read went to.
+    """
+    replica = REPLICA
+    databases = {DEFAULT_DB_ALIAS, REPLICA}
+
+    @classmethod
+    def setUpClass(cls):
+        # The router only migrates the primary; give the replica its tables
+        connection = connections[cls.replica]
+        existing = set(connection.introspection.table_names())
+        with connection.schema_editor() as editor:
+            for model in apps.get_models():
+                if model._meta.managed and not model._meta.proxy and model._meta.db_table not in existing:
+                    editor.create_model(model)
+        super().setUpClass()
+
+    def setUp(self):
+        override = override_settings(DATABASE_REPLICAS=[self.replica])
+        override.enable()
+        self.addCleanup(override.disable)
+        super().setUp()
+
+
+class EventsMixin:
+    """
+    Subscribe to evfinder.events channels from a synchronous test, with a
+    fresh broker per test.
+    """
+
+    def setUp(self):
+        super().setUp()
+        events.reset_broker()
+        self.addCleanup(events.reset_broker)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def subscribe(self, *channels):
+        subscription = events.get_broker().subscribe(channels, self.loop)
+        self.addCleanup(subscription.close)
+        return subscription
+
+    def received(self, subscription, timeout=0):
+        """
+        The events delivered to `subscription` so far, waiting up to
+        `timeout` seconds for the first.
+        """
+        async def drain():
+            received = []
+            while (event := await subscription.get(timeout if not received else 0)) is not None:
+                received.append(event)
+            return received
+
+        return self.loop.run_until_complete(drain())
+
+
+class AsyncRoutesMixin:
+    """
+    Request the ASGI deployment's routes (evfinder.asgi_urls) with
+    AsyncClient from a synchronous test, authenticated with `self.token`
+    when set.
+    """
+    token = None
+
+    def asgi(self, method, path, *args, headers=None, **kwargs):
+        headers = dict(headers or {})
+        if self.token:
+            headers.setdefault('Authorization', f'Bearer {self.token}')
+        with override_settings(ROOT_URLCONF='evfinder.asgi_urls'):
+            return async_to_sync(getattr(self.async_client, method))(path, *args, headers=headers, **kwargs)
@@ -0,0 +1,80 @@
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from rest_framework import serializers
+
+from users.models import Users
+from . import metrics
+from .events import CacheBroker
+from .testing import EventsMixin, SharedCacheMixin
+
+
+@override_settings(EVENTS_BROKER='cache', EVENTS_POLL_INTERVAL=0.01)
+class CacheBrokerTests(EventsMixin, SharedCacheMixin, SimpleTestCase):
+
+    def test_events_from_another_process_are_delivered(self):
+        watching = self.subscribe('station:1')
+        elsewhere = self.subscribe('station:2')
+        # Another process publishing through the shared cache
+        CacheBroker().publish([('station:1', 'station', {'id': 1}), ('station:1', 'station', {'id': 1, 'price': 9})])
+
+        received = self.received(watching, timeout=5)
+        self.assertEqual([event.data for event in received], ['{"id":1}', '{"id":1,"price":9}'])
+        self.assertEqual([event.id for event in received], [1, 2])
+        self.assertEqual(self.received(elsewhere, timeout=0.1), [])
+
+
+@override_settings(METRICS_ENABLED=True, METRICS_TOKEN='scrape')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+        # The middleware is loaded on a client's first request
+        self.client = Client()
+
+    def scrape(self):
+        response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape'})
+        self.assertEqual(response.status_code, 200)
+        return response.content.decode().splitlines()
+
+    @override_settings(METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+    def test_scrapers_need_the_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        self.assertEqual(self.client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code, 401)
+
+    def test_requests_are_recorded_by_endpoint(self):
+        self.client.get('/api/stations/')
+        self.client.get('/api/stations/')
+        self.assertIn('evfinder_requests_total{route="station-list",method="GET",action="list",status="200"} 2', self.scrape())
+
+    def test_queries_inside_serializer_data_are_counted(self):
+        metrics.install()
+
+        class Probe(serializers.Serializer):
+            users = serializers.SerializerMethodField()
+
+            def get_users(self, obj):
+                return Users.objects.count()
+
+        state = metrics.RequestMetrics()
+        token = metrics._current.set(state)
+        try:
+            Users.objects.exists()
+            Probe([object(), object()], many=True).data
+        finally:
+            metrics._current.reset(token)
+        self.assertEqual((state.queries, state.serializer_queries), (3, 2))
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = metrics.Histogram('sizes', 'Sizes.', ('route',), (1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(('a',), value)
+        self.assertEqual(list(histogram.render())[2:], [
+            'sizes_bucket{route="a",le="1"} 2',
+            'sizes_bucket{route="a",le="5"} 3',
+            'sizes_bucket{route="a",le="+Inf"} 4',
+            'sizes_sum{route="a"} 14.5',
+            'sizes_count{route="a"} 4',
+        ])
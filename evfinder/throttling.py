@@ -0,0 +1,148 @@
+"""
+Sliding-window rate limits kept in the shared cache.
+
+Each protected endpoint names a scope; THROTTLE_BUCKETS gives the scope
+up to three buckets, checked in order: per client IP, per account (the
+email/username in the request body) and one global bucket. A bucket
+"N/period" allows N requests in any period: requests are counted per
+fixed window, and the previous window's count is weighted by how much
+of it still overlaps the sliding one. Rejected requests never reach the
+view, so no password hashing, queries or email happen for them.
+
+Counting is an atomic cache.incr, so concurrent requests each see a
+distinct count and a burst can't slip past the limit. The client IP is
+REMOTE_ADDR unless REST_FRAMEWORK['NUM_PROXIES'] says how many proxy
+hops of X-Forwarded-For to trust.
+"""
+import hashlib
+import math
+import re
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+KINDS = ('ip', 'account', 'global')
+
+
+_PERIOD_RE = re.compile(r'(\d*)\s*([smhd])[a-z]*')
+
+
+def parse_rate(rate):
+    """
+    '10/min' -> (limit 10, period 60 seconds); '3/10min' -> (3, 600).
+    """
+    count, period = rate.split('/')
+    match = _PERIOD_RE.fullmatch(period.strip())
+    if match is None:
+        raise ValueError(f'Invalid throttle rate: {rate}')
+    return int(count), int(match.group(1) or 1) * PERIODS[match.group(2)]
+
+
+def get_cache():
+    return caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+
+
+def _incr(cache, key, timeout):
+    cache.add(key, 0, timeout)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Expired or evicted between the add and the incr
+        cache.add(key, 0, timeout)
+        return cache.incr(key)
+
+
+def take(key, limit, period, now=None):
+    """
+    Count one request against the bucket at `key`. Returns 0 when
+    allowed, or the seconds until one more request would be.
+    """
+    cache = get_cache()
+    now = time.time() if now is None else now
+    window, offset = divmod(now, period)
+    overlap = 1 - offset / period
+
+    current = f'{key}:{int(window)}'
+    # Both windows must outlive the sliding one that reads them
+    count = _incr(cache, current, 2 * period + 1)
+    previous = cache.get(f'{key}:{int(window) - 1}', 0)
+    if previous * overlap + count <= limit:
+        return 0
+
+    # Rejected requests don't use up the allowance
+    cache.decr(current)
+    count -= 1
+    if count >= limit:
+        # Full on its own; next window it weighs as `previous`
+        return period * (overlap + 1 - (limit - 1) / count)
+    # Wait for the previous window's share to shrink enough
+    return period * (overlap - (limit - 1 - count) / previous)
+
+
+class WindowThrottle(BaseThrottle):
+    """
+    Subclasses set `scope`. Buckets missing from THROTTLE_BUCKETS are
+    not enforced, and IPs/accounts in THROTTLE_EXEMPT_IPS /
+    THROTTLE_EXEMPT_ACCOUNTS skip every bucket. Exempt IPs match the
+    connecting address (REMOTE_ADDR) only, never a forwarded header.
+    """
+    scope = None
+    account_fields = ('email', 'email_or_username', 'username')
+
+    def __init__(self):
+        self.delay = None
+
+    def buckets(self):
+        return getattr(settings, 'THROTTLE_BUCKETS', {}).get(self.scope, {})
+
+    def get_account(self, request):
+        try:
+            data = request.data
+        except Exception:
+            return None
+        for field in self.account_fields:
+            value = data.get(field) if hasattr(data, 'get') else None
+            if isinstance(value, str) and value.strip():
+                return value.strip().lower()
+        return None
+
+    def bucket_keys(self, request):
+        if request.META.get('REMOTE_ADDR') in getattr(settings, 'THROTTLE_EXEMPT_IPS', ()):
+            return None
+
+        account = self.get_account(request)
+        if account is not None and account in getattr(settings, 'THROTTLE_EXEMPT_ACCOUNTS', ()):
+            return None
+
+        keys = {'ip': self.get_ident(request), 'global': 'all'}
+        if account is not None:
+            keys['account'] = hashlib.sha1(account.encode()).hexdigest()
+        return keys
+
+    def allow_request(self, request, view):
+        buckets = self.buckets()
+        if not buckets:
+            return True
+
+        keys = self.bucket_keys(request)
+        if keys is None:
+            return True
+
+        for kind in KINDS:
+            if kind not in buckets or kind not in keys:
+                continue
+            limit, period = parse_rate(buckets[kind])
+            wait = take(f'throttle:{self.scope}:{kind}:{keys[kind]}', limit, period)
+            # Stop at the first full bucket so rejected requests don't
+            # count against the buckets after it
+            if wait:
+                self.delay = wait
+                return False
+        return True
+
+    def wait(self):
+        # Retry-After is whole seconds; round up so clients don't retry early
+        return math.ceil(self.delay) if self.delay else None
@@ -17,10 +17,13 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path,include
 
+from evfinder import metrics
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('users.urls')),
     path('api/', include('stations.urls')),
     path('api/', include('booking.urls')),
+    path('metrics', metrics.metrics_view, name='metrics'),
 ]
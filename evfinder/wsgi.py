@@ -14,3 +14,7 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'evfinder.settings')
 
 application = get_wsgi_application()
+
+from evfinder import scheduler  # noqa: E402
+
+scheduler.start()
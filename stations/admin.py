@@ -1,10 +1,14 @@
 from django.contrib import admin
-from .models import Station, StationRating
+from .models import Station, StationRating, TariffBand
 
 @admin.register(Station)
 class StationAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'owner', 'get_base_type', 'price', 'is_active', 'created_at')
     search_fields = ('name', 'owner__username')
+    list_select_related = ('owner',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_current_type()
 
     # Method to show type in admin
     def get_base_type(self, obj):
@@ -14,3 +18,10 @@ class StationAdmin(admin.ModelAdmin):
 @admin.register(StationRating)
 class RatingAdmin(admin.ModelAdmin):
     list_display = ('id','station','user','rating','created_at')
+    list_select_related = ('station', 'user')
+
+@admin.register(TariffBand)
+class TariffBandAdmin(admin.ModelAdmin):
+    list_display = ('id', 'station', 'days', 'start_time', 'end_time', 'multiplier', 'priority')
+    list_select_related = ('station',)
+    raw_id_fields = ('station',)
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class StationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stations'
+
+    def ready(self):
+        from django.conf import settings
+        from evfinder import scheduler
+        from django.db.models.signals import post_migrate
+        from . import signals
+
+        post_migrate.connect(signals.create_fulltext_index, sender=self)
+        from .tasks import clear_expired_temp_types
+
+        scheduler.register('clear_expired_temp_types', settings.TEMP_TYPE_SWEEP_INTERVAL, clear_expired_temp_types)
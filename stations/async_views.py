@@ -0,0 +1,120 @@
+"""
+Async (ASGI) versions of the station discovery reads.
+
+Same responses, cache keys and validators as StationViewSet's list,
+retrieve and nearby, with the cache and the ORM awaited. Served from
+evfinder.asgi_urls; other methods on these paths go to StationViewSet.
+"""
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.exceptions import NotFound
+
+from evfinder import db_router
+from evfinder.asyncapi import authenticate, check_permissions, read_view, render
+from evfinder.conditional import aconditional_response, make_etag
+from . import cache as station_cache
+from . import pricing
+from .views import StationViewSet
+
+list_fallback = StationViewSet.as_view({'get': 'list', 'post': 'create'})
+detail_fallback = StationViewSet.as_view({
+    'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy',
+})
+nearby_fallback = StationViewSet.as_view({'get': 'nearby'})
+
+
+def _view(request, action, **kwargs):
+    view = StationViewSet(request=request, args=(), kwargs=kwargs, format_kwarg=None, action=action)
+    check_permissions(request, view.get_permissions(), view)
+    return view
+
+
+async def _filtered(view, queryset):
+    if view.request.query_params.get('search'):
+        # The search index may have to load; keep that off the event loop
+        return await sync_to_async(view.filter_queryset)(queryset)
+    return view.filter_queryset(queryset)
+
+
+async def _cached(request, key, build):
+    if key is None:
+        # No shared cache: see CachedReadMixin
+        return render(await build())
+
+    async def cached_response():
+        cache = station_cache.get_cache()
+        data = await cache.aget(key)
+        if data is not None:
+            await station_cache.arecord(hit=True)
+            response = render(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        await station_cache.arecord(hit=False)
+        changed = await station_cache.achanged_at()
+        if changed is not None and time.time() - changed < settings.DATABASE_REPLICA_LAG_SECONDS:
+            # See CachedReadMixin: don't cache a lagging replica's rows
+            with db_router.use_primary():
+                data = await build()
+        else:
+            data = await build()
+        await cache.aset(key, data, station_cache.timeout())
+        response = render(data)
+        response['X-Cache'] = 'MISS'
+        return response
+
+    # ETag only, as in CachedReadMixin: quotes change without a station write
+    return await aconditional_response(request, make_etag(key), None, cached_response)
+
+
+@read_view(list_fallback)
+async def station_list(request):
+    request = await authenticate(request)
+    view = _view(request, 'list')
+    key = None
+    if station_cache.enabled():
+        key = await station_cache.alist_key(request.user, request.query_params, band=pricing.week_slot())
+
+    async def build():
+        queryset = await _filtered(view, view.get_queryset())
+        page = await view.paginator.apaginate_queryset(queryset, request, view)
+        await pricing.aattach_quotes(page)
+        data = view.get_serializer_class()(page, many=True, context=view.get_serializer_context()).data
+        return station_cache.plain(view.paginator.get_paginated_response(data).data)
+
+    return await _cached(request, key, build)
+
+
+@read_view(detail_fallback)
+async def station_detail(request, pk):
+    request = await authenticate(request)
+    view = _view(request, 'retrieve', pk=pk)
+    key = None
+    if station_cache.enabled():
+        key = await station_cache.adetail_key(request.user, pk, request.query_params, band=pricing.week_slot())
+
+    async def build():
+        queryset = await _filtered(view, view.get_queryset())
+        station = await queryset.filter(pk=pk).afirst()
+        if station is None:
+            raise NotFound('No Station matches the given query.')
+        view.check_object_permissions(request, station)
+        await pricing.aattach_quotes([station])
+        return station_cache.plain(view.get_serializer_class()(station, context=view.get_serializer_context()).data)
+
+    return await _cached(request, key, build)
+
+
+@read_view(nearby_fallback)
+async def station_nearby(request):
+    request = await authenticate(request)
+    view = _view(request, 'nearby')
+    params, error = StationViewSet.nearby_params(request.query_params)
+    if error:
+        return render({'error': error}, status=400)
+
+    stations = await view.get_queryset().anearest(*params)
+    await pricing.aattach_quotes(stations)
+    return render(view.get_serializer_class()(stations, many=True, context=view.get_serializer_context()).data)
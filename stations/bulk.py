@@ -0,0 +1,400 @@
+"""
+Bulk station import/export for operators with large fleets.
+
+Imports are read row by row from CSV or NDJSON, validated with the
+StationSerializer rules and written in batches: one transaction per
+batch with a single bulk_create for new stations and a single
+bulk_update for existing ones. Cluster deltas are written inside each
+batch's transaction, so the clusters always match the committed rows;
+the search index and the response cache are updated once per batch.
+
+Exports stream rows straight from an iterator so an owner's fleet is
+never loaded into memory.
+"""
+import csv
+import io
+import json
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models.functions import Now
+from django.utils import timezone
+from rest_framework import serializers
+
+from . import cache, clusters, events, geo, search
+from .models import Station
+from .serializers import StationSerializer
+
+FORMAT_CSV = 'csv'
+FORMAT_NDJSON = 'ndjson'
+FORMATS = (FORMAT_CSV, FORMAT_NDJSON)
+
+CONTENT_TYPES = {
+    FORMAT_CSV: 'text/csv',
+    FORMAT_NDJSON: 'application/x-ndjson',
+}
+
+FIELDS = [
+    'id', 'name', 'description', 'latitude', 'longitude', 'type',
+    'price', 'connector_count', 'temp_type', 'temp_until', 'is_active',
+]
+WRITABLE_FIELDS = FIELDS[1:]
+
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+
+
+def format_for(content_type, filename=None):
+    """
+    Pick the import format from an upload's name or content type.
+    """
+    if filename:
+        if filename.endswith('.csv'):
+            return FORMAT_CSV
+        if filename.endswith(('.ndjson', '.jsonl')):
+            return FORMAT_NDJSON
+    content_type = (content_type or '').split(';')[0].strip()
+    for fmt, known in CONTENT_TYPES.items():
+        if content_type == known:
+            return fmt
+    if content_type in ('application/jsonl', 'application/json-lines'):
+        return FORMAT_NDJSON
+    return None
+
+
+def _text_lines(stream):
+    for line in stream:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8-sig')
+        yield line
+
+
+def read_rows(stream, fmt):
+    """
+    Yield (line_number, row) from a binary or text stream. CSV empty
+    cells are treated as missing; malformed NDJSON lines yield None.
+    """
+    lines = _text_lines(stream)
+
+    if fmt == FORMAT_CSV:
+        reader = csv.DictReader(lines)
+        for row in reader:
+            yield reader.line_num, {key: value for key, value in row.items() if key and value != ''}
+        return
+
+    for number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+class ImportResult:
+
+    def __init__(self):
+        self.created = 0
+        self.updated = 0
+        self.failed = 0
+        self.errors = []
+
+    def error(self, line, detail):
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': detail})
+
+    def as_dict(self):
+        return {
+            'created': self.created,
+            'updated': self.updated,
+            'failed': self.failed,
+            'errors': self.errors,
+            'errors_truncated': self.failed > len(self.errors),
+        }
+
+
+class StationImporter:
+    """
+    Validate and write station rows in batches on behalf of `owner`.
+
+    Rows with an `id` update that station (it must belong to the owner,
+    unless the owner is staff) with only the columns supplied; rows
+    without one create a new station.
+    """
+
+    def __init__(self, owner, batch_size=BATCH_SIZE):
+        self.owner = owner
+        self.batch_size = batch_size
+        # One serializer per mode, reused for every row: building a fresh
+        # serializer per row costs more than validating it
+        self.create_serializer = StationSerializer()
+        self.update_serializer = StationSerializer(partial=True)
+        self.result = ImportResult()
+
+    def run(self, rows):
+        batch = []
+        for line, row in rows:
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self._import_batch(batch)
+                batch = []
+        if batch:
+            self._import_batch(batch)
+        return self.result
+
+    def _validate(self, line, row):
+        if row is None:
+            self.result.error(line, {'non_field_errors': ['Row is not a JSON object']})
+            return None, None
+
+        station_id = row.get('id')
+        if station_id not in (None, ''):
+            try:
+                station_id = int(station_id)
+            except (TypeError, ValueError):
+                self.result.error(line, {'id': ['A valid integer is required.']})
+                return None, None
+        else:
+            station_id = None
+
+        data = {key: value for key, value in row.items() if key in WRITABLE_FIELDS}
+        serializer = self.update_serializer if station_id else self.create_serializer
+        try:
+            validated = serializer.run_validation(data)
+        except serializers.ValidationError as exc:
+            self.result.error(line, exc.detail)
+            return None, None
+        return station_id, validated
+
+    def _import_batch(self, batch):
+        creates = []
+        updates = []
+        for line, row in batch:
+            station_id, validated = self._validate(line, row)
+            if validated is None:
+                continue
+            if station_id is None:
+                creates.append(validated)
+            else:
+                updates.append((line, station_id, validated))
+
+        with transaction.atomic():
+            changes = []
+            touched = []
+            changed_ids = []
+
+            if updates:
+                existing = Station.objects.all()
+                if not self.owner.is_staff:
+                    existing = existing.filter(owner=self.owner)
+                existing = existing.in_bulk([station_id for _, station_id, _ in updates])
+
+                now = timezone.now()
+                fields = {'geohash', 'updated_at'}
+                stations = {}
+                for line, station_id, validated in updates:
+                    station = stations.get(station_id) or existing.get(station_id)
+                    if station is None:
+                        self.result.error(line, {'id': [f'Station {station_id} not found.']})
+                        continue
+                    for name, value in validated.items():
+                        setattr(station, name, value)
+                    fields.update(validated)
+                    station.geohash = geo.encode(station.latitude, station.longitude)
+                    station.updated_at = now
+                    stations[station_id] = station
+                    self.result.updated += 1
+
+                for station in stations.values():
+                    changes.append((getattr(station, '_indexed', None), station.index_state()))
+                    touched.append(station)
+                    changed_ids.append(station.pk)
+                Station.objects.bulk_update(list(stations.values()), sorted(fields))
+                events.stations_changed(stations.values())
+
+            if creates:
+                new = []
+                for validated in creates:
+                    station = Station(owner=self.owner, **validated)
+                    station.geohash = geo.encode(station.latitude, station.longitude)
+                    new.append(station)
+                Station.objects.bulk_create(new)
+                self.result.created += len(new)
+                for station in new:
+                    changes.append((None, station.index_state()))
+                    touched.append(station)
+
+            clusters.apply_changes(changes)
+            cache.bump(changed_ids)
+
+        self._reindex(touched)
+
+    def _reindex(self, stations):
+        # Backends that don't return pks from bulk_create (MySQL) can't be
+        # indexed row by row; drop the in-process index so it rebuilds
+        if any(station.pk is None for station in stations):
+            search.reset_index()
+            return
+        for station in stations:
+            search.station_changed(station)
+
+
+def import_stations(owner, stream, fmt, batch_size=BATCH_SIZE):
+    return StationImporter(owner, batch_size=batch_size).run(read_rows(stream, fmt))
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _json_value(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def export_rows(queryset, fmt, chunk_size=2000):
+    """
+    Yield the encoded export (header first for CSV) for `queryset`,
+    fetching rows in chunks from the database cursor.
+    """
+    rows = queryset.order_by('id').values_list(*FIELDS).iterator(chunk_size=chunk_size)
+
+    if fmt == FORMAT_CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(FIELDS)
+        for count, row in enumerate(rows, start=1):
+            writer.writerow([_csv_value(value) for value in row])
+            if count % chunk_size == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+        return
+
+    lines = []
+    for row in rows:
+        record = {name: _json_value(value) for name, value in zip(FIELDS, row)}
+        lines.append(json.dumps(record, separators=(',', ':')))
+        if len(lines) >= chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+UPDATE_FIELDS = ['price', 'is_active', 'type', 'temp_type', 'temp_until', 'latitude', 'longitude']
+MAX_UPDATE_STATIONS = 5000
+
+
+def _validate_update(serializer, values, label):
+    unknown = set(values) - set(UPDATE_FIELDS)
+    if unknown:
+        raise serializers.ValidationError({label: [f"Can't change: {', '.join(sorted(unknown))}"]})
+    if ('latitude' in values) != ('longitude' in values):
+        raise serializers.ValidationError({label: ['latitude and longitude must be changed together']})
+    if not values:
+        raise serializers.ValidationError({label: ['No fields to change']})
+    try:
+        return serializer.run_validation(values)
+    except serializers.ValidationError as exc:
+        raise serializers.ValidationError({label: exc.detail})
+
+
+def parse_update_request(data):
+    """
+    Normalise a bulk update body into {station_id: validated_values}.
+
+    Either {"ids": [...], "set": {...}} to apply the same change to many
+    stations, or {"changes": [{"id": 1, "price": "9.50"}, ...]}.
+    """
+    serializer = StationSerializer(partial=True)
+    changes = {}
+
+    if 'ids' in data:
+        ids = data.get('ids')
+        if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+            raise serializers.ValidationError({'ids': ['A list of station ids is required']})
+        values = _validate_update(serializer, data.get('set') or {}, 'set')
+        changes = {pk: values for pk in ids}
+    else:
+        rows = data.get('changes')
+        if not isinstance(rows, list):
+            raise serializers.ValidationError({'changes': ['A list of changes is required']})
+        for position, row in enumerate(rows):
+            if not isinstance(row, dict) or not isinstance(row.get('id'), int):
+                raise serializers.ValidationError({f'changes[{position}]': ['Each change needs an integer id']})
+            values = {key: value for key, value in row.items() if key != 'id'}
+            if row['id'] in changes:
+                raise serializers.ValidationError({f'changes[{position}]': ['Station listed twice']})
+            changes[row['id']] = _validate_update(serializer, values, f'changes[{position}]')
+
+    if not changes:
+        raise serializers.ValidationError({'ids': ['No stations given']})
+    if len(changes) > MAX_UPDATE_STATIONS:
+        raise serializers.ValidationError({'ids': [f'At most {MAX_UPDATE_STATIONS} stations per request']})
+    return changes
+
+
+def update_stations(user, changes):
+    """
+    Apply {station_id: values} in one transaction.
+
+    Ownership is checked with one query over all ids; stations whose
+    values actually differ are then written with one UPDATE per distinct
+    set of values (so a network-wide price change is a single statement),
+    followed by one cluster update and one cache bump. Returns
+    (changed_ids, unchanged_ids).
+    """
+    fields = sorted({name for values in changes.values() for name in values})
+    loaded = set(fields) | {'geohash', 'latitude', 'longitude'} | set(events.WATCHED)
+
+    with transaction.atomic():
+        stations = Station.objects.select_for_update().only('id', 'owner_id', *loaded)
+        if not user.is_staff:
+            stations = stations.filter(owner=user)
+        stations = stations.in_bulk(list(changes))
+
+        missing = sorted(set(changes) - set(stations))
+        if missing:
+            raise serializers.ValidationError({'ids': [f'Stations not found or not yours: {missing}']})
+
+        groups = defaultdict(list)
+        cluster_changes = []
+        unchanged = []
+        for station_id, values in changes.items():
+            station = stations[station_id]
+            if all(getattr(station, name) == value for name, value in values.items()):
+                unchanged.append(station_id)
+                continue
+
+            for name, value in values.items():
+                setattr(station, name, value)
+            values = dict(values)
+            if 'latitude' in values:
+                station.geohash = values['geohash'] = geo.encode(station.latitude, station.longitude)
+            cluster_changes.append((station._indexed, station.index_state()))
+
+            groups[tuple(sorted(values.items()))].append(station_id)
+
+        for values, ids in groups.items():
+            Station.objects.filter(pk__in=ids).update(updated_at=Now(), **dict(values))
+
+        changed = sorted(pk for ids in groups.values() for pk in ids)
+        if changed:
+            clusters.apply_changes(cluster_changes)
+            cache.bump(changed)
+            events.stations_changed(stations[pk] for pk in changed)
+
+    return changed, sorted(unchanged)
@@ -0,0 +1,212 @@
+"""
+Versioned response cache for public station reads.
+
+Cached list responses are keyed by a global version and cached detail
+responses by a per-station version, so invalidation only bumps a
+counter and never has to find or delete keys.
+
+The versions only invalidate entries everywhere when every worker reads
+the same cache. With a per-process one (locmem, the default) a bump would
+reach just the worker that wrote, so enabled() is False and the views
+serve uncached responses without the key-derived ETag.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from evfinder.caching import is_shared
+
+GLOBAL_VERSION_KEY = 'stations:version'
+STATION_VERSION_KEY = 'stations:version:{}'
+CHANGED_AT_KEY = 'stations:changed_at'
+TARIFF_VERSION_KEY = 'stations:tariffs:version'
+HITS_KEY = 'stations:cache:hits'
+MISSES_KEY = 'stations:cache:misses'
+
+
+def _alias():
+    return getattr(settings, 'STATION_CACHE_ALIAS', 'default')
+
+
+def get_cache():
+    return caches[_alias()]
+
+
+def enabled():
+    return is_shared(_alias())
+
+
+def timeout():
+    return getattr(settings, 'STATION_CACHE_TIMEOUT', 60)
+
+
+def _incr(cache, key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Missing key: start a fresh counter (add() loses races harmlessly)
+        cache.add(key, 1, None)
+        return cache.get(key, 1)
+
+
+def _version(cache, key):
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, 1, None)
+        version = cache.get(key, 1)
+    return version
+
+
+async def _aincr(cache, key):
+    try:
+        return await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, 1, None)
+        return await cache.aget(key, 1)
+
+
+async def _aversion(cache, key):
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, 1, None)
+        version = await cache.aget(key, 1)
+    return version
+
+
+def global_version():
+    return _version(get_cache(), GLOBAL_VERSION_KEY)
+
+
+def station_version(station_id):
+    return _version(get_cache(), STATION_VERSION_KEY.format(station_id))
+
+
+def changed_at():
+    """
+    Unix time of the last bump, or None if nothing changed since the
+    cache started.
+    """
+    return get_cache().get(CHANGED_AT_KEY)
+
+
+async def achanged_at():
+    return await get_cache().aget(CHANGED_AT_KEY)
+
+
+def bump(station_ids=()):
+    """
+    Invalidate every cached list and the given stations' cached details.
+    Deferred until commit so no reader can re-cache pre-commit rows under
+    the new version.
+    """
+    station_ids = list(station_ids)
+    transaction.on_commit(lambda: _bump(station_ids))
+
+
+def _bump(station_ids):
+    cache = get_cache()
+    _incr(cache, GLOBAL_VERSION_KEY)
+    for station_id in station_ids:
+        _incr(cache, STATION_VERSION_KEY.format(station_id))
+    cache.set(CHANGED_AT_KEY, time.time(), None)
+
+
+def tariff_version():
+    return _version(get_cache(), TARIFF_VERSION_KEY)
+
+
+async def atariff_version():
+    return await _aversion(get_cache(), TARIFF_VERSION_KEY)
+
+
+def bump_tariffs(station_ids=()):
+    """
+    Invalidate compiled tariff schedules (in every process) and the
+    affected stations' cached responses, after commit.
+    """
+    station_ids = list(station_ids)
+    transaction.on_commit(lambda: _bump_tariffs(station_ids))
+
+
+def _bump_tariffs(station_ids):
+    _incr(get_cache(), TARIFF_VERSION_KEY)
+    _bump(station_ids)
+
+
+def variant_for(user):
+    """
+    Which get_queryset() branch a user falls into; users in the same
+    branch see the same rows.
+    """
+    if user.is_authenticated and user.is_staff:
+        return 'all'
+    if user.is_authenticated and getattr(user, 'role', None) == 'chargerowner':
+        return f'owner:{user.pk}'
+    return 'active'
+
+
+def _params_digest(query_params):
+    items = sorted((key, tuple(query_params.getlist(key))) for key in query_params)
+    return hashlib.md5(repr(items).encode()).hexdigest()
+
+
+def list_key(user, query_params, band=None):
+    # `band` is the pricing slot: quoted prices are only valid within it
+    return 'stations:list:{}:{}:{}:{}'.format(
+        variant_for(user), global_version(), band, _params_digest(query_params)
+    )
+
+
+def detail_key(user, station_id, query_params, band=None):
+    return 'stations:detail:{}:{}:{}:{}:{}'.format(
+        variant_for(user), station_id, station_version(station_id), band, _params_digest(query_params)
+    )
+
+
+async def alist_key(user, query_params, band=None):
+    return 'stations:list:{}:{}:{}:{}'.format(
+        variant_for(user), await _aversion(get_cache(), GLOBAL_VERSION_KEY), band, _params_digest(query_params)
+    )
+
+
+async def adetail_key(user, station_id, query_params, band=None):
+    version = await _aversion(get_cache(), STATION_VERSION_KEY.format(station_id))
+    return 'stations:detail:{}:{}:{}:{}:{}'.format(
+        variant_for(user), station_id, version, band, _params_digest(query_params)
+    )
+
+
+def plain(data):
+    """
+    Strip DRF's ReturnDict/ReturnList wrappers (which hold a serializer
+    reference) so the data pickles cheaply.
+    """
+    if isinstance(data, dict):
+        return {key: plain(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [plain(value) for value in data]
+    return data
+
+
+def record(hit):
+    _incr(get_cache(), HITS_KEY if hit else MISSES_KEY)
+
+
+async def arecord(hit):
+    await _aincr(get_cache(), HITS_KEY if hit else MISSES_KEY)
+
+
+def stats():
+    cache = get_cache()
+    hits = cache.get(HITS_KEY, 0)
+    misses = cache.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(hits / total, 4) if total else None,
+        'version': global_version(),
+    }
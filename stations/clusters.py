@@ -0,0 +1,206 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+from . import geo
+from .models import Station, StationCluster
+
+# Map zoom level -> geohash precision of the cluster tier shown at that zoom.
+# Above CLUSTER_MAX_ZOOM the viewport returns individual stations.
+ZOOM_PRECISION = {
+    0: 1, 1: 1, 2: 1,
+    3: 2, 4: 2, 5: 2,
+    6: 3, 7: 3, 8: 3,
+    9: 4, 10: 4,
+    11: 5, 12: 5,
+}
+CLUSTER_MAX_ZOOM = max(ZOOM_PRECISION)
+TIERS = sorted(set(ZOOM_PRECISION.values()))
+
+# Above this many touched cells, deltas are applied with bulk queries
+BULK_DELTAS = 50
+
+
+def precision_for_zoom(zoom):
+    if zoom > CLUSTER_MAX_ZOOM:
+        return None
+    return ZOOM_PRECISION[max(zoom, 0)]
+
+
+def _add_state(deltas, state, sign):
+    if state is None:
+        return
+    geohash, lat, lng, is_active = state
+    if not is_active:
+        return
+    for precision in TIERS:
+        delta = deltas[(precision, geohash[:precision])]
+        delta[0] += sign
+        delta[1] += sign * lat
+        delta[2] += sign * lng
+
+
+def state_deltas(changes):
+    """
+    Fold (old_state, new_state) pairs into per-cell deltas of
+    [count, lat_sum, lng_sum]. A state is Station.index_state() or None.
+    """
+    deltas = defaultdict(lambda: [0, 0.0, 0.0])
+    for old, new in changes:
+        if old == new:
+            continue
+        _add_state(deltas, old, -1)
+        _add_state(deltas, new, 1)
+    return {key: value for key, value in deltas.items() if value[0] or value[1] or value[2]}
+
+
+def apply_deltas(deltas):
+    if len(deltas) > BULK_DELTAS:
+        _apply_bulk(deltas)
+        return
+
+    with transaction.atomic():
+        for key, delta in deltas.items():
+            _apply_one(key, delta)
+
+
+def _apply_one(key, delta):
+    precision, cell = key
+    count, lat_sum, lng_sum = delta
+    updated = StationCluster.objects.filter(precision=precision, cell=cell).update(
+        count=F('count') + count,
+        lat_sum=F('lat_sum') + lat_sum,
+        lng_sum=F('lng_sum') + lng_sum,
+    )
+    if updated:
+        return
+
+    cell_lat, cell_lng = geo.decode_center(cell)
+    try:
+        with transaction.atomic():
+            StationCluster.objects.create(
+                precision=precision, cell=cell,
+                cell_lat=cell_lat, cell_lng=cell_lng,
+                count=count, lat_sum=lat_sum, lng_sum=lng_sum,
+            )
+    except IntegrityError:
+        # Another writer created the row first
+        StationCluster.objects.filter(precision=precision, cell=cell).update(
+            count=F('count') + count,
+            lat_sum=F('lat_sum') + lat_sum,
+            lng_sum=F('lng_sum') + lng_sum,
+        )
+
+
+def _apply_bulk(deltas):
+    """
+    apply_deltas for large batches (bulk imports): lock the existing cells,
+    update them in one bulk_update and insert the rest in one bulk_create.
+    """
+    with transaction.atomic():
+        existing = StationCluster.objects.select_for_update().filter(
+            precision__in={precision for precision, _ in deltas},
+            cell__in={cell for _, cell in deltas},
+        )
+        updated = []
+        for cluster in existing:
+            delta = deltas.get((cluster.precision, cluster.cell))
+            if delta is None:
+                continue
+            cluster.count = F('count') + delta[0]
+            cluster.lat_sum = F('lat_sum') + delta[1]
+            cluster.lng_sum = F('lng_sum') + delta[2]
+            updated.append(cluster)
+        StationCluster.objects.bulk_update(updated, ['count', 'lat_sum', 'lng_sum'], batch_size=500)
+
+        seen = {(cluster.precision, cluster.cell) for cluster in updated}
+        missing = {key: delta for key, delta in deltas.items() if key not in seen}
+        created = []
+        for (precision, cell), (count, lat_sum, lng_sum) in missing.items():
+            cell_lat, cell_lng = geo.decode_center(cell)
+            created.append(StationCluster(
+                precision=precision, cell=cell,
+                cell_lat=cell_lat, cell_lng=cell_lng,
+                count=count, lat_sum=lat_sum, lng_sum=lng_sum,
+            ))
+        try:
+            with transaction.atomic():
+                StationCluster.objects.bulk_create(created, batch_size=500)
+        except IntegrityError:
+            # Another writer created some of these cells; fall back to the
+            # row-at-a-time upsert for them
+            for key, delta in missing.items():
+                _apply_one(key, delta)
+
+
+def apply_changes(changes):
+    deltas = state_deltas(changes)
+    if deltas:
+        apply_deltas(deltas)
+
+
+def station_changed(station, deleted=False):
+    old = getattr(station, '_indexed', None)
+    new = None if deleted else station.index_state()
+    apply_changes([(old, new)])
+    station._indexed = new
+
+
+def rebuild(batch_size=2000):
+    """
+    Recompute every cluster from the stations table.
+    """
+    deltas = defaultdict(lambda: [0, 0.0, 0.0])
+    rows = (
+        Station.objects.filter(is_active=True)
+        .values_list('geohash', 'latitude', 'longitude')
+        .iterator(chunk_size=batch_size)
+    )
+    for geohash, lat, lng in rows:
+        _add_state(deltas, (geohash, lat, lng, True), 1)
+
+    clusters = []
+    for (precision, cell), (count, lat_sum, lng_sum) in deltas.items():
+        cell_lat, cell_lng = geo.decode_center(cell)
+        clusters.append(StationCluster(
+            precision=precision, cell=cell,
+            cell_lat=cell_lat, cell_lng=cell_lng,
+            count=count, lat_sum=lat_sum, lng_sum=lng_sum,
+        ))
+
+    with transaction.atomic():
+        StationCluster.objects.all().delete()
+        StationCluster.objects.bulk_create(clusters, batch_size=batch_size)
+    return len(clusters)
+
+
+def clusters_in_bbox(precision, min_lat, min_lng, max_lat, max_lng, limit):
+    """
+    Non-empty clusters of one tier whose cell overlaps the bounding box.
+    """
+    lat_pad, lng_pad = geo.cell_degrees(precision)
+    qs = StationCluster.objects.filter(
+        precision=precision,
+        count__gt=0,
+        cell_lat__gte=min_lat - lat_pad / 2,
+        cell_lat__lte=max_lat + lat_pad / 2,
+    )
+    qs = qs.filter(bbox_lng_q('cell_lng', min_lng - lng_pad / 2, max_lng + lng_pad / 2))
+
+    return [
+        {
+            'cell': cluster.cell,
+            'count': cluster.count,
+            'latitude': cluster.lat_sum / cluster.count,
+            'longitude': cluster.lng_sum / cluster.count,
+        }
+        for cluster in qs[:limit]
+    ]
+
+
+def bbox_lng_q(field, min_lng, max_lng):
+    # A box crossing the antimeridian has min_lng > max_lng
+    if min_lng <= max_lng:
+        return Q(**{f'{field}__gte': min_lng, f'{field}__lte': max_lng})
+    return Q(**{f'{field}__gte': min_lng}) | Q(**{f'{field}__lte': max_lng})
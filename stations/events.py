@@ -0,0 +1,45 @@
+"""
+Push notifications for watched stations (channel 'station:<id>'): an
+event when a station is activated or deactivated, re-priced or changes
+type (including a temporary type being set or running out).
+"""
+from evfinder import events
+
+WATCHED = ('is_active', 'price', 'type', 'temp_type', 'temp_until')
+
+
+def channel(station_id):
+    return f'station:{station_id}'
+
+
+def watch_state(station):
+    # Read from __dict__ so deferred fields never trigger a query
+    return tuple(station.__dict__.get(name) for name in WATCHED)
+
+
+def _payload(station):
+    return {
+        'id': station.pk,
+        'is_active': station.is_active,
+        'price': station.price,
+        'type': station.current_type(),
+    }
+
+
+def stations_changed(stations):
+    """
+    Publish the stations whose watched fields differ from when they were
+    loaded. New stations have no watchers yet and are skipped.
+    """
+    messages = []
+    for station in stations:
+        old = getattr(station, '_watched', None)
+        new = watch_state(station)
+        if old is not None and old != new:
+            messages.append((channel(station.pk), 'station', _payload(station)))
+        station._watched = new
+    events.publish(messages)
+
+
+def station_deleted(station_id):
+    events.publish([(channel(station_id), 'station', {'id': station_id, 'deleted': True})])
@@ -0,0 +1,16 @@
+from rest_framework import filters
+
+from . import search
+
+
+class StationSearchFilter(filters.SearchFilter):
+    """
+    `?search=` over name/description with relevance ranking, backed by
+    MySQL FULLTEXT or the in-process inverted index (see stations.search).
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return search.search_filter(queryset, terms)
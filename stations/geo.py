@@ -0,0 +1,201 @@
+import math
+
+# Geohash helpers used to index stations spatially.
+# Every station stores its geohash; a radius search only looks at the
+# cells covering the circle's bounding box, at the finest precision that
+# needs at most MAX_COVER_CELLS of them.
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {c: i for i, c in enumerate(BASE32)}
+
+STORED_PRECISION = 9
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+# Upper bound on the prefixes a radius search ORs together
+MAX_COVER_CELLS = 16
+
+
+def encode(lat, lng, precision=STORED_PRECISION):
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+
+    while len(chars) < precision:
+        if even:
+            mid = (lng_lo + lng_hi) / 2
+            if lng >= mid:
+                bits = (bits << 1) | 1
+                lng_lo = mid
+            else:
+                bits <<= 1
+                lng_hi = mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_lo = mid
+            else:
+                bits <<= 1
+                lat_hi = mid
+        even = not even
+        bit_count += 1
+
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+
+def decode_bounds(geohash):
+    """
+    Return (lat_lo, lat_hi, lng_lo, lng_hi) of a geohash cell.
+    """
+    lat_lo, lat_hi = -90.0, 90.0
+    lng_lo, lng_hi = -180.0, 180.0
+    even = True
+
+    for char in geohash:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            if even:
+                mid = (lng_lo + lng_hi) / 2
+                if bit:
+                    lng_lo = mid
+                else:
+                    lng_hi = mid
+            else:
+                mid = (lat_lo + lat_hi) / 2
+                if bit:
+                    lat_lo = mid
+                else:
+                    lat_hi = mid
+            even = not even
+
+    return lat_lo, lat_hi, lng_lo, lng_hi
+
+
+def decode_center(geohash):
+    lat_lo, lat_hi, lng_lo, lng_hi = decode_bounds(geohash)
+    return (lat_lo + lat_hi) / 2, (lng_lo + lng_hi) / 2
+
+
+def neighbours(geohash):
+    """
+    The cell itself plus the (up to) 8 cells surrounding it.
+    """
+    lat_lo, lat_hi, lng_lo, lng_hi = decode_bounds(geohash)
+    lat_step = lat_hi - lat_lo
+    lng_step = lng_hi - lng_lo
+    lat_c = (lat_lo + lat_hi) / 2
+    lng_c = (lng_lo + lng_hi) / 2
+    precision = len(geohash)
+
+    cells = []
+    for dlat in (-1, 0, 1):
+        lat = lat_c + dlat * lat_step
+        if lat < -90 or lat > 90:
+            continue
+        for dlng in (-1, 0, 1):
+            lng = lng_c + dlng * lng_step
+            # wrap around the antimeridian
+            lng = (lng + 180) % 360 - 180
+            cell = encode(lat, lng, precision)
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def _bounding_box(lat, lng, radius_km):
+    """
+    (lat_lo, lat_hi, lng_lo, lng_hi) around the circle; the longitude
+    span is taken at its poleward edge, where degrees are shortest.
+    """
+    dlat = radius_km / KM_PER_DEGREE
+    lat_lo, lat_hi = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+    shrink = math.cos(math.radians(max(abs(lat_lo), abs(lat_hi))))
+    dlng = 180.0 if shrink < 1e-6 else min(dlat / shrink, 180.0)
+    return lat_lo, lat_hi, lng - dlng, lng + dlng
+
+
+def precision_for_radius(radius_km, lat=0.0):
+    """
+    Finest precision whose cells are still at least radius_km across at
+    the circle's poleward edge, so that the 3x3 block around the centre
+    covers the whole circle.
+    """
+    lat_lo, lat_hi, lng_lo, lng_hi = _bounding_box(lat, 0.0, radius_km)
+    best = 1
+    for precision in range(1, STORED_PRECISION + 1):
+        lat_step, lng_step = cell_degrees(precision)
+        if lat_step >= (lat_hi - lat_lo) / 2 and lng_step >= (lng_hi - lng_lo) / 2:
+            best = precision
+        else:
+            break
+    return best
+
+
+def _cell_ranges(box, precision):
+    lat_lo, lat_hi, lng_lo, lng_hi = box
+    lat_step, lng_step = cell_degrees(precision)
+    lat_cells = round(180.0 / lat_step)
+    lng_cells = round(360.0 / lng_step)
+    rows = range(
+        min(int((lat_lo + 90.0) // lat_step), lat_cells - 1),
+        min(int((lat_hi + 90.0) // lat_step), lat_cells - 1) + 1,
+    )
+    first, last = int((lng_lo + 180.0) // lng_step), int((lng_hi + 180.0) // lng_step)
+    # Columns past the antimeridian wrap around
+    columns = range(first, min(last, first + lng_cells - 1) + 1)
+    return rows, columns, lat_step, lng_step, lng_cells
+
+
+def cover(lat, lng, radius_km):
+    """
+    Geohash prefixes whose cells together cover the circle of radius_km
+    around (lat, lng): the finest precision needing at most
+    MAX_COVER_CELLS cells, and never coarser than the 3x3 block of
+    precision_for_radius().
+    """
+    box = _bounding_box(lat, lng, radius_km)
+    precision = precision_for_radius(radius_km, lat)
+    while precision < STORED_PRECISION:
+        rows, columns, *_ = _cell_ranges(box, precision + 1)
+        if len(rows) * len(columns) > MAX_COVER_CELLS:
+            break
+        precision += 1
+
+    rows, columns, lat_step, lng_step, lng_cells = _cell_ranges(box, precision)
+    cells = []
+    for row in rows:
+        cell_lat = -90.0 + (row + 0.5) * lat_step
+        for column in columns:
+            cell = encode(cell_lat, -180.0 + (column % lng_cells + 0.5) * lng_step, precision)
+            if cell not in cells:
+                cells.append(cell)
+    return cells
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cell_degrees(precision):
+    """
+    (lat_degrees, lng_degrees) spanned by a cell of the given precision.
+    """
+    bits = precision * 5
+    lng_bits = (bits + 1) // 2
+    lat_bits = bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
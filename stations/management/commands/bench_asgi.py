@@ -0,0 +1,184 @@
+import asyncio
+import io
+import os
+import random
+import resource
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.asgi import get_asgi_application
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+
+from stations import geo
+from stations.models import Station
+from users.models import Users
+
+DEFAULT_PATHS = [
+    "/api/stations/",
+    "/api/stations/nearby/?lat=12.97&lng=77.59&radius_km=25",
+]
+
+
+def _rss():
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak, not current, outside Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _PeakRSS:
+    """
+    Samples RSS in the background while a run is in progress.
+    """
+
+    def __enter__(self):
+        self.base = self.peak = _rss()
+        self.running = True
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def _sample(self):
+        while self.running:
+            self.peak = max(self.peak, _rss())
+            time.sleep(0.005)
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare requests/sec and memory per concurrent connection for the WSGI "
+        "deployment (sync views, a thread per connection) and the ASGI one "
+        "(async views on one event loop), driving both handlers in-process"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", default=DEFAULT_PATHS)
+        parser.add_argument("--requests", type=int, default=2000)
+        parser.add_argument("--concurrency", type=int, default=100)
+        parser.add_argument("--seed", type=int, default=0, help="Create this many temporary stations around the default nearby point")
+        parser.add_argument("--token", help="Bearer token to send")
+
+    def handle(self, *args, **options):
+        owner = self._seed(options["seed"]) if options["seed"] else None
+        try:
+            for path in options["paths"]:
+                self.stdout.write(self.style.MIGRATE_HEADING(path))
+                self._report("wsgi", self._run_wsgi(path, options), options)
+                self._report("asgi", self._run_asgi(path, options), options)
+        finally:
+            if owner is not None:
+                # Cascades to the stations
+                owner.delete()
+
+    def _seed(self, count):
+        tag = uuid.uuid4().hex[:8]
+        owner = Users.objects.create_user(
+            username=f"bench-{tag}", email=f"bench-{tag}@example.invalid", password=None, role="chargerowner",
+        )
+        stations = []
+        for i in range(count):
+            latitude, longitude = 12.97 + random.uniform(-0.2, 0.2), 77.59 + random.uniform(-0.2, 0.2)
+            stations.append(Station(
+                owner=owner, name=f"bench-{tag}-{i}", latitude=latitude, longitude=longitude,
+                # bulk_create skips save(), which fills the column nearby() scans
+                geohash=geo.encode(latitude, longitude),
+                type=random.choice(["bike", "car", "both"]),
+                price=Decimal(random.randint(50, 500)) / 10, connector_count=random.randint(1, 8),
+            ))
+        Station.objects.bulk_create(stations, batch_size=1000)
+        return owner
+
+    def _run_wsgi(self, path, options):
+        app = get_wsgi_application()
+        url, _, query = path.partition("?")
+        headers = {"HTTP_AUTHORIZATION": f"Bearer {options['token']}"} if options["token"] else {}
+        statuses = []
+
+        def call(_):
+            environ = {
+                "REQUEST_METHOD": "GET", "PATH_INFO": url, "QUERY_STRING": query,
+                "SERVER_NAME": "bench", "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1",
+                "HTTP_HOST": "bench", "wsgi.url_scheme": "http", "wsgi.input": io.BytesIO(),
+                "wsgi.errors": io.StringIO(), "wsgi.multithread": True, "wsgi.multiprocess": False,
+                "wsgi.run_once": False, "wsgi.version": (1, 0), **headers,
+            }
+            status = []
+            body = app(environ, lambda code, response_headers, exc_info=None: status.append(code))
+            b"".join(body)
+            body.close()
+            statuses.append(status[0].split()[0])
+
+        call(None)
+        statuses.clear()
+        with _PeakRSS() as memory, ThreadPoolExecutor(options["concurrency"]) as pool:
+            started = time.perf_counter()
+            list(pool.map(call, range(options["requests"])))
+            seconds = time.perf_counter() - started
+        return seconds, memory, statuses
+
+    def _run_asgi(self, path, options):
+        url, _, query = path.partition("?")
+        headers = [(b"host", b"bench")]
+        if options["token"]:
+            headers.append((b"authorization", f"Bearer {options['token']}".encode()))
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": url, "raw_path": url.encode(), "query_string": query.encode(),
+            "root_path": "", "headers": headers, "client": ("127.0.0.1", 0), "server": ("bench", 80),
+        }
+        statuses = []
+
+        async def call(app, limit):
+            async with limit:
+                messages = [{"type": "http.request", "body": b"", "more_body": False}]
+                done = asyncio.Event()
+
+                async def receive():
+                    if messages:
+                        return messages.pop()
+                    # The handler listens for a disconnect until it has responded
+                    await done.wait()
+                    return {"type": "http.disconnect"}
+
+                async def send(message):
+                    if message["type"] == "http.response.start":
+                        statuses.append(str(message["status"]))
+                    elif not message.get("more_body"):
+                        done.set()
+
+                await app(dict(scope), receive, send)
+
+        async def run():
+            app = get_asgi_application()
+            limit = asyncio.Semaphore(options["concurrency"])
+            await call(app, limit)
+            statuses.clear()
+            with _PeakRSS() as memory:
+                started = time.perf_counter()
+                await asyncio.gather(*(call(app, limit) for _ in range(options["requests"])))
+                return time.perf_counter() - started, memory
+
+        with override_settings(ROOT_URLCONF="evfinder.asgi_urls"):
+            seconds, memory = asyncio.run(run())
+        return seconds, memory, statuses
+
+    def _report(self, label, result, options):
+        seconds, memory, statuses = result
+        codes = ", ".join(f"{code}x{statuses.count(code)}" for code in sorted(set(statuses)))
+        per_connection = max(memory.peak - memory.base, 0) / options["concurrency"]
+        self.stdout.write(
+            f"{label}  {options['requests'] / seconds:8.0f} req/s  "
+            f"rss {memory.base / 2**20:6.1f} MiB  +{per_connection / 1024:7.1f} KiB per connection  "
+            f"[{codes}]"
+        )
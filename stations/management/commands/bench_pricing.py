@@ -0,0 +1,93 @@
+import random
+import time
+import uuid
+from datetime import time as clock
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from stations import pricing
+from stations.models import Station, TariffBand
+from users.models import Users
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Quote a synthetic station list with the vectorized pricing engine and "
+        "report the per-station cost (all rows are rolled back)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--stations", type=int, default=10000)
+        parser.add_argument("--schedules", type=int, default=20, help="Distinct tariff schedules to spread over the stations")
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._bench(options)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        finally:
+            pricing.reset_schedules()
+
+    def _bench(self, options):
+        tag = uuid.uuid4().hex[:8]
+        owner = Users.objects.create_user(
+            username=f"bench-owner-{tag}", email=f"bench-owner-{tag}@example.invalid",
+            password=None, role="chargerowner",
+        )
+        Station.objects.bulk_create([
+            Station(
+                owner=owner, name=f"bench-{tag}-{i}",
+                latitude=random.uniform(8, 30), longitude=random.uniform(70, 90),
+                type=random.choice(["bike", "car", "both"]),
+                price=Decimal(random.randint(50, 500)) / 10,
+                connector_count=random.randint(1, 8),
+            )
+            for i in range(options["stations"])
+        ], batch_size=1000)
+        stations = list(Station.objects.filter(owner=owner).with_current_type())
+
+        bands = []
+        for station in stations:
+            schedule = hash(station.pk) % max(options["schedules"], 1)
+            bands.append(TariffBand(
+                station=station, start_time=clock(7 + schedule % 4), end_time=clock(10 + schedule % 4),
+                multiplier=Decimal("1.25") + Decimal(schedule) / 100,
+            ))
+            bands.append(TariffBand(
+                station=station, days=TariffBand.SATURDAY | TariffBand.SUNDAY,
+                start_time=clock(22), end_time=clock(6), multiplier=Decimal("0.80"), priority=1,
+            ))
+        TariffBand.objects.bulk_create(bands, batch_size=1000)
+
+        # The tariff version only moves on commit, so drop any compiled grid
+        # and let the first quote compile the benchmark bands
+        pricing.reset_schedules()
+        started = time.perf_counter()
+        schedules = pricing.get_schedules()
+        compile_seconds = time.perf_counter() - started
+
+        now = timezone.now()
+        timings = []
+        for _ in range(options["repeat"]):
+            started = time.perf_counter()
+            pricing.attach_quotes(stations, at=now)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        median = timings[len(timings) // 2]
+
+        count = len(stations)
+        self.stdout.write(f"stations:          {count}")
+        self.stdout.write(f"schedules:         {len(schedules.grid) - 1} distinct")
+        self.stdout.write(f"compile:           {compile_seconds * 1000:.1f} ms")
+        self.stdout.write(f"quote list:        {median * 1000:.2f} ms median of {len(timings)}")
+        self.stdout.write(self.style.SUCCESS(f"per station:       {median / count * 1e6:.2f} us"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from stations.tasks import clear_expired_temp_types
+
+
+class Command(BaseCommand):
+    help = "Clear temp_type/temp_until on stations whose temporary type has expired"
+
+    def handle(self, *args, **options):
+        cleared = clear_expired_temp_types()
+        self.stdout.write(self.style.SUCCESS(f"Cleared {cleared} expired temp types"))
@@ -0,0 +1,38 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from stations import bulk
+from users.models import Users
+
+
+class Command(BaseCommand):
+    help = "Create or update stations for an owner from a CSV or NDJSON file"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--owner', required=True, help="Owner username or id")
+        parser.add_argument('--format', dest='fmt', choices=bulk.FORMATS,
+                            help="Defaults to the file extension")
+        parser.add_argument('--batch-size', type=int, default=bulk.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        owner_ref = options['owner']
+        lookup = {'pk': int(owner_ref)} if owner_ref.isdigit() else {'username': owner_ref}
+        try:
+            owner = Users.objects.get(**lookup)
+        except Users.DoesNotExist:
+            raise CommandError(f"Owner {owner_ref} not found")
+
+        fmt = options['fmt'] or bulk.format_for(None, options['path'])
+        if fmt is None:
+            raise CommandError("Can't tell the format from the file name; pass --format")
+
+        with open(options['path'], 'rb') as stream:
+            result = bulk.import_stations(owner, stream, fmt, batch_size=options['batch_size'])
+
+        for error in result.errors:
+            self.stderr.write(f"line {error['line']}: {json.dumps(error['errors'])}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result.created}, updated {result.updated}, failed {result.failed}"
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from stations import clusters
+
+
+class Command(BaseCommand):
+    help = "Recompute the per-zoom station cluster counts from the stations table"
+
+    def handle(self, *args, **options):
+        count = clusters.rebuild()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} clusters"))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from stations import ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute rating_avg, rating_count and the star histogram on every station"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        written = ratings.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt ratings for {written} stations"))
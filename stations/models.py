@@ -1,7 +1,78 @@
+import heapq
+
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
+from django.db.models import Case, CharField, F, Q, When
+from django.db.models.functions import Now
 from users.views import Users
 from django.utils import timezone
 
+from . import events as station_events
+from . import geo
+
+class StationQuerySet(models.QuerySet):
+
+    def with_current_type(self):
+        """
+        Annotate `effective_type`: temp_type while it is still valid,
+        otherwise the base type. Resolved in SQL so reads never write.
+        """
+        temp_valid = (
+            Q(temp_type__isnull=False)
+            & ~Q(temp_type='')
+            & (Q(temp_until__isnull=True) | Q(temp_until__gte=Now()))
+        )
+        return self.annotate(effective_type=Case(
+            When(temp_valid, then=F('temp_type')),
+            default=F('type'),
+            output_field=CharField(),
+        ))
+
+    def expired_temp_types(self):
+        return self.filter(temp_until__isnull=False, temp_until__lt=Now())
+
+    def nearest(self, lat, lng, radius_km, limit):
+        """
+        Stations within radius_km of (lat, lng), closest first.
+        Only the geohash cells around the point are scanned; each returned
+        station carries a `distance_km` attribute.
+        """
+        candidates = self._near_candidates(lat, lng, radius_km)
+        ranked = _rank(candidates.iterator(chunk_size=2000), lat, lng, radius_km, limit)
+        stations = self.filter(pk__in=[pk for _, pk in ranked]).in_bulk()
+        return _with_distances(ranked, stations)
+
+    async def anearest(self, lat, lng, radius_km, limit):
+        candidates = self._near_candidates(lat, lng, radius_km)
+        ranked = _rank([row async for row in candidates], lat, lng, radius_km, limit)
+        stations = await self.filter(pk__in=[pk for _, pk in ranked]).ain_bulk()
+        return _with_distances(ranked, stations)
+
+    def _near_candidates(self, lat, lng, radius_km):
+        cells_q = Q()
+        for cell in geo.cover(lat, lng, radius_km):
+            cells_q |= Q(geohash__startswith=cell)
+        return self.filter(cells_q).values_list('id', 'latitude', 'longitude')
+
+
+def _rank(candidates, lat, lng, radius_km, limit):
+    ranked = []
+    for pk, s_lat, s_lng in candidates:
+        distance = geo.haversine_km(lat, lng, s_lat, s_lng)
+        if distance <= radius_km:
+            ranked.append((distance, pk))
+    return heapq.nsmallest(limit, ranked)
+
+
+def _with_distances(ranked, stations):
+    result = []
+    for distance, pk in ranked:
+        station = stations[pk]
+        station.distance_km = round(distance, 3)
+        result.append(station)
+    return result
+
+
 class Station(models.Model):
     TYPE_BIKE = 'bike'
     TYPE_CAR = 'car'
@@ -18,25 +89,82 @@ class Station(models.Model):
     description = models.TextField(blank=True, null=True)
     latitude = models.FloatField()
     longitude = models.FloatField()
+    geohash = models.CharField(max_length=geo.STORED_PRECISION, db_index=True, editable=False, blank=True)
     type = models.CharField(max_length=10, choices=TYPE_CHOICES, default=TYPE_BOTH)
 
     price = models.DecimalField(max_digits=8, decimal_places=2, default=0.00)
+    connector_count = models.PositiveSmallIntegerField(default=1)
 
     temp_type = models.CharField(max_length=10, choices=TYPE_CHOICES, blank=True, null=True)
     temp_until = models.DateTimeField(blank=True, null=True)
 
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    # Denormalized rating aggregates, maintained by stations.ratings
+    rating_avg = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    objects = StationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['latitude', 'longitude']),
+            models.Index(fields=['created_at', 'id']),
+            models.Index(fields=['price', 'id']),
+            models.Index(fields=['rating_avg', 'id']),
+            models.Index(fields=['rating_count', 'id']),
+        ]
+
+    def save(self, *args, **kwargs):
+        # Keep the spatial index column in sync with the coordinates
+        self.geohash = geo.encode(self.latitude, self.longitude)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            extra = {'updated_at'}
+            if 'latitude' in update_fields or 'longitude' in update_fields:
+                extra.add('geohash')
+            kwargs['update_fields'] = set(update_fields) | extra
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the indexed state so writes can update clusters incrementally
+        instance._indexed = instance.index_state()
+        # ...and the fields station watchers are notified about
+        instance._watched = station_events.watch_state(instance)
+        return instance
+
+    def index_state(self):
+        # Read from __dict__ so deferred fields never trigger a query
+        fields = ('geohash', 'latitude', 'longitude', 'is_active')
+        values = [self.__dict__.get(name) for name in fields]
+        if any(value is None for value in values) or not values[0]:
+            return None
+        return tuple(values)
+
+    def rating_histogram(self):
+        return {str(star): getattr(self, f'rating_{star}') for star in range(1, 6)}
 
     def current_type(self):
         """
         Return the current type considering temp_type and temp_until.
-        Automatically clear expired temp_type.
+        Never writes: expired temp types are cleared in bulk by
+        stations.tasks.clear_expired_temp_types.
         """
+        effective = self.__dict__.get('effective_type')
+        if effective is not None:
+            return effective
         if self.temp_until and timezone.now() > self.temp_until:
-            self.temp_type = None
-            self.temp_until = None
-            self.save(update_fields=['temp_type', 'temp_until'])
+            return self.type
         return self.temp_type or self.type
 
     def __str__(self):
@@ -46,12 +174,73 @@ class Station(models.Model):
 class StationRating(models.Model):
     station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='ratings')
     user = models.ForeignKey(Users, on_delete=models.CASCADE)
-    rating = models.PositiveIntegerField(default=1)
+    rating = models.PositiveIntegerField(default=1, validators=[MinValueValidator(1), MaxValueValidator(5)])
     comment = models.TextField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ('station', 'user')
+        indexes = [
+            models.Index(fields=['created_at', 'id']),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored rating so updates adjust the station aggregates
+        instance._counted = (instance.__dict__.get('station_id'), instance.__dict__.get('rating'))
+        return instance
 
     def __str__(self):
         return f"{self.station.name} - {self.rating}"
+
+
+class TariffBand(models.Model):
+    """
+    A time-of-use multiplier on a station's base price for part of the
+    week, in local time. end_time at or before start_time wraps past
+    midnight. Where bands overlap the higher priority wins.
+    """
+    MONDAY, TUESDAY, WEDNESDAY, THURSDAY, FRIDAY, SATURDAY, SUNDAY = (1 << day for day in range(7))
+    EVERY_DAY = 0b1111111
+
+    station = models.ForeignKey(Station, on_delete=models.CASCADE, related_name='tariff_bands')
+    days = models.PositiveSmallIntegerField(
+        default=EVERY_DAY, validators=[MinValueValidator(1), MaxValueValidator(EVERY_DAY)],
+        help_text="Weekday bitmask, Monday = 1 ... Sunday = 64",
+    )
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    multiplier = models.DecimalField(max_digits=5, decimal_places=2, validators=[MinValueValidator(0)])
+    priority = models.SmallIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['station', 'priority']),
+        ]
+
+    def __str__(self):
+        return f"{self.station_id} {self.start_time}-{self.end_time} x{self.multiplier}"
+
+
+class StationCluster(models.Model):
+    """
+    Precomputed count of active stations per geohash cell, one row per
+    (precision, cell). Maintained incrementally by stations.clusters.
+    """
+    precision = models.PositiveSmallIntegerField()
+    cell = models.CharField(max_length=12)
+    cell_lat = models.FloatField()
+    cell_lng = models.FloatField()
+    count = models.IntegerField(default=0)
+    lat_sum = models.FloatField(default=0)
+    lng_sum = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = ('precision', 'cell')
+        indexes = [
+            models.Index(fields=['precision', 'cell_lat', 'cell_lng']),
+        ]
+
+    def __str__(self):
+        return f"{self.cell} ({self.count})"
@@ -0,0 +1,307 @@
+"""
+Time-of-use station pricing, evaluated in bulk with NumPy.
+
+Station.price is the base hourly rate. Tariff bands are compiled once
+into a week grid of 15-minute slots (one row per distinct schedule,
+shared by every station that uses it), so quoting a whole station list
+is a few array operations: each station's grid row at the current slot,
+times the vehicle-type multiplier, times surge from the occupancy index.
+Compiled grids are kept per process and rebuilt when the shared tariff
+version changes.
+"""
+import threading
+from datetime import timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from booking.availability import SLOT_MINUTES, SLOTS_PER_DAY, day_slots, lapsed, without_lapsed
+from booking.models import StationDayAvailability
+from . import cache
+from .models import TariffBand
+
+WEEK_SLOTS = 7 * SLOTS_PER_DAY
+SLOT = timedelta(minutes=SLOT_MINUTES)
+
+# Above this many stations, occupancy is read for the whole day rather
+# than with a long IN (...) list
+OCCUPANCY_IN_LIMIT = 1000
+
+CENT = Decimal('0.01')
+
+
+class Schedules:
+    """
+    Compiled tariff grids: `grid[row]` holds the multiplier for every
+    slot of the week; row 0 is the flat schedule of stations without
+    bands. `station_ids` (sorted) maps to `rows`.
+    """
+
+    def __init__(self, version, station_ids, rows, grid):
+        self.version = version
+        self.station_ids = station_ids
+        self.rows = rows
+        self.grid = grid
+
+    def rows_for(self, ids):
+        if not len(self.station_ids):
+            return np.zeros(len(ids), dtype=np.intp)
+        position = np.searchsorted(self.station_ids, ids)
+        position = np.minimum(position, len(self.station_ids) - 1)
+        return np.where(self.station_ids[position] == ids, self.rows[position], 0)
+
+
+def _minute_slot(value, round_up=False):
+    minutes = value.hour * 60 + value.minute
+    if round_up:
+        return -(-minutes // SLOT_MINUTES)
+    return minutes // SLOT_MINUTES
+
+
+def _band_mask(days, start_time, end_time):
+    first = _minute_slot(start_time)
+    last = _minute_slot(end_time, round_up=True)
+
+    day = np.zeros(SLOTS_PER_DAY, dtype=bool)
+    spill = np.zeros(SLOTS_PER_DAY, dtype=bool)
+    if last > first:
+        day[first:last] = True
+    else:
+        # Wraps past midnight into the next day
+        day[first:] = True
+        spill[:last] = True
+
+    mask = np.zeros((7, SLOTS_PER_DAY), dtype=bool)
+    for weekday in range(7):
+        if days & (1 << weekday):
+            mask[weekday] |= day
+            mask[(weekday + 1) % 7] |= spill
+    return mask.reshape(WEEK_SLOTS)
+
+
+def compile_schedules(version=None):
+    bands = (
+        TariffBand.objects
+        .order_by('station_id', 'priority', 'id')
+        .values_list('station_id', 'days', 'start_time', 'end_time', 'multiplier')
+    )
+
+    per_station = {}
+    for station_id, *band in bands.iterator(chunk_size=2000):
+        per_station.setdefault(station_id, []).append(tuple(band))
+
+    profiles = {}
+    station_ids = np.fromiter(sorted(per_station), dtype=np.int64, count=len(per_station))
+    rows = np.empty(len(station_ids), dtype=np.intp)
+    for position, station_id in enumerate(station_ids):
+        key = tuple(per_station[station_id])
+        rows[position] = profiles.setdefault(key, len(profiles) + 1)
+
+    grid = np.ones((len(profiles) + 1, WEEK_SLOTS))
+    for key, row in profiles.items():
+        # Lower priority first, so higher priority bands overwrite them
+        for days, start_time, end_time, multiplier in key:
+            grid[row, _band_mask(days, start_time, end_time)] = float(multiplier)
+
+    return Schedules(version, station_ids, rows, grid)
+
+
+_schedules = None
+_schedules_lock = threading.Lock()
+
+
+def get_schedules():
+    global _schedules
+
+    version = cache.tariff_version()
+    schedules = _schedules
+    if schedules is None or schedules.version != version:
+        with _schedules_lock:
+            if _schedules is None or _schedules.version != version:
+                _schedules = compile_schedules(version)
+            schedules = _schedules
+    return schedules
+
+
+async def aget_schedules():
+    schedules = _schedules
+    if schedules is not None and schedules.version == await cache.atariff_version():
+        return schedules
+    # Compiling is a rare, bulk read; run it on a worker thread
+    return await sync_to_async(get_schedules)()
+
+
+def reset_schedules():
+    global _schedules
+    _schedules = None
+
+
+def week_slot(at=None):
+    """
+    Index of the local 15-minute slot of the week (Monday 00:00 = 0).
+    Used as the cache band for quoted responses.
+    """
+    local = timezone.localtime(at)
+    return local.weekday() * SLOTS_PER_DAY + _minute_slot(local)
+
+
+def type_multipliers(types):
+    mapping = settings.PRICING_TYPE_MULTIPLIERS
+    codes, inverse = np.unique(np.asarray(types, dtype=str), return_inverse=True)
+    return np.array([mapping.get(code, 1.0) for code in codes])[inverse]
+
+
+def surge(occupied, capacity):
+    threshold = settings.PRICING_SURGE_THRESHOLD
+    peak = settings.PRICING_SURGE_MAX
+    share = occupied / np.maximum(capacity, 1)
+    ramp = np.clip((share - threshold) / max(1 - threshold, 1e-9), 0, 1)
+    return 1 + (peak - 1) * ramp
+
+
+def occupancy_at(ids, at):
+    """
+    Reserved connectors per station (aligned with `ids`) at moment `at`,
+    from the booking occupancy index less lapsed pending bookings.
+    """
+    rows, expired, day, slot = _occupancy_rows(ids, at)
+    return _occupancy(ids, list(rows), list(expired), day, slot)
+
+
+async def aoccupancy_at(ids, at):
+    rows, expired, day, slot = _occupancy_rows(ids, at)
+    return _occupancy(ids, [row async for row in rows], [row async for row in expired], day, slot)
+
+
+def _occupancy_rows(ids, at):
+    day, slot, _ = next(day_slots(at, at + SLOT))
+    rows = StationDayAvailability.objects.filter(day=day)
+    station_ids = None
+    if len(ids) <= OCCUPANCY_IN_LIMIT:
+        station_ids = ids.tolist()
+        rows = rows.filter(station_id__in=station_ids)
+    return rows.values_list('station_id', 'occupancy'), lapsed(station_ids, at, at + SLOT), day, slot
+
+
+def _occupancy(ids, rows, expired, day, slot):
+    index = without_lapsed({(station_id, day): bytes(slots) for station_id, slots in rows}, expired)
+    station_ids, occupancy = [], []
+    for (station_id, _), slots in index.items():
+        station_ids.append(station_id)
+        occupancy.append(slots[slot])
+
+    occupied = np.zeros(len(ids))
+    if station_ids:
+        known = np.array(station_ids, dtype=np.int64)
+        order = np.argsort(known)
+        known, values = known[order], np.array(occupancy, dtype=float)[order]
+        position = np.minimum(np.searchsorted(known, ids), len(known) - 1)
+        occupied = np.where(known[position] == ids, values[position], 0.0)
+    return occupied
+
+
+def quote(ids, prices, types, capacities, at=None):
+    """
+    Current hourly price for every station, as a float array aligned with
+    the inputs.
+    """
+    at = at or timezone.now()
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return np.zeros(0)
+    return _price(ids, prices, types, capacities, at, get_schedules(), occupancy_at(ids, at))
+
+
+async def aquote(ids, prices, types, capacities, at=None):
+    at = at or timezone.now()
+    ids = np.asarray(ids, dtype=np.int64)
+    if not len(ids):
+        return np.zeros(0)
+    return _price(ids, prices, types, capacities, at, await aget_schedules(), await aoccupancy_at(ids, at))
+
+
+def _price(ids, prices, types, capacities, at, schedules, occupied):
+    bands = schedules.grid[schedules.rows_for(ids), week_slot(at)]
+    surges = surge(occupied, np.asarray(capacities, dtype=float))
+    prices = np.asarray(prices, dtype=float) * bands * type_multipliers(types) * surges
+    return np.round(prices, 2)
+
+
+def _quote_inputs(stations):
+    return (
+        [station.pk for station in stations],
+        [station.price for station in stations],
+        [station.current_type() for station in stations],
+        [station.connector_count for station in stations],
+    )
+
+
+def attach_quotes(stations, at=None):
+    """
+    Set `quoted_price` on each station in one vectorized pass.
+    """
+    stations = list(stations)
+    if not stations:
+        return stations
+    prices = quote(*_quote_inputs(stations), at=at)
+    for station, price in zip(stations, prices.tolist()):
+        station.quoted_price = price
+    return stations
+
+
+async def aattach_quotes(stations, at=None):
+    stations = list(stations)
+    if not stations:
+        return stations
+    prices = await aquote(*_quote_inputs(stations), at=at)
+    for station, price in zip(stations, prices.tolist()):
+        station.quoted_price = price
+    return stations
+
+
+def quote_booking(station, start_at, end_at):
+    """
+    Amount for a booking window: each 15-minute slot is charged at that
+    slot's band, surge and type multiplier, pro rata for partial slots.
+    """
+    local_start = timezone.localtime(start_at)
+    first_at = start_at - timedelta(
+        minutes=local_start.minute % SLOT_MINUTES,
+        seconds=local_start.second,
+        microseconds=local_start.microsecond,
+    )
+    count = -(-(end_at - first_at) // SLOT)
+    offsets = np.arange(count)
+
+    # Hours of each slot inside [start_at, end_at)
+    slot_starts = offsets * SLOT_MINUTES
+    lead = (start_at - first_at).total_seconds() / 60
+    tail = (end_at - first_at).total_seconds() / 60
+    hours = (np.minimum(slot_starts + SLOT_MINUTES, tail) - np.maximum(slot_starts, lead)) / 60
+
+    schedules = get_schedules()
+    row = schedules.rows_for(np.array([station.pk], dtype=np.int64))[0]
+    slots = (week_slot(first_at) + offsets) % WEEK_SLOTS
+    bands = schedules.grid[row, slots]
+
+    occupied = np.zeros(count)
+    windows = list(day_slots(first_at, end_at))
+    rows = StationDayAvailability.objects.filter(station_id=station.pk, day__in=[day for day, _, _ in windows])
+    index = without_lapsed(
+        {(station.pk, day): bytes(slots) for day, slots in rows.values_list('day', 'occupancy')},
+        lapsed([station.pk], first_at, end_at),
+    )
+    rows = {day: slots for (_, day), slots in index.items()}
+    position = 0
+    for day, first, last in windows:
+        slots_today = rows.get(day)
+        if slots_today is not None:
+            occupied[position:position + last - first] = np.frombuffer(bytes(slots_today), dtype=np.uint8)[first:last]
+        position += last - first
+
+    multiplier = type_multipliers([station.current_type()])[0]
+    amounts = float(station.price) * multiplier * bands * surge(occupied, station.connector_count) * hours
+    return Decimal(str(amounts.sum())).quantize(CENT, rounding=ROUND_HALF_UP)
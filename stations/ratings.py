@@ -0,0 +1,111 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Case, Count, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Now
+
+from .models import Station, StationRating
+
+STARS = range(1, 6)
+
+
+def _apply(station_id, count, total, stars):
+    updates = {f'rating_{star}': F(f'rating_{star}') + delta for star, delta in stars.items() if delta}
+    if not (count or total or updates):
+        return
+
+    with transaction.atomic():
+        Station.objects.filter(pk=station_id).update(
+            rating_count=F('rating_count') + count,
+            rating_sum=F('rating_sum') + total,
+            updated_at=Now(),
+            **updates,
+        )
+        # Separate statement so it reads the new counters (MySQL and SQLite
+        # disagree on whether SET sees earlier assignments in the same UPDATE)
+        Station.objects.filter(pk=station_id).update(rating_avg=Case(
+            When(rating_count__gt=0, then=Cast(F('rating_sum'), FloatField()) / Cast(F('rating_count'), FloatField())),
+            default=Value(0.0),
+            output_field=FloatField(),
+        ))
+
+
+def rating_changed(rating, deleted=False):
+    """
+    Adjust the station aggregates for one created, updated or deleted
+    StationRating, using the values it had when it was loaded.
+    """
+    old_station, old_value = getattr(rating, '_counted', (None, None))
+    new = None if deleted else (rating.station_id, rating.rating)
+
+    changes = defaultdict(lambda: [0, 0, defaultdict(int)])
+    if old_station is not None and old_value is not None:
+        change = changes[old_station]
+        change[0] -= 1
+        change[1] -= old_value
+        change[2][old_value] -= 1
+    if new is not None:
+        change = changes[new[0]]
+        change[0] += 1
+        change[1] += new[1]
+        change[2][new[1]] += 1
+
+    for station_id, (count, total, stars) in changes.items():
+        _apply(station_id, count, total, stars)
+
+    rating._counted = new if new is not None else (None, None)
+
+
+def rebuild(batch_size=1000):
+    """
+    Recompute every station's rating aggregates from StationRating in
+    batches of stations. Returns the number of stations written.
+    """
+    fields = ['rating_avg', 'rating_count', 'rating_sum', 'updated_at'] + [f'rating_{star}' for star in STARS]
+    ids = Station.objects.order_by('id').values_list('id', flat=True)
+
+    written = 0
+    batch = []
+    for station_id in ids.iterator(chunk_size=batch_size):
+        batch.append(station_id)
+        if len(batch) == batch_size:
+            written += _rebuild_batch(batch, fields)
+            batch = []
+    if batch:
+        written += _rebuild_batch(batch, fields)
+    return written
+
+
+def _rebuild_batch(ids, fields):
+    now = timezone.now()
+    aggregates = {
+        row['station_id']: row
+        for row in StationRating.objects.filter(station_id__in=ids)
+        .values('station_id')
+        .annotate(
+            count=Count('id'),
+            total=Sum('rating'),
+            **{f'star_{star}': Count('id', filter=Q(rating=star)) for star in STARS},
+        )
+    }
+
+    stations = []
+    for station_id in ids:
+        row = aggregates.get(station_id, {})
+        count = row.get('count', 0)
+        total = row.get('total') or 0
+        station = Station(
+            pk=station_id,
+            updated_at=now,
+            rating_count=count,
+            rating_sum=total,
+            rating_avg=total / count if count else 0,
+        )
+        for star in STARS:
+            setattr(station, f'rating_{star}', row.get(f'star_{star}', 0))
+        stations.append(station)
+
+    with transaction.atomic():
+        Station.objects.bulk_update(stations, fields)
+    return len(stations)
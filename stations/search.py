@@ -0,0 +1,266 @@
+"""
+Station name/description search.
+
+Two backends:
+  * MySQL: a FULLTEXT index (ngram parser) queried with MATCH ... AGAINST,
+    which ranks by relevance and tolerates prefixes and small typos
+    because it matches on character bigrams.
+  * Everything else (SQLite, tests): an in-process inverted index with
+    prefix expansion, single-edit typo tolerance and TF-IDF ranking,
+    kept in sync by the Station save/delete signals.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Case, IntegerField, Value, When
+from django.db.models.expressions import RawSQL
+
+FULLTEXT_INDEX_NAME = 'stations_station_fulltext'
+
+MAX_RESULTS = 1000
+MAX_EXPANSIONS = 50
+MIN_PREFIX_LENGTH = 2
+MIN_TYPO_LENGTH = 4
+
+NAME_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+EXACT_WEIGHT = 1.0
+PREFIX_WEIGHT = 0.6
+TYPO_WEIGHT = 0.5
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return _TOKEN_RE.findall(text.lower())
+
+
+def _deletions(token):
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def use_fulltext(using='default'):
+    backend = getattr(settings, 'STATION_SEARCH_BACKEND', 'auto')
+    if backend == 'auto':
+        return connections[using].vendor == 'mysql'
+    return backend == 'fulltext'
+
+
+def ensure_fulltext_index(using='default'):
+    """
+    Create the FULLTEXT index on MySQL if it is missing. Django can't
+    declare it in Meta.indexes, so it is added after migrate.
+    """
+    connection = connections[using]
+    if connection.vendor != 'mysql':
+        return False
+
+    from .models import Station
+    table = Station._meta.db_table
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM information_schema.statistics "
+            "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+            [table, FULLTEXT_INDEX_NAME],
+        )
+        if cursor.fetchone():
+            return False
+        cursor.execute(
+            f"ALTER TABLE {connection.ops.quote_name(table)} "
+            f"ADD FULLTEXT INDEX {FULLTEXT_INDEX_NAME} (name, description) WITH PARSER ngram"
+        )
+    return True
+
+
+def fulltext_filter(queryset, terms):
+    query = ' '.join(terms)
+    relevance = RawSQL(
+        'MATCH (name, description) AGAINST (%s IN NATURAL LANGUAGE MODE)', [query]
+    )
+    return queryset.annotate(search_rank=relevance).filter(search_rank__gt=0)
+
+
+class InvertedIndex:
+    """
+    token -> {station_id: weight} postings with a sorted vocabulary for
+    prefix lookups and a single-deletion map for typo tolerance.
+    """
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self.vocabulary = []
+        self.deletions = defaultdict(set)
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, station_id, name, description):
+        weights = defaultdict(float)
+        for token in tokenize(name):
+            weights[token] += NAME_WEIGHT
+        for token in tokenize(description):
+            weights[token] += DESCRIPTION_WEIGHT
+
+        with self.lock:
+            self._remove(station_id)
+            for token, weight in weights.items():
+                if token not in self.postings:
+                    self._add_token(token)
+                self.postings[token][station_id] = weight
+            self.documents[station_id] = tuple(weights)
+
+    def remove(self, station_id):
+        with self.lock:
+            self._remove(station_id)
+
+    def _remove(self, station_id):
+        for token in self.documents.pop(station_id, ()):
+            posting = self.postings[token]
+            posting.pop(station_id, None)
+            if not posting:
+                del self.postings[token]
+                self._drop_token(token)
+
+    def _add_token(self, token):
+        bisect.insort(self.vocabulary, token)
+        if len(token) >= MIN_TYPO_LENGTH:
+            for variant in _deletions(token):
+                self.deletions[variant].add(token)
+
+    def _drop_token(self, token):
+        position = bisect.bisect_left(self.vocabulary, token)
+        if position < len(self.vocabulary) and self.vocabulary[position] == token:
+            del self.vocabulary[position]
+        if len(token) >= MIN_TYPO_LENGTH:
+            for variant in _deletions(token):
+                tokens = self.deletions.get(variant)
+                if tokens is not None:
+                    tokens.discard(token)
+                    if not tokens:
+                        del self.deletions[variant]
+
+    def expand(self, term):
+        """
+        Vocabulary tokens matching `term` with their match weight:
+        exact, prefix, then one insertion/deletion/substitution away.
+        """
+        matches = {}
+        if term in self.postings:
+            matches[term] = EXACT_WEIGHT
+
+        if len(term) >= MIN_PREFIX_LENGTH:
+            position = bisect.bisect_left(self.vocabulary, term)
+            while position < len(self.vocabulary) and len(matches) < MAX_EXPANSIONS:
+                token = self.vocabulary[position]
+                if not token.startswith(term):
+                    break
+                matches.setdefault(token, PREFIX_WEIGHT)
+                position += 1
+
+        if len(term) >= MIN_TYPO_LENGTH:
+            candidates = set(self.deletions.get(term, ()))
+            for variant in _deletions(term):
+                if variant in self.postings:
+                    candidates.add(variant)
+                candidates.update(self.deletions.get(variant, ()))
+            for token in candidates:
+                if len(matches) >= MAX_EXPANSIONS:
+                    break
+                matches.setdefault(token, TYPO_WEIGHT)
+
+        return matches
+
+    def search(self, terms, limit=MAX_RESULTS):
+        """
+        Station ids matching every term, best first.
+        """
+        with self.lock:
+            total = max(len(self.documents), 1)
+            scores = None
+            for term in terms:
+                term_scores = defaultdict(float)
+                for token, match_weight in self.expand(term.lower()).items():
+                    posting = self.postings[token]
+                    idf = math.log(1 + total / len(posting))
+                    for station_id, weight in posting.items():
+                        term_scores[station_id] += idf * match_weight * weight
+
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        station_id: score + term_scores[station_id]
+                        for station_id, score in scores.items()
+                        if station_id in term_scores
+                    }
+                if not scores:
+                    return []
+
+        ranked = heapq.nsmallest(limit, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [station_id for station_id, _ in ranked]
+
+    def filter(self, queryset, terms):
+        ids = self.search(terms)
+        if not ids:
+            return queryset.none()
+        # Higher search_rank is better; keyset pagination orders on it
+        rank = Case(
+            *[When(pk=station_id, then=Value(len(ids) - position)) for position, station_id in enumerate(ids)],
+            output_field=IntegerField(),
+        )
+        return queryset.filter(pk__in=ids).annotate(search_rank=rank)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    The process-wide index, built from the stations table on first use.
+    """
+    global _index
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                from .models import Station
+
+                index = InvertedIndex()
+                rows = Station.objects.values_list('id', 'name', 'description').iterator(chunk_size=2000)
+                for station_id, name, description in rows:
+                    index.add(station_id, name, description)
+                _index = index
+    return _index
+
+
+def reset_index():
+    global _index
+    _index = None
+
+
+def station_changed(station, deleted=False):
+    # Nothing to keep in sync until the index has been built
+    if _index is None:
+        return
+    if deleted:
+        _index.remove(station.pk)
+    else:
+        _index.add(station.pk, station.name, station.description)
+
+
+def search_filter(queryset, terms):
+    if use_fulltext(queryset.db):
+        return fulltext_filter(queryset, terms)
+    return get_index().filter(queryset, terms)
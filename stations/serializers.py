@@ -5,19 +5,32 @@ class StationSerializer(serializers.ModelSerializer):
     owner = serializers.ReadOnlyField(source='owner.id')
     owner_name = serializers.ReadOnlyField(source='owner.name')
     current_type = serializers.SerializerMethodField()
+    distance_km = serializers.SerializerMethodField()
+    rating_histogram = serializers.SerializerMethodField()
+    # Set by stations.pricing.attach_quotes on read responses
+    quoted_price = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True, allow_null=True)
 
     class Meta:
         model = Station
         fields = [
             'id', 'owner','owner_name', 'name', 'description',
             'latitude', 'longitude', 'type',
-            'price', 'temp_type', 'temp_until',
-            'is_active', 'created_at', 'current_type'
+            'price', 'quoted_price', 'connector_count', 'temp_type', 'temp_until',
+            'is_active', 'created_at', 'current_type', 'distance_km',
+            'rating_avg', 'rating_count', 'rating_histogram'
         ]
+        read_only_fields = ['rating_avg', 'rating_count']
 
     def get_current_type(self, obj):
         return obj.current_type()
 
+    def get_rating_histogram(self, obj):
+        return obj.rating_histogram()
+
+    def get_distance_km(self, obj):
+        # Only set when the station came from a nearby query
+        return getattr(obj, 'distance_km', None)
+
 
 class StationRatingSerializer(serializers.ModelSerializer):
     user = serializers.ReadOnlyField(source='user.username')
@@ -0,0 +1,49 @@
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import cache, clusters, events, ratings, search
+from .models import Station, StationRating, TariffBand
+
+
+@receiver(post_save, sender=Station)
+def station_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    clusters.station_changed(instance)
+    search.station_changed(instance)
+    cache.bump([instance.pk])
+    events.stations_changed([instance])
+
+
+@receiver(post_delete, sender=Station)
+def station_deleted(sender, instance, **kwargs):
+    clusters.station_changed(instance, deleted=True)
+    search.station_changed(instance, deleted=True)
+    cache.bump([instance.pk])
+    events.station_deleted(instance.pk)
+
+
+@receiver(post_save, sender=StationRating)
+def rating_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    ratings.rating_changed(instance)
+    cache.bump([instance.station_id])
+
+
+@receiver(post_delete, sender=StationRating)
+def rating_deleted(sender, instance, **kwargs):
+    ratings.rating_changed(instance, deleted=True)
+    cache.bump([instance.station_id])
+
+
+@receiver(post_save, sender=TariffBand)
+@receiver(post_delete, sender=TariffBand)
+def tariff_changed(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    cache.bump_tariffs([instance.station_id])
+
+
+def create_fulltext_index(sender, using='default', **kwargs):
+    search.ensure_fulltext_index(using)
@@ -0,0 +1,44 @@
+from django.db import connection, transaction
+from django.db.models.functions import Now
+
+from . import cache, events
+from .models import Station
+
+
+def clear_expired_temp_types(batch_size=500):
+    """
+    Reset temp_type/temp_until on every station whose temporary type has
+    run out, one set-based UPDATE per batch. Returns the number of rows
+    cleared.
+    """
+    total = 0
+    while True:
+        with transaction.atomic():
+            due = Station.objects.expired_temp_types().order_by('temp_until')
+            # Owners extending a temp type concurrently keep their lock
+            if connection.features.has_select_for_update_skip_locked:
+                due = due.select_for_update(skip_locked=True)
+            stations = list(due.only('id', *events.WATCHED)[:batch_size])
+            if not stations:
+                break
+
+            ids = [station.pk for station in stations]
+            # Re-checked: a temp_until extended since the select must survive
+            cleared = (
+                Station.objects
+                .filter(id__in=ids, temp_until__lt=Now())
+                .update(temp_type=None, temp_until=None, updated_at=Now())
+            )
+            if cleared < len(ids):
+                still = set(Station.objects.filter(id__in=ids, temp_until__isnull=True).values_list('id', flat=True))
+                stations = [station for station in stations if station.pk in still]
+
+            cache.bump(station.pk for station in stations)
+            for station in stations:
+                station.temp_type = station.temp_until = None
+            events.stations_changed(stations)
+
+        total += cleared
+        if len(ids) < batch_size:
+            break
+    return total
@@ -1,3 +1,448 @@
-from django.test import TestCase
+import json
+import tempfile
+from datetime import time, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+import numpy as np
+from django.core.cache import cache
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from evfinder.testing import AsyncRoutesMixin, EventsMixin, SharedCacheMixin, shared_cache
+from users.models import Users
+from users.tokens import UserRefreshToken
+from . import bulk, clusters, events, geo, pricing, ratings, search
+from .models import Station, StationCluster, StationRating, TariffBand
+from .tasks import clear_expired_temp_types
+
+
+class StationTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.owner = Users.objects.create_user(username='owner', email='owner@example.com', password='pw', role='chargerowner')
+        self.station = Station.objects.create(owner=self.owner, name='Hub', latitude=12.97, longitude=77.59, price=10)
+        self.client = APIClient()
+
+
+URLS = ('/api/stations/', '/api/stations/{}/')
+
+
+class CachedReadTests(SharedCacheMixin, StationTestCase):
+
+    def test_quoted_responses_validate_by_etag_only(self):
+        for url in URLS:
+            url = url.format(self.station.pk)
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('Last-Modified', response)
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_write_invalidates_cached_responses(self):
+        url = URLS[1].format(self.station.pk)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            Station.objects.get(pk=self.station.pk).save()
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+
+class PerProcessCacheTests(StationTestCase):
+
+    def test_responses_bypass_the_cache(self):
+        # A bump in one worker wouldn't reach the others' copies or ETags
+        for url in URLS:
+            response = self.client.get(url.format(self.station.pk))
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('X-Cache', response)
+            self.assertNotIn('ETag', response)
+
+
+class AsyncRouteTests(AsyncRoutesMixin, StationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        Station.objects.create(owner=self.owner, name='Depot', latitude=12.99, longitude=77.6, price=8)
+        self.token = str(UserRefreshToken.for_user(self.owner).access_token)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.token}')
+
+    def test_reads_match_the_drf_views(self):
+        paths = [
+            '/api/stations/', '/api/stations/?ordering=price&page_size=1', '/api/stations/?search=depot',
+            f'/api/stations/{self.station.pk}/', '/api/stations/999999/',
+            '/api/stations/nearby/?lat=12.97&lng=77.59&radius_km=5', '/api/stations/nearby/?lat=north',
+        ]
+        for path in paths:
+            with self.subTest(path=path):
+                drf, native = self.client.get(path), self.asgi('get', path)
+                self.assertEqual(native.status_code, drf.status_code)
+                self.assertEqual(native.json(), drf.json())
+
+    def test_cached_reads_share_etags_with_the_drf_views(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES=shared_cache(directory)):
+            for url in URLS:
+                url = url.format(self.station.pk)
+                etag = self.client.get(url)['ETag']
+                self.assertEqual(self.asgi('get', url)['ETag'], etag)
+                self.assertEqual(self.asgi('get', url, headers={'If-None-Match': etag}).status_code, 304)
+
+    def test_other_methods_go_to_the_drf_views(self):
+        response = self.asgi('post', '/api/stations/', {'name': 'New', 'latitude': 13.0, 'longitude': 77.6}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.asgi('delete', f'/api/stations/{response.json()["id"]}/').status_code, 204)
+        self.assertFalse(Station.objects.filter(name='New').exists())
+        self.assertEqual(self.asgi('post', '/api/stations/nearby/').status_code, 405)
+
+
+class StationEventTests(EventsMixin, StationTestCase):
+
+    def save(self, **fields):
+        station = Station.objects.get(pk=self.station.pk)
+        for name, value in fields.items():
+            setattr(station, name, value)
+        with self.captureOnCommitCallbacks(execute=True):
+            station.save()
+
+    def test_watched_change_is_published(self):
+        watching = self.subscribe(events.channel(self.station.pk))
+        elsewhere = self.subscribe(events.channel(self.station.pk + 1))
+        self.save(is_active=False)
+
+        [event] = self.received(watching)
+        self.assertEqual(event.type, 'station')
+        self.assertEqual(json.loads(event.data)['is_active'], False)
+        self.assertEqual(self.received(elsewhere), [])
+
+    def test_unwatched_change_is_not_published(self):
+        watching = self.subscribe(events.channel(self.station.pk))
+        self.save(name='Renamed', description='Now with coffee')
+        self.assertEqual(self.received(watching), [])
+
+
+class RatingAggregateTests(StationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = Station.objects.create(owner=self.owner, name='Depot', latitude=12.9, longitude=77.5)
+        self.users = [
+            Users.objects.create_user(username=f'ev{n}', email=f'ev{n}@example.com', password='pw') for n in range(3)
+        ]
+
+    def aggregates(self, station):
+        station = Station.objects.get(pk=station.pk)
+        return station.rating_count, station.rating_sum, station.rating_avg, station.rating_histogram()
+
+    def rate(self, user, rating, station=None):
+        return StationRating.objects.create(station=station or self.station, user=user, rating=rating)
+
+    def test_create_update_delete(self):
+        first = self.rate(self.users[0], 5)
+        self.rate(self.users[1], 2)
+        self.assertEqual(self.aggregates(self.station), (2, 7, 3.5, {'1': 0, '2': 1, '3': 0, '4': 0, '5': 1}))
+
+        first.rating = 4
+        first.save()
+        self.assertEqual(self.aggregates(self.station)[:3], (2, 6, 3.0))
+
+        # Moving a rating to another station counts it there instead
+        first = StationRating.objects.get(pk=first.pk)
+        first.station = self.other
+        first.save()
+        self.assertEqual(self.aggregates(self.station)[:3], (1, 2, 2.0))
+        self.assertEqual(self.aggregates(self.other)[:3], (1, 4, 4.0))
+
+        first.delete()
+        self.assertEqual(self.aggregates(self.other), (0, 0, 0, {str(star): 0 for star in range(1, 6)}))
+
+    def test_rebuild_matches_the_maintained_aggregates(self):
+        for user, rating in zip(self.users, (1, 3, 3)):
+            self.rate(user, rating)
+        self.rate(self.users[0], 4, station=self.other).delete()
+        maintained = [self.aggregates(self.station), self.aggregates(self.other)]
+
+        # Lose the counters, then recompute them from the rows
+        Station.objects.update(rating_count=0, rating_sum=0, rating_avg=0, rating_3=0)
+        self.assertEqual(ratings.rebuild(batch_size=1), Station.objects.count())
+        self.assertEqual([self.aggregates(self.station), self.aggregates(self.other)], maintained)
+
+
+class SearchIndexTests(TestCase):
+
+    def setUp(self):
+        self.index = search.InvertedIndex()
+        self.index.add(1, 'Fast Charging Hub', 'Open all night')
+        self.index.add(2, 'City Parking', 'Fast chargers on level two')
+        self.index.add(3, 'Mall', 'Slow charging')
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.index.search(['fast']), [1, 2])
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.index.search(['fast', 'night']), [1])
+        self.assertEqual(self.index.search(['fast', 'slow']), [])
+
+    def test_prefix_matches(self):
+        self.assertEqual(set(self.index.search(['charg'])), {1, 2, 3})
+        self.assertEqual(self.index.search(['charger']), [2])
+        # An exact token outranks a prefix match
+        self.index.add(4, 'Bay', 'One charger')
+        self.assertEqual(self.index.search(['charger']), [4, 2])
+
+    def test_single_edit_typos_match(self):
+        for typo in ('chargng', 'charrging', 'chbrging'):
+            with self.subTest(typo=typo):
+                self.assertEqual(set(self.index.search([typo])), {1, 3})
+        self.assertEqual(self.index.search(['chrgng']), [])
+        # Too short to risk a typo match
+        self.assertEqual(self.index.search(['mal']), [3])
+        self.assertEqual(self.index.search(['mxl']), [])
+
+    def test_removed_stations_are_forgotten(self):
+        self.index.remove(1)
+        self.assertEqual(self.index.search(['fast']), [2])
+        self.assertEqual(self.index.search(['hub']), [])
+
+
+class StationSearchTests(StationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        search.reset_index()
+        self.addCleanup(search.reset_index)
+
+    def names(self, query):
+        return [station['name'] for station in self.client.get(f'/api/stations/?search={query}').json()['results']]
+
+    def test_results_follow_station_writes(self):
+        self.assertEqual(self.names('hub'), ['Hub'])
+        # The index is built now; later writes keep it in sync
+        depot = Station.objects.create(owner=self.owner, name='Depot', description='Next to the hub', latitude=12.9, longitude=77.5)
+        self.assertEqual(self.names('hub'), ['Hub', 'Depot'])
+
+        depot.name = 'Hub Depot'
+        depot.save()
+        self.station.delete()
+        self.assertEqual(self.names('hub'), ['Hub Depot'])
+
+
+class TempTypeSweepTests(StationTestCase):
+
+    def test_clears_expired_temp_types_in_batches(self):
+        now = timezone.now()
+        expired = [
+            Station.objects.create(
+                owner=self.owner, name=f'Expired {n}', latitude=12.9, longitude=77.5,
+                temp_type=Station.TYPE_CAR, temp_until=now - timedelta(minutes=n + 1),
+            )
+            for n in range(3)
+        ]
+        live = Station.objects.create(
+            owner=self.owner, name='Live', latitude=12.9, longitude=77.5,
+            temp_type=Station.TYPE_BIKE, temp_until=now + timedelta(hours=1),
+        )
+
+        self.assertEqual(clear_expired_temp_types(batch_size=2), 3)
+        self.assertFalse(Station.objects.filter(pk__in=[s.pk for s in expired], temp_type__isnull=False).exists())
+        live.refresh_from_db()
+        self.assertEqual(live.temp_type, Station.TYPE_BIKE)
+
+
+class BulkImportTests(StationTestCase):
+
+    def rows(self, count, fail_after=None):
+        for n in range(count):
+            if n == fail_after:
+                raise RuntimeError('upload interrupted')
+            yield n + 1, {'name': f'Imported {n}', 'latitude': '13.0', 'longitude': '77.6', 'price': '12'}
+
+    def clustered(self):
+        return sum(StationCluster.objects.filter(precision=1).values_list('count', flat=True))
+
+    def test_clusters_match_the_imported_rows(self):
+        result = bulk.StationImporter(self.owner, batch_size=2).run(self.rows(5))
+        self.assertEqual(result.created, 5)
+        self.assertEqual(self.clustered(), Station.objects.filter(is_active=True).count())
+
+    def test_committed_batches_are_clustered_when_a_later_one_fails(self):
+        with self.assertRaises(RuntimeError):
+            bulk.StationImporter(self.owner, batch_size=2).run(self.rows(5, fail_after=3))
+        self.assertEqual(Station.objects.filter(name__startswith='Imported').count(), 2)
+        self.assertEqual(self.clustered(), Station.objects.filter(is_active=True).count())
+
+
+class BulkUpdateTests(SharedCacheMixin, StationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.other = Station.objects.create(owner=self.owner, name='Depot', latitude=12.9, longitude=77.5, price=10)
+        self.client.force_authenticate(self.owner)
+
+    def update(self, body):
+        return self.client.post('/api/stations/bulk-update/', body, format='json')
+
+    def prices(self):
+        return {pk: str(price) for pk, price in Station.objects.values_list('id', 'price')}
+
+    def test_stations_of_other_owners_are_listed_and_nothing_changes(self):
+        stranger = Users.objects.create_user(username='other', email='other@example.com', password='pw', role='chargerowner')
+        theirs = Station.objects.create(owner=stranger, name='Theirs', latitude=12.9, longitude=77.5, price=10)
+        before = self.prices()
+
+        response = self.update({'ids': [self.station.pk, theirs.pk, 999999], 'set': {'price': '15.00'}})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(sorted([theirs.pk, 999999])), response.json()['ids'][0])
+        self.assertEqual(self.prices(), before)
+
+    def test_same_change_for_many_stations(self):
+        response = self.update({'ids': [self.station.pk, self.other.pk], 'set': {'price': '15.00', 'is_active': False}})
+        self.assertEqual(response.json(), {'changed': [self.station.pk, self.other.pk], 'unchanged': []})
+        self.assertEqual(Station.objects.filter(price=15, is_active=False).count(), 2)
+
+    def test_unchanged_stations_are_reported_and_not_written(self):
+        stamp = Station.objects.get(pk=self.other.pk).updated_at
+        response = self.update({'changes': [
+            {'id': self.station.pk, 'price': '12.50'},
+            {'id': self.other.pk, 'price': '10.00'},
+        ]})
+        self.assertEqual(response.json(), {'changed': [self.station.pk], 'unchanged': [self.other.pk]})
+        self.assertEqual(self.prices()[self.station.pk], '12.50')
+        self.assertEqual(Station.objects.get(pk=self.other.pk).updated_at, stamp)
+
+    def test_move_updates_geohash_and_clusters(self):
+        self.update({'changes': [{'id': self.station.pk, 'latitude': 28.61, 'longitude': 77.21}]})
+        self.assertEqual(Station.objects.get(pk=self.station.pk).geohash, geo.encode(28.61, 77.21))
+
+        maintained = set(StationCluster.objects.filter(count__gt=0).values_list('precision', 'cell', 'count'))
+        clusters.rebuild()
+        self.assertEqual(set(StationCluster.objects.filter(count__gt=0).values_list('precision', 'cell', 'count')), maintained)
+
+    def test_change_invalidates_cached_responses(self):
+        url = URLS[1].format(self.station.pk)
+        self.client.get(url)
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.update({'ids': [self.station.pk], 'set': {'price': '11.00'}})
+
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['price'], '11.00')
+
+    def test_request_size_is_capped(self):
+        with mock.patch.object(bulk, 'MAX_UPDATE_STATIONS', 1):
+            response = self.update({'ids': [self.station.pk, self.other.pk], 'set': {'price': '15.00'}})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('At most 1', response.json()['ids'][0])
+
+
+class NearbyTests(StationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # A 0.02 degree grid (about 2.2 km) over a degree around Bengaluru
+        Station.objects.bulk_create([
+            Station(
+                owner=self.owner, name=f'Grid {row}-{column}', latitude=lat, longitude=lng,
+                geohash=geo.encode(lat, lng),
+            )
+            for row in range(51) for column in range(51)
+            for lat, lng in [(12.5 + row * 0.02, 77.1 + column * 0.02)]
+        ])
+
+    def test_candidates_stay_close_to_the_circle(self):
+        lat, lng, radius_km = 13.0, 77.6, 5
+        candidates = list(Station.objects.all()._near_candidates(lat, lng, radius_km))
+        within = [
+            pk for pk, s_lat, s_lng in Station.objects.values_list('id', 'latitude', 'longitude')
+            if geo.haversine_km(lat, lng, s_lat, s_lng) <= radius_km
+        ]
+        self.assertTrue(set(within) <= {pk for pk, _, _ in candidates})
+        # 49 for 21 in range; the 3x3 block of ~39x20 km cells scanned 1296
+        self.assertLess(len(candidates), 3 * len(within))
+
+    def test_precision_accounts_for_latitude(self):
+        self.assertEqual(geo.precision_for_radius(2, lat=0), 5)
+        self.assertEqual(geo.precision_for_radius(2, lat=70), 4)
+        self.assertLessEqual(len(geo.cover(13.0, 77.6, 5)), geo.MAX_COVER_CELLS)
+
+
+class KeysetPaginationTests(StationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # Ties on price make the id tiebreaker matter
+        for n in range(6):
+            Station.objects.create(owner=self.owner, name=f'Paged {n}', latitude=12.9, longitude=77.5, price=n % 3)
+
+    def walk(self, url, direction):
+        ids = []
+        while url:
+            body = self.client.get(url).json()
+            ids.append([station['id'] for station in body['results']])
+            url = body[direction]
+        return ids
+
+    def test_cursors_visit_every_row_once(self):
+        for ordering, key in (('price', lambda s: (s.price, s.pk)), ('-created_at', lambda s: (s.created_at, s.pk))):
+            expected = [s.pk for s in sorted(Station.objects.all(), key=key, reverse=ordering.startswith('-'))]
+            pages = self.walk(f'/api/stations/?ordering={ordering}&page_size=2', 'next')
+            self.assertEqual([pk for page in pages for pk in page], expected)
+            self.assertTrue(all(len(page) == 2 for page in pages[:-1]))
+
+    def test_previous_cursor_returns_the_earlier_page(self):
+        first = self.client.get('/api/stations/?ordering=price&page_size=3').json()
+        second = self.client.get(first['next']).json()
+        self.assertEqual(self.client.get(second['previous']).json()['results'], first['results'])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/stations/?cursor=not-a-cursor').status_code, 404)
+
+
+class PricingTests(StationTestCase):
+
+    def setUp(self):
+        super().setUp()
+        pricing.reset_schedules()
+        self.addCleanup(pricing.reset_schedules)
+        self.ten = timezone.localtime(timezone.now() + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+
+    def band(self, start_time, end_time, multiplier, **fields):
+        return TariffBand.objects.create(
+            station=self.station, start_time=start_time, end_time=end_time, multiplier=multiplier, **fields,
+        )
+
+    def slot(self, weekday, hour, minute=0):
+        return weekday * pricing.SLOTS_PER_DAY + (hour * 60 + minute) // pricing.SLOT_MINUTES
+
+    def grid_row(self):
+        schedules = pricing.compile_schedules()
+        return schedules.grid[schedules.rows_for(np.array([self.station.pk]))[0]]
+
+    def test_band_wraps_past_midnight(self):
+        # Sunday night runs into Monday, the start of the week grid
+        mask = pricing._band_mask(TariffBand.SUNDAY, time(22), time(1, 30))
+        expected = list(range(self.slot(0, 0), self.slot(0, 1, 30))) + list(range(self.slot(6, 22), pricing.WEEK_SLOTS))
+        self.assertEqual(np.flatnonzero(mask).tolist(), expected)
+
+    def test_higher_priority_band_wins(self):
+        self.band(time(17), time(19), '2', priority=1)
+        self.band(time(8), time(20), '1.5')
+        row = self.grid_row()
+        self.assertEqual([row[self.slot(2, hour)] for hour in (7, 9, 17, 19)], [1, 1.5, 2, 1.5])
+
+    def test_partial_slots_are_charged_pro_rata(self):
+        self.band(time(10, 15), time(10, 30), '2')
+        # 10 minutes at the base 10/h, then 5 at the doubled rate
+        amount = pricing.quote_booking(self.station, self.ten + timedelta(minutes=5), self.ten + timedelta(minutes=20))
+        self.assertEqual(amount, Decimal('3.33'))
+
+    @override_settings(PRICING_SURGE_THRESHOLD=0.5, PRICING_SURGE_MAX=2)
+    def test_surge_ramps_from_the_threshold(self):
+        surges = pricing.surge(np.array([0, 2, 3, 4, 5]), np.full(5, 4.0))
+        self.assertEqual(surges.tolist(), [1, 1, 1.5, 2, 2])
+
+    @override_settings(PRICING_TYPE_MULTIPLIERS={'bike': 0.5, 'car': 1.0})
+    def test_type_multipliers(self):
+        self.assertEqual(pricing.type_multipliers(['car', 'bike', 'both', 'bike']).tolist(), [1, 0.5, 1, 0.5])
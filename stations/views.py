@@ -1,41 +1,291 @@
 from rest_framework import viewsets, permissions, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from .models import Station, StationRating
 from .serializers import StationSerializer, StationRatingSerializer
 from .permissions import IsOwnerOrReadOnly
-
-
-
-
-class StationViewSet(viewsets.ModelViewSet):
+from evfinder import db_router
+from evfinder.conditional import conditional_response, make_etag
+from evfinder.pagination import StationPagination, RatingPagination
+from . import cache as station_cache
+from . import bulk, clusters, pricing
+from .filters import StationSearchFilter
+
+class CachedReadMixin:
+    """
+    Serve list/retrieve from the versioned station cache. Writes bump the
+    versions through the Station signals, and bookings that change the
+    current slot's occupancy (and so the surge) through
+    booking.availability, so entries never go stale.
+    The cache key doubles as the ETag, so conditional GETs are answered
+    with 304 before touching the cache or the database.
+
+    No Last-Modified: each body carries a quoted_price that moves with the
+    tariff band and occupancy without any station write, so a date would
+    validate stale quotes. The key (and ETag) includes the band instead.
+
+    Without a shared cache (station_cache.enabled()) both are skipped and
+    the plain handlers answer.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if not station_cache.enabled():
+            return super().list(request, *args, **kwargs)
+        key = station_cache.list_key(request.user, request.query_params, band=pricing.week_slot())
+        return self._cached(key, super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not station_cache.enabled():
+            return super().retrieve(request, *args, **kwargs)
+        key = station_cache.detail_key(
+            request.user, kwargs[self.lookup_field], request.query_params, band=pricing.week_slot()
+        )
+        return self._cached(key, super().retrieve, request, *args, **kwargs)
+
+    def _cached(self, key, handler, request, *args, **kwargs):
+        return conditional_response(
+            request, make_etag(key), None, lambda: self._cached_response(key, handler, request, *args, **kwargs),
+        )
+
+    def _cached_response(self, key, handler, request, *args, **kwargs):
+        cache = station_cache.get_cache()
+        data = cache.get(key)
+        if data is not None:
+            station_cache.record(hit=True)
+            response = Response(data)
+            response['X-Cache'] = 'HIT'
+            return response
+
+        station_cache.record(hit=False)
+        changed = station_cache.changed_at()
+        if changed is not None and time.time() - changed < settings.DATABASE_REPLICA_LAG_SECONDS:
+            # A replica may not have the change yet, and whatever is read
+            # here is cached under the new version
+            with db_router.use_primary():
+                response = handler(request, *args, **kwargs)
+        else:
+            response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, station_cache.plain(response.data), station_cache.timeout())
+        response['X-Cache'] = 'MISS'
+        return response
+
+
+class StationViewSet(CachedReadMixin, viewsets.ModelViewSet):
     queryset = Station.objects.all()
     serializer_class = StationSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly, IsOwnerOrReadOnly]
-    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    filter_backends = [StationSearchFilter, filters.OrderingFilter]
     search_fields = ['name', 'description']
-    ordering_fields = ['price', 'created_at']
+    ordering_fields = ['price', 'created_at', 'rating_avg', 'rating_count']
+    pagination_class = StationPagination
+    replica_reads = True
 
+    NEARBY_DEFAULT_RADIUS_KM = 10
+    NEARBY_MAX_RADIUS_KM = 200
+    NEARBY_DEFAULT_LIMIT = 20
+    NEARBY_MAX_LIMIT = 100
+
+    VIEWPORT_MAX_CLUSTERS = 1000
+    VIEWPORT_MAX_STATIONS = 500
+
+
+    def get_serializer(self, *args, **kwargs):
+        # Quote every station of a read response in one vectorized pass
+        if args and self.request.method in permissions.SAFE_METHODS:
+            instance = args[0]
+            pricing.attach_quotes(instance if isinstance(instance, list) else [instance])
+        return super().get_serializer(*args, **kwargs)
 
     def get_queryset(self):
         user = self.request.user
+        # Owner joined and type resolved in SQL → constant queries, no writes
+        stations = Station.objects.select_related('owner').with_current_type()
 
         # Admin → see all
         if user.is_authenticated and user.is_staff:
-            return Station.objects.all()
+            return stations
 
         # EV Owner → only active stations
         if user.is_authenticated and getattr(user, "role", None) == "evowner":
-            return Station.objects.filter(is_active=True)
+            return stations.filter(is_active=True)
 
         # Charger Owner → only his stations
         if user.is_authenticated and getattr(user, "role", None) == "chargerowner":
-            return Station.objects.filter(owner=user)
+            return stations.filter(owner=user)
 
         # Public users
-        return Station.objects.filter(is_active=True)
+        return stations.filter(is_active=True)
+
+    @classmethod
+    def nearby_params(cls, query_params):
+        """
+        (lat, lng, radius_km, limit) from the query string, and an error
+        message when they are missing or invalid.
+        """
+        lat = query_params.get('lat')
+        lng = query_params.get('lng')
+
+        if lat is None or lng is None:
+            return None, 'lat and lng are required'
+
+        try:
+            lat = float(lat)
+            lng = float(lng)
+            radius_km = float(query_params.get('radius_km', cls.NEARBY_DEFAULT_RADIUS_KM))
+            limit = int(query_params.get('limit', cls.NEARBY_DEFAULT_LIMIT))
+        except ValueError:
+            return None, 'lat, lng, radius_km and limit must be numeric'
+
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return None, 'lat/lng out of range'
+
+        if radius_km <= 0 or limit <= 0:
+            return None, 'radius_km and limit must be positive'
+
+        radius_km = min(radius_km, cls.NEARBY_MAX_RADIUS_KM)
+        limit = min(limit, cls.NEARBY_MAX_LIMIT)
+        return (lat, lng, radius_km, limit), None
+
+    @action(detail=False, methods=['get'])
+    def nearby(self, request):
+        params, error = self.nearby_params(request.query_params)
+        if error:
+            return Response({'error': error}, status=400)
+
+        stations = self.get_queryset().nearest(*params)
+        serializer = self.get_serializer(stations, many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def viewport(self, request):
+        bbox = request.query_params.get('bbox')
+        zoom = request.query_params.get('zoom')
+
+        if bbox is None or zoom is None:
+            return Response({'error': 'bbox and zoom are required'}, status=400)
+
+        try:
+            min_lng, min_lat, max_lng, max_lat = [float(v) for v in bbox.split(',')]
+            zoom = int(zoom)
+        except ValueError:
+            return Response({'error': 'bbox must be minLng,minLat,maxLng,maxLat and zoom an integer'}, status=400)
+
+        if min_lat > max_lat:
+            return Response({'error': 'bbox minLat must not exceed maxLat'}, status=400)
+
+        precision = clusters.precision_for_zoom(zoom)
+
+        # Coarse zoom → precomputed clusters
+        if precision is not None:
+            data = clusters.clusters_in_bbox(
+                precision, min_lat, min_lng, max_lat, max_lng, self.VIEWPORT_MAX_CLUSTERS
+            )
+            return Response({'zoom': zoom, 'clusters': data})
+
+        # Fine zoom → individual stations
+        qs = (
+            self.get_queryset()
+            .filter(latitude__gte=min_lat, latitude__lte=max_lat)
+            .filter(clusters.bbox_lng_q('longitude', min_lng, max_lng))
+        )
+        stations = list(qs[:self.VIEWPORT_MAX_STATIONS + 1])
+        truncated = len(stations) > self.VIEWPORT_MAX_STATIONS
+        serializer = self.get_serializer(stations[:self.VIEWPORT_MAX_STATIONS], many=True)
+
+        return Response({'zoom': zoom, 'stations': serializer.data, 'truncated': truncated})
+
+    @action(detail=False, methods=['get'], url_path='cache-stats', permission_classes=[permissions.IsAdminUser])
+    def cache_stats(self, request):
+        return Response(station_cache.stats())
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[permissions.IsAuthenticated])
+    def bulk_import(self, request):
+        """
+        Create/update many stations from a CSV or NDJSON body (or a
+        multipart `file`). Rows with an `id` update that station.
+        """
+        user = request.user
+        if getattr(user, 'role', None) != 'chargerowner' and not user.is_staff:
+            return Response({'error': 'Not allowed'}, status=403)
+
+        if request.content_type.startswith('multipart/form-data'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'error': 'file is required'}, status=400)
+            fmt = bulk.format_for(upload.content_type, upload.name)
+            stream = upload
+        else:
+            fmt = bulk.format_for(request.content_type)
+            stream = request.stream
+
+        fmt = request.query_params.get('fmt', fmt)
+        if fmt not in bulk.FORMATS:
+            return Response({'error': 'Send text/csv or application/x-ndjson, or pass ?fmt=csv|ndjson'}, status=400)
+        if stream is None:
+            return Response({'error': 'Empty body'}, status=400)
+
+        result = bulk.import_stations(user, stream, fmt)
+        return Response(result.as_dict(), status=200 if not result.failed else 207)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def export(self, request):
+        fmt = request.query_params.get('fmt', bulk.FORMAT_CSV)
+        if fmt not in bulk.FORMATS:
+            return Response({'error': 'fmt must be csv or ndjson'}, status=400)
+
+        stations = Station.objects.all()
+        if not request.user.is_staff:
+            stations = stations.filter(owner=request.user)
+
+        response = StreamingHttpResponse(bulk.export_rows(stations, fmt), content_type=bulk.CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = f'attachment; filename="stations.{fmt}"'
+        return response
+
+    @action(detail=False, methods=['post'], url_path='bulk-update', permission_classes=[permissions.IsAuthenticated])
+    def bulk_update(self, request):
+        """
+        Change price/active/type/location on many stations at once:
+        {"ids": [1, 2], "set": {"price": "12.00"}} or
+        {"changes": [{"id": 1, "price": "12.00"}, {"id": 2, "is_active": false}]}
+        """
+        user = request.user
+        if getattr(user, 'role', None) != 'chargerowner' and not user.is_staff:
+            return Response({'error': 'Not allowed'}, status=403)
+
+        changes = bulk.parse_update_request(request.data)
+        changed, unchanged = bulk.update_stations(user, changes)
+        return Response({'changed': changed, 'unchanged': unchanged})
+
+    @action(detail=True, methods=['get'])
+    def quote(self, request, pk=None):
+        """
+        Server-side price for a booking window: ?start_at=&end_at= (ISO).
+        """
+        station = self.get_object()
+        start_at = parse_datetime(request.query_params.get('start_at', '')) or timezone.now()
+        end_at = parse_datetime(request.query_params.get('end_at', '')) or (
+            start_at + timedelta(minutes=settings.BOOKING_DEFAULT_MINUTES)
+        )
+        if timezone.is_naive(start_at) or timezone.is_naive(end_at):
+            return Response({'error': 'start_at and end_at need a timezone offset'}, status=400)
+        if end_at <= start_at or end_at - start_at > timedelta(minutes=settings.BOOKING_MAX_MINUTES):
+            return Response({'error': 'Invalid booking window'}, status=400)
+
+        return Response({
+            'station': station.pk,
+            'start_at': start_at,
+            'end_at': end_at,
+            'amount': pricing.quote_booking(station, start_at, end_at),
+        })
 
     # Assign owner automatically on create
     def perform_create(self, serializer):
@@ -149,6 +399,17 @@ class StationRatingViewSet(viewsets.ModelViewSet):
     queryset = StationRating.objects.all()
     serializer_class = StationRatingSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = RatingPagination
+    replica_reads = True
+
+    def get_queryset(self):
+        qs = StationRating.objects.select_related('station', 'user')
+
+        station_id = self.request.query_params.get('station')
+        if station_id and station_id.isdigit():
+            qs = qs.filter(station_id=station_id)
+
+        return qs
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
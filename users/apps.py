@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from django.conf import settings
+        from evfinder import scheduler
+        from . import outbox, signals
+        from .tasks import flush_expired_tokens, purge_expired_otps
+
+        scheduler.register('deliver_email', settings.EMAIL_OUTBOX_INTERVAL, outbox.deliver_pending)
+        scheduler.register('purge_sent_email', 6 * 60 * 60, outbox.purge_sent)
+        scheduler.register('purge_expired_otps', 60 * 60, purge_expired_otps)
+        scheduler.register('flush_expired_tokens', settings.TOKEN_FLUSH_INTERVAL, flush_expired_tokens)
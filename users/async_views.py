@@ -0,0 +1,46 @@
+"""
+Async (ASGI) versions of the OTP views that queue email: the same
+throttles and responses as SignupSendOTPView and send_otp, with the
+user lookup, the OTP store and the outbox insert awaited.
+"""
+from asgiref.sync import sync_to_async
+
+from evfinder.asyncapi import api_view, authenticate, check_throttles, render
+from . import otp, outbox
+from .models import Users
+from .throttling import OTPSendThrottle
+from .utils import asend_otp_email
+from .views import signup_otp_message
+
+
+@api_view(["POST"])
+async def signup_send_otp(request):
+    request = await authenticate(request)
+    await check_throttles(request, [OTPSendThrottle()])
+    email = request.data.get("email")
+
+    if not email:
+        return render({"error": "Email is required"}, status=400)
+
+    if await Users.objects.filter(email=email).aexists():
+        return render({"error": "Email already registered"}, status=400)
+
+    code = await sync_to_async(otp.get_store().issue)(otp.PURPOSE_SIGNUP, email)
+    await outbox.aenqueue(**signup_otp_message(email, code))
+
+    return render({"message": "OTP sent successfully", "email": email}, status=200)
+
+
+@api_view(["POST"])
+async def send_otp(request):
+    request = await authenticate(request)
+    await check_throttles(request, [OTPSendThrottle()])
+    email = request.data.get("email")
+
+    user = await Users.objects.filter(email=email).afirst() if email else None
+    if user is None:
+        return render({"error": "User not found."}, status=404)
+
+    code = await sync_to_async(otp.get_store().issue)(otp.PURPOSE_RESET, user.email)
+    await asend_otp_email(user, code)
+    return render({"message": "OTP sent successfully to your email."}, status=200)
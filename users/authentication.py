@@ -0,0 +1,153 @@
+"""
+JWT authentication that resolves request.user without a query.
+
+Access tokens carry the account's role and flags (users.tokens), and
+request.user is rebuilt from them as a Users instance with only those
+fields loaded. A per-user record in the auth cache takes precedence over
+the claims: every save or delete of a Users row writes it, so a role
+change or deactivation applies to tokens issued before it. The record
+lives as long as an access token does, so by the time it expires every
+token with older claims has expired too. Tokens without the claims load
+the row once and cache it.
+
+The records only reach every worker through a shared cache. With a
+per-process one (locmem, the default unless CACHE_BACKEND/CACHE_LOCATION
+point elsewhere) a deactivation would reach just the worker that saved
+it, so the claims aren't trusted and every request loads the row instead.
+
+Bulk queryset.update() calls bypass the signals; call remember() for
+the affected users after them.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from evfinder.caching import is_shared
+from .models import Users
+from .tokens import USER_CLAIMS
+
+FIELDS = ('id',) + USER_CLAIMS
+DELETED = 'deleted'
+
+
+def _alias():
+    return getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'default')
+
+
+def get_cache():
+    return caches[_alias()]
+
+
+def cache_enabled():
+    return is_shared(_alias())
+
+
+def _key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _record(user):
+    return {field: getattr(user, field) for field in FIELDS}
+
+
+def _store(user_id, record):
+    get_cache().set(_key(user_id), record, settings.AUTH_USER_CACHE_SECONDS)
+
+
+def remember(user):
+    """
+    Publish `user`'s current flags to authentication once the
+    transaction commits.
+    """
+    record = _record(user)
+    transaction.on_commit(lambda: _store(record['id'], record))
+
+
+def forget(user_id):
+    transaction.on_commit(lambda: _store(user_id, DELETED))
+
+
+def fetch(user_id):
+    return Users.objects.filter(pk=user_id).values(*FIELDS).first()
+
+
+async def afetch(user_id):
+    return await Users.objects.filter(pk=user_id).values(*FIELDS).afirst()
+
+
+def load(user_id):
+    record = fetch(user_id)
+    _store(user_id, record or DELETED)
+    return record
+
+
+async def aload(user_id):
+    record = await afetch(user_id)
+    await get_cache().aset(_key(user_id), record or DELETED, settings.AUTH_USER_CACHE_SECONDS)
+    return record
+
+
+def build_user(record):
+    # from_db() takes values in model field order; the rest are deferred
+    # and load on first access
+    names = [f.attname for f in Users._meta.concrete_fields if f.attname in record]
+    return Users.from_db(DEFAULT_DB_ALIAS, names, [record[name] for name in names])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+
+    def get_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        if not cache_enabled():
+            return self._user(fetch(user_id))
+        record = self._from_claims(user_id, validated_token, get_cache().get(_key(user_id)))
+        if record is None:
+            record = load(user_id)
+        return self._user(record)
+
+    async def aauthenticate(self, request):
+        """
+        authenticate() for async views: the same checks, with the cache
+        and (on a miss) the database awaited.
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+
+    async def aget_user(self, validated_token):
+        user_id = self._user_id(validated_token)
+        if not cache_enabled():
+            return self._user(await afetch(user_id))
+        record = self._from_claims(user_id, validated_token, await get_cache().aget(_key(user_id)))
+        if record is None:
+            record = await aload(user_id)
+        return self._user(record)
+
+    def _user_id(self, validated_token):
+        try:
+            return Users._meta.pk.to_python(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def _from_claims(self, user_id, validated_token, record):
+        # The cached record wins; claims fill in when there is none
+        if record is None and all(claim in validated_token for claim in USER_CLAIMS):
+            record = {'id': user_id, **{claim: validated_token[claim] for claim in USER_CLAIMS}}
+        return record
+
+    def _user(self, record):
+        if record is None or record == DELETED:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        if api_settings.CHECK_USER_IS_ACTIVE and not record['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        return build_user(record)
@@ -0,0 +1,105 @@
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import override_settings
+
+from evfinder.caching import is_shared
+from users import revocation
+from users.models import Users
+from users.tokens import UserRefreshToken, UserTokenRefreshSerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Time refresh-token blacklist checks and full refreshes with and without "
+        "the revocation filter (all rows are rolled back). With a per-process "
+        "revocation cache the filtered run uses a temporary file cache instead"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tokens", type=int, default=500, help="Refresh tokens checked per mode")
+        parser.add_argument("--revoked", type=int, default=5000, help="Blacklisted tokens already in the table")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as directory:
+            try:
+                with transaction.atomic():
+                    self._bench(options, self._filter_settings(directory))
+                    raise _Rollback()
+            except _Rollback:
+                pass
+            finally:
+                revocation.reset_filter()
+
+    def _filter_settings(self, directory):
+        """
+        Settings for the filtered run. filter_enabled() is false while the
+        revocation cache is per-process (locmem), so point it at a file
+        cache for the run rather than timing the unfiltered path twice.
+        """
+        alias = settings.TOKEN_REVOCATION_CACHE_ALIAS
+        overrides = {"TOKEN_REVOCATION_FILTER": True}
+        if not is_shared(alias):
+            self.stderr.write(self.style.WARNING(
+                f"Cache '{alias}' is per-process, so the filter is off in this configuration; "
+                f"timing it against a temporary file cache"
+            ))
+            overrides["CACHES"] = {
+                **settings.CACHES,
+                alias: {"BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": directory},
+            }
+        return overrides
+
+    def _bench(self, options, filter_settings):
+        tag = uuid.uuid4().hex[:8]
+        user = Users.objects.create_user(
+            username=f"bench-{tag}", email=f"bench-{tag}@example.invalid", password=None,
+        )
+        for _ in range(options["revoked"]):
+            UserRefreshToken.for_user(user).blacklist()
+
+        for enabled in (False, True):
+            revocation.reset_filter()
+            label = "filter" if enabled else "no filter"
+            with override_settings(**(filter_settings if enabled else {"TOKEN_REVOCATION_FILTER": False})):
+                tokens = [str(UserRefreshToken.for_user(user)) for _ in range(options["tokens"])]
+                if enabled:
+                    # Build the filter outside the timed loop
+                    UserRefreshToken(tokens[0])
+
+                seconds, queries = self._timed(lambda: [UserRefreshToken(token) for token in tokens])
+                self._report(f"check ({label})", seconds, queries, len(tokens))
+
+                seconds, queries = self._timed(lambda: [
+                    UserTokenRefreshSerializer(data={"refresh": token}).is_valid(raise_exception=True)
+                    for token in tokens
+                ])
+                self._report(f"refresh ({label})", seconds, queries, len(tokens))
+
+    def _timed(self, func):
+        queries = 0
+
+        def count(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count):
+            started = time.perf_counter()
+            func()
+            seconds = time.perf_counter() - started
+        return seconds, queries
+
+    def _report(self, label, seconds, queries, count):
+        self.stdout.write(
+            f"{label:<22} {count / seconds:8.0f}/s  {seconds / count * 1e6:8.1f} us each  "
+            f"{queries / count:.1f} queries each"
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from users.tasks import purge_expired_otps
+
+
+class Command(BaseCommand):
+    help = "Delete SignupOTP/EmailOTP rows past OTP_RETENTION_HOURS"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=None)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired_otps(hours=options['hours'])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} OTP rows"))
@@ -0,0 +1,48 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from users import outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails with a pool of couriers, each reusing one SMTP connection"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=2)
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--loop", action="store_true", help="Keep polling every --interval seconds")
+        parser.add_argument("--interval", type=float, default=2.0)
+        parser.add_argument("--purge", action="store_true", help="Also delete sent rows past retention")
+
+    def handle(self, *args, **options):
+        totals = []
+        lock = threading.Lock()
+
+        def worker():
+            courier = outbox.Courier(batch_size=options["batch_size"])
+            processed = 0
+            try:
+                while True:
+                    processed += courier.drain()
+                    if not options["loop"]:
+                        break
+                    courier.close_if_idle()
+                    time.sleep(options["interval"])
+            finally:
+                courier.close()
+                connection.close()
+                with lock:
+                    totals.append(processed)
+
+        threads = [threading.Thread(target=worker) for _ in range(options["workers"])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.stdout.write(f"Processed {sum(totals)} emails")
+        if options["purge"]:
+            self.stdout.write(f"Purged {outbox.purge_sent()} sent emails")
@@ -0,0 +1,210 @@
+"""
+One-time codes on a TTL key-value store.
+
+Each (purpose, subject) pair has at most one live code, stored under one
+key that expires with the code, so issuing replaces the old code and
+verifying is a single keyed lookup. Guesses are counted in a separate
+key with an atomic increment before the code is compared, so concurrent
+guesses can't share one attempt; after OTP_MAX_ATTEMPTS the code is
+dropped. A successful verify leaves a short-lived "verified" marker that
+the follow-up step (password reset) consumes exactly once.
+
+Backends: the Django cache (OTP_STORE = 'cache', any shared cache in
+production) or an in-process dict (OTP_STORE = 'local') for tests and
+single-process runs.
+"""
+import abc
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+PURPOSE_SIGNUP = 'signup'
+PURPOSE_RESET = 'reset'
+
+VERIFIED = 'verified'
+INVALID = 'invalid'
+EXPIRED = 'expired'
+LOCKED = 'locked'
+
+
+def _digest(value):
+    return hashlib.sha256(f'{settings.SECRET_KEY}:{value}'.encode()).hexdigest()
+
+
+def _code_key(purpose, subject):
+    return f'otp:{purpose}:{_digest(subject.strip().lower())}'
+
+
+def _verified_key(purpose, subject):
+    return f'otp:{purpose}:verified:{_digest(subject.strip().lower())}'
+
+
+def _attempts_key(purpose, subject):
+    return f'otp:{purpose}:attempts:{_digest(subject.strip().lower())}'
+
+
+class OTPStore(abc.ABC):
+    """
+    issue/verify on top of four primitives: get, set with a TTL, delete
+    (True if the key existed) and an atomic incr.
+    """
+
+    @abc.abstractmethod
+    def get(self, key):
+        ...
+
+    @abc.abstractmethod
+    def set(self, key, value, ttl):
+        ...
+
+    @abc.abstractmethod
+    def delete(self, key):
+        ...
+
+    @abc.abstractmethod
+    def incr(self, key, ttl):
+        """
+        Add one to the counter at `key` (created at 0 with `ttl`) and
+        return the new value.
+        """
+
+    def issue(self, purpose, subject, digits=4):
+        code = ''.join(secrets.choice('0123456789') for _ in range(digits))
+        record = {'code': _digest(code), 'expires': time.time() + settings.OTP_TTL_SECONDS}
+        self.set(_code_key(purpose, subject), record, settings.OTP_TTL_SECONDS)
+        self.delete(_attempts_key(purpose, subject))
+        self.delete(_verified_key(purpose, subject))
+        return code
+
+    def verify(self, purpose, subject, code):
+        key = _code_key(purpose, subject)
+        record = self.get(key)
+        if record is None or record['expires'] <= time.time():
+            return EXPIRED
+
+        # Counted before comparing: every concurrent guess gets its own number
+        attempts_key = _attempts_key(purpose, subject)
+        attempts = self.incr(attempts_key, max(1, int(record['expires'] - time.time()) + 1))
+        if attempts > settings.OTP_MAX_ATTEMPTS:
+            self.delete(key)
+            return LOCKED
+
+        if hmac.compare_digest(record['code'], _digest(str(code).strip())):
+            # Only the guess that removes the code verifies it
+            if not self.delete(key):
+                return EXPIRED
+            self.delete(attempts_key)
+            self.set(_verified_key(purpose, subject), True, settings.OTP_VERIFIED_TTL_SECONDS)
+            return VERIFIED
+
+        if attempts >= settings.OTP_MAX_ATTEMPTS:
+            self.delete(key)
+            return LOCKED
+        return INVALID
+
+    def is_verified(self, purpose, subject):
+        return bool(self.get(_verified_key(purpose, subject)))
+
+    def consume_verified(self, purpose, subject):
+        return self.delete(_verified_key(purpose, subject))
+
+
+class CacheOTPStore(OTPStore):
+
+    def __init__(self, alias='default'):
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, ttl):
+        self.cache.set(key, value, ttl)
+
+    def delete(self, key):
+        return self.cache.delete(key)
+
+    def incr(self, key, ttl):
+        self.cache.add(key, 0, ttl)
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Expired between the add and the incr
+            self.cache.add(key, 0, ttl)
+            return self.cache.incr(key)
+
+
+class LocalOTPStore(OTPStore):
+    """
+    In-process stand-in with the same TTL semantics; expired keys are
+    dropped on access and swept when the store grows.
+    """
+    SWEEP_EVERY = 1000
+
+    def __init__(self):
+        self.data = {}
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def get(self, key):
+        with self.lock:
+            item = self.data.get(key)
+            if item is None:
+                return None
+            value, expires = item
+            if expires <= time.monotonic():
+                del self.data[key]
+                return None
+            return value
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.data[key] = (value, time.monotonic() + ttl)
+            self.writes += 1
+            if self.writes % self.SWEEP_EVERY == 0:
+                self._sweep()
+
+    def delete(self, key):
+        with self.lock:
+            item = self.data.pop(key, None)
+            return item is not None and item[1] > time.monotonic()
+
+    def incr(self, key, ttl):
+        with self.lock:
+            now = time.monotonic()
+            value, expires = self.data.get(key, (0, 0))
+            if expires <= now:
+                value, expires = 0, now + ttl
+            self.data[key] = (value + 1, expires)
+            return value + 1
+
+    def _sweep(self):
+        now = time.monotonic()
+        for key in [key for key, (_, expires) in self.data.items() if expires <= now]:
+            del self.data[key]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if settings.OTP_STORE == 'local':
+                    _store = LocalOTPStore()
+                else:
+                    _store = CacheOTPStore(settings.OTP_CACHE_ALIAS)
+    return _store
+
+
+def reset_store():
+    global _store
+    _store = None
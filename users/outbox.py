@@ -0,0 +1,217 @@
+"""
+Transactional email outbox.
+
+Requests call enqueue(), which renders the message and stores an
+OutboundEmail row, so request latency never depends on SMTP. Couriers
+claim due rows in batches and send them over one SMTP connection that
+stays open between batches; failures are retried with exponential
+backoff until EMAIL_OUTBOX_MAX_ATTEMPTS, then marked failed.
+
+A claim pushes next_attempt_at forward by EMAIL_OUTBOX_CLAIM_SECONDS, so
+rows held by a courier that died are picked up again after that.
+
+Bodies carry one-time codes, so they are cleared once a row is sent or
+has failed for good; only the envelope stays for the retention period.
+"""
+import functools
+import logging
+import random
+import smtplib
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection as db_connection, transaction
+from django.db.models import F
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=64)
+def _template(name):
+    # Parsed once per process, whatever the template loader config is
+    return get_template(name)
+
+
+def render(template_name, context):
+    return _template(template_name).render(context)
+
+
+def enqueue(subject, to, body='', template=None, context=None, from_email=None):
+    """
+    Queue an email for delivery. `template` (with `context`) renders the
+    HTML part; `body` is the plain-text part.
+    """
+    return OutboundEmail.objects.create(**_fields(subject, to, body, template, context, from_email))
+
+
+async def aenqueue(subject, to, body='', template=None, context=None, from_email=None):
+    return await OutboundEmail.objects.acreate(**_fields(subject, to, body, template, context, from_email))
+
+
+def _fields(subject, to, body, template, context, from_email):
+    if isinstance(to, str):
+        to = [to]
+    return {
+        'subject': subject,
+        'body': body,
+        'html': render(template, context or {}) if template else '',
+        'from_email': from_email or settings.EMAIL_HOST_USER or '',
+        'to': list(to),
+    }
+
+
+def _message(email):
+    message = EmailMultiAlternatives(
+        subject=email.subject,
+        body=email.body,
+        from_email=email.from_email or None,
+        to=email.to,
+    )
+    if email.html:
+        if email.body:
+            message.attach_alternative(email.html, 'text/html')
+        else:
+            message.body = email.html
+            message.content_subtype = 'html'
+    return message
+
+
+def claim(batch_size):
+    """
+    Lock and lease up to `batch_size` due rows; other couriers skip them.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = OutboundEmail.objects.filter(
+            status=OutboundEmail.STATUS_PENDING, next_attempt_at__lte=now,
+        ).order_by('next_attempt_at', 'id')
+        if db_connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return []
+        OutboundEmail.objects.filter(pk__in=ids).update(
+            attempts=F('attempts') + 1,
+            next_attempt_at=now + timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_SECONDS),
+        )
+    return list(OutboundEmail.objects.filter(pk__in=ids).order_by('id'))
+
+
+def _retry_at(attempts):
+    delay = settings.EMAIL_OUTBOX_RETRY_SECONDS * (2 ** (attempts - 1))
+    return timezone.now() + timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+class Courier:
+    """
+    Delivers claimed batches over one reusable SMTP connection. One
+    courier per thread; the connection is reopened after errors and
+    closed when idle for EMAIL_OUTBOX_IDLE_SECONDS.
+    """
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+        self.connection = None
+        self.last_used = 0.0
+
+    def _connection(self):
+        if self.connection is None:
+            self.connection = get_connection(fail_silently=False)
+            self.connection.open()
+        self.last_used = time.monotonic()
+        return self.connection
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                logger.warning("Closing the SMTP connection failed", exc_info=True)
+            self.connection = None
+
+    def close_if_idle(self):
+        if self.connection is not None and time.monotonic() - self.last_used > settings.EMAIL_OUTBOX_IDLE_SECONDS:
+            self.close()
+
+    def deliver_batch(self):
+        """
+        Send one claimed batch; returns the number of rows processed.
+        """
+        emails = claim(self.batch_size)
+        if not emails:
+            return 0
+
+        sent, retry, failed = [], [], []
+        for email in emails:
+            try:
+                self._connection().send_messages([_message(email)])
+                sent.append(email.pk)
+            except Exception as exc:
+                logger.warning("Email %s failed (attempt %s): %s", email.pk, email.attempts, exc)
+                if isinstance(exc, (smtplib.SMTPServerDisconnected, OSError)):
+                    self.close()
+                if email.attempts >= settings.EMAIL_OUTBOX_MAX_ATTEMPTS:
+                    failed.append((email, exc))
+                else:
+                    retry.append((email, exc))
+
+        now = timezone.now()
+        if sent:
+            OutboundEmail.objects.filter(pk__in=sent).update(
+                status=OutboundEmail.STATUS_SENT, sent_at=now, last_error='', body='', html='',
+            )
+        for email, exc in retry:
+            OutboundEmail.objects.filter(pk=email.pk).update(
+                next_attempt_at=_retry_at(email.attempts), last_error=str(exc)[:1000],
+            )
+        for email, exc in failed:
+            OutboundEmail.objects.filter(pk=email.pk).update(
+                status=OutboundEmail.STATUS_FAILED, last_error=str(exc)[:1000], body='', html='',
+            )
+        return len(emails)
+
+    def drain(self, max_batches=None):
+        """
+        Deliver batches until nothing is due (or `max_batches` ran).
+        """
+        processed = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            count = self.deliver_batch()
+            if not count:
+                break
+            processed += count
+            batches += 1
+        return processed
+
+
+_courier = None
+
+
+def deliver_pending():
+    """
+    Scheduler entry point: drain the outbox, keeping this process's
+    courier (and its SMTP connection) across runs.
+    """
+    global _courier
+
+    if _courier is None:
+        _courier = Courier()
+    processed = _courier.drain()
+    _courier.close_if_idle()
+    return processed
+
+
+def purge_sent(days=None):
+    days = settings.EMAIL_OUTBOX_RETENTION_DAYS if days is None else days
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted, _ = OutboundEmail.objects.filter(
+        status=OutboundEmail.STATUS_SENT, sent_at__lt=cutoff,
+    ).delete()
+    return deleted
@@ -0,0 +1,188 @@
+"""
+Per-process Bloom filter of revoked refresh-token JTIs.
+
+Checking a refresh token against the blacklist is a query on every
+refresh, and almost every answer is "not revoked". Each process keeps a
+Bloom filter of blacklisted JTIs: a miss is definitive and skips the
+query, and a hit (revoked, or a rare false positive) is confirmed in the
+database.
+
+Revoking bumps a counter in the shared cache on commit. A process whose
+filter is behind that counter syncs the rows blacklisted since its last
+sync (re-reading a short overlap, so rows from transactions that
+committed late are not missed). Syncs run at most once per
+TOKEN_REVOCATION_SYNC_SECONDS; while a filter is behind it is not used
+and checks go to the database, so a revocation is never missed. A
+filter also resyncs every TOKEN_REVOCATION_RESYNC_SECONDS whatever the
+counter says, in case the cache lost it.
+
+The counter only works if every process sees it, so the filter is used
+only when TOKEN_REVOCATION_CACHE_ALIAS is a shared cache; with a
+per-process cache (locmem) every check queries the blacklist.
+"""
+import hashlib
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from evfinder.caching import is_shared
+
+VERSION_KEY = 'auth:revoked:version'
+
+
+def _alias():
+    return getattr(settings, 'TOKEN_REVOCATION_CACHE_ALIAS', 'default')
+
+
+def get_cache():
+    return caches[_alias()]
+
+
+def _version(cache):
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, 1, None)
+        version = cache.get(VERSION_KEY, 1)
+    return version
+
+
+def _bump():
+    cache = get_cache()
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.add(VERSION_KEY, 1, None)
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter sized for `capacity` items at `error_rate`
+    false positives, using double hashing over one blake2b digest.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.capacity = capacity
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * step) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationFilter:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.bloom = None
+        self.version = None
+        self.synced_at = None
+        self.last_sync = 0.0
+        self.recent = {}
+
+    def _rows(self, queryset):
+        return queryset.values_list('id', 'token__jti', 'blacklisted_at').iterator(chunk_size=5000)
+
+    def _rebuild(self):
+        started = timezone.now()
+        live = BlacklistedToken.objects.filter(token__expires_at__gt=started)
+        capacity = max(settings.TOKEN_REVOCATION_FILTER_CAPACITY, 2 * live.count())
+        bloom = BloomFilter(capacity, settings.TOKEN_REVOCATION_FILTER_ERROR_RATE)
+
+        overlap = started - timedelta(seconds=settings.TOKEN_REVOCATION_SYNC_OVERLAP_SECONDS)
+        recent = {}
+        for pk, jti, blacklisted_at in self._rows(live):
+            bloom.add(jti)
+            if blacklisted_at >= overlap:
+                recent[pk] = blacklisted_at
+
+        self.bloom = bloom
+        self.recent = recent
+        self.synced_at = started
+
+    def _sync(self):
+        started = timezone.now()
+        overlap = timedelta(seconds=settings.TOKEN_REVOCATION_SYNC_OVERLAP_SECONDS)
+        rows = BlacklistedToken.objects.filter(blacklisted_at__gte=self.synced_at - overlap)
+        for pk, jti, blacklisted_at in self._rows(rows):
+            if pk not in self.recent:
+                self.bloom.add(jti)
+                self.recent[pk] = blacklisted_at
+
+        cutoff = started - overlap
+        self.recent = {pk: at for pk, at in self.recent.items() if at >= cutoff}
+        self.synced_at = started
+
+    def might_be_revoked(self, jti):
+        """
+        False when `jti` is certainly not blacklisted, True when it may be,
+        None when the filter is behind and can't answer.
+        """
+        version = _version(get_cache())
+        with self.lock:
+            now = time.monotonic()
+            if self.bloom is None or self.bloom.count > self.bloom.capacity:
+                self._rebuild()
+                self.version = version
+                self.last_sync = now
+            elif self.version != version:
+                if now - self.last_sync < settings.TOKEN_REVOCATION_SYNC_SECONDS:
+                    return None
+                self.last_sync = now
+                self._sync()
+                self.version = version
+            elif now - self.last_sync >= settings.TOKEN_REVOCATION_RESYNC_SECONDS:
+                self.last_sync = now
+                self._sync()
+            return jti in self.bloom
+
+    def add(self, jti):
+        with self.lock:
+            if self.bloom is not None:
+                self.bloom.add(jti)
+
+
+_filter = RevocationFilter()
+
+
+def filter_enabled():
+    return getattr(settings, 'TOKEN_REVOCATION_FILTER', True) and is_shared(_alias())
+
+
+def is_revoked(jti):
+    if filter_enabled() and _filter.might_be_revoked(jti) is False:
+        return False
+    return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+def revoked(jti):
+    """
+    Record a JTI that was just blacklisted: this process sees it at once,
+    other processes sync once the transaction commits.
+    """
+    _filter.add(jti)
+    transaction.on_commit(_bump)
+
+
+def reset_filter():
+    global _filter
+    _filter = RevocationFilter()
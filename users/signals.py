@@ -0,0 +1,17 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import authentication
+from .models import Users
+
+
+@receiver(post_save, sender=Users)
+def user_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    authentication.remember(instance)
+
+
+@receiver(post_delete, sender=Users)
+def user_deleted(sender, instance, **kwargs):
+    authentication.forget(instance.pk)
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+from .models import EmailOTP, SignupOTP
+
+
+def purge_expired_otps(hours=None):
+    """
+    Delete SignupOTP/EmailOTP rows older than OTP_RETENTION_HOURS. Codes
+    now live in users.otp; this keeps the old tables from growing.
+    Returns the number of rows deleted.
+    """
+    hours = settings.OTP_RETENTION_HOURS if hours is None else hours
+    cutoff = timezone.now() - timedelta(hours=hours)
+    signup, _ = SignupOTP.objects.filter(created_at__lt=cutoff).delete()
+    email, _ = EmailOTP.objects.filter(created_at__lt=cutoff).delete()
+    return signup + email
+
+
+def flush_expired_tokens():
+    """
+    Delete outstanding refresh tokens past their expiry, and with them
+    their blacklist rows; an expired token is rejected before the
+    blacklist is consulted. Returns the number of rows deleted.
+    """
+    deleted, _ = OutstandingToken.objects.filter(expires_at__lte=timezone.now()).delete()
+    return deleted
@@ -1,3 +1,383 @@
-from django.test import TestCase
+import smtplib
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core import mail
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from evfinder import throttling
+from evfinder.testing import AsyncRoutesMixin, shared_cache
+from . import otp, outbox, revocation
+from .models import OutboundEmail, Users
+from .tokens import UserRefreshToken
+
+
+class RevocationTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        revocation.reset_filter()
+        self.user = Users.objects.create_user(username='ev', email='ev@example.com', password='pw')
+        self.client = APIClient()
+
+    def refresh(self, token):
+        return self.client.post('/api/token/refresh/', {'refresh': token}, format='json')
+
+    def test_rotated_refresh_token_is_rejected(self):
+        token = str(UserRefreshToken.for_user(self.user))
+        self.assertEqual(self.refresh(token).status_code, 200)
+        self.assertEqual(self.refresh(token).status_code, 401)
+
+    def test_per_process_cache_checks_the_blacklist(self):
+        # locmem can't carry revocations between workers
+        self.assertFalse(revocation.filter_enabled())
+        token = UserRefreshToken.for_user(self.user)
+        with self.assertNumQueries(1):
+            self.assertFalse(revocation.is_revoked(token['jti']))
+
+    def test_shared_cache_filter(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES=shared_cache(directory)):
+            self.assertTrue(revocation.filter_enabled())
+            live = UserRefreshToken.for_user(self.user)
+            revoked = UserRefreshToken.for_user(self.user)
+            revocation.is_revoked(live['jti'])
+
+            # Misses are answered by the filter alone
+            with self.assertNumQueries(0):
+                self.assertFalse(revocation.is_revoked(live['jti']))
+
+            with self.captureOnCommitCallbacks(execute=True):
+                revoked.blacklist(self.user)
+            self.assertTrue(revocation.is_revoked(revoked['jti']))
+
+    def test_revocation_from_another_process(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            CACHES=shared_cache(directory), TOKEN_REVOCATION_SYNC_SECONDS=0,
+        ):
+            token = UserRefreshToken.for_user(self.user)
+            self.assertFalse(revocation.is_revoked(token['jti']))
+
+            # Blacklisted elsewhere: the row plus the version bump
+            BlacklistedToken.objects.create(token=token.outstand(self.user)[0])
+            revocation._bump()
+            self.assertTrue(revocation.is_revoked(token['jti']))
+
+    def test_resync_without_version_bump(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(
+            CACHES=shared_cache(directory), TOKEN_REVOCATION_RESYNC_SECONDS=0,
+        ):
+            token = UserRefreshToken.for_user(self.user)
+            self.assertFalse(revocation.is_revoked(token['jti']))
+
+            # The bump was lost (e.g. the cache restarted)
+            BlacklistedToken.objects.create(token=token.outstand(self.user)[0])
+            self.assertTrue(revocation.is_revoked(token['jti']))
+
+
+@override_settings(
+    THROTTLE_BUCKETS={'login': {'ip': '3/min', 'account': '2/min'}},
+    THROTTLE_EXEMPT_IPS=['10.0.0.1'],
+)
+class ThrottleTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def login(self, account='ev@example.com', **extra):
+        return self.client.post(
+            '/api/login/', {'email_or_username': account, 'password': 'wrong'}, format='json', **extra,
+        )
+
+    def test_window_limit_is_exact(self):
+        key = 'throttle:test'
+        self.assertEqual([throttling.take(key, 3, 60, now=120) for _ in range(3)], [0, 0, 0])
+        self.assertTrue(throttling.take(key, 3, 60, now=121))
+        # Halfway through the next window the previous one still weighs half
+        self.assertEqual(throttling.take(key, 3, 60, now=210), 0)
+        self.assertTrue(throttling.take(key, 3, 60, now=210))
+
+    def test_rejected_requests_do_not_use_the_allowance(self):
+        key = 'throttle:test'
+        throttling.take(key, 1, 60, now=0)
+        for _ in range(5):
+            self.assertTrue(throttling.take(key, 1, 60, now=30))
+        self.assertEqual(throttling.take(key, 1, 60, now=120), 0)
+
+    def test_account_bucket_returns_retry_after(self):
+        self.assertNotIn(429, [self.login().status_code for _ in range(2)])
+        response = self.login()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+    def test_forwarded_for_does_not_reset_the_ip_bucket(self):
+        statuses = [
+            self.login(account=f'user{n}@example.com', HTTP_X_FORWARDED_FOR=f'203.0.113.{n}').status_code == 429
+            for n in range(4)
+        ]
+        self.assertEqual(statuses, [False, False, False, True])
+
+    def test_forwarded_for_cannot_claim_an_exempt_ip(self):
+        statuses = [self.login(HTTP_X_FORWARDED_FOR='10.0.0.1').status_code for _ in range(3)]
+        self.assertEqual(statuses[-1], 429)
+
+    def test_exempt_ip_matches_remote_addr(self):
+        statuses = [self.login(REMOTE_ADDR='10.0.0.1').status_code for _ in range(4)]
+        self.assertNotIn(429, statuses)
+
+
+@override_settings(THROTTLE_BUCKETS={}, OTP_MAX_ATTEMPTS=3)
+class OTPTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        otp.reset_store()
+        self.store = otp.get_store()
+        self.user = Users.objects.create_user(username='ev', email='ev@example.com', password='old')
+        self.client = APIClient()
+
+    def reset_password(self, password='new'):
+        return self.client.put(
+            '/api/forgot-password/', {'email': self.user.email, 'new_password': password}, format='json',
+        )
+
+    def test_reset_flow(self):
+        code = self.store.issue(otp.PURPOSE_RESET, self.user.email)
+        response = self.client.post('/api/verify-otp/', {'email': self.user.email, 'code': code}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.reset_password().status_code, 200)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('new'))
+        # The verified marker is single-use
+        self.assertEqual(self.reset_password('again').status_code, 400)
+
+    def test_signup_code_does_not_reset_password(self):
+        code = self.store.issue(otp.PURPOSE_SIGNUP, self.user.email)
+        self.assertEqual(self.store.verify(otp.PURPOSE_SIGNUP, self.user.email, code), otp.VERIFIED)
+        self.assertEqual(self.reset_password().status_code, 400)
+
+    def test_code_is_single_use(self):
+        code = self.store.issue(otp.PURPOSE_RESET, self.user.email)
+        self.assertEqual(self.store.verify(otp.PURPOSE_RESET, self.user.email, code), otp.VERIFIED)
+        self.assertEqual(self.store.verify(otp.PURPOSE_RESET, self.user.email, code), otp.EXPIRED)
+
+    def test_wrong_guesses_lock_the_code(self):
+        code = self.store.issue(otp.PURPOSE_RESET, self.user.email)
+        wrong = '0000' if code != '0000' else '1111'
+        results = [self.store.verify(otp.PURPOSE_RESET, self.user.email, wrong) for _ in range(3)]
+        self.assertEqual(results, [otp.INVALID, otp.INVALID, otp.LOCKED])
+        self.assertEqual(self.store.verify(otp.PURPOSE_RESET, self.user.email, code), otp.EXPIRED)
+
+    def test_attempts_are_counted_apart_from_the_code(self):
+        code = self.store.issue(otp.PURPOSE_RESET, self.user.email)
+        # Guesses already counted by other requests that read the same record
+        for _ in range(3):
+            self.store.incr(otp._attempts_key(otp.PURPOSE_RESET, self.user.email), 60)
+        self.assertEqual(self.store.verify(otp.PURPOSE_RESET, self.user.email, code), otp.LOCKED)
+
+    def test_new_code_resets_attempts(self):
+        self.store.issue(otp.PURPOSE_RESET, self.user.email)
+        self.store.verify(otp.PURPOSE_RESET, self.user.email, 'x')
+        self.store.verify(otp.PURPOSE_RESET, self.user.email, 'x')
+        code = self.store.issue(otp.PURPOSE_RESET, self.user.email)
+        self.assertEqual(self.store.verify(otp.PURPOSE_RESET, self.user.email, 'x'), otp.INVALID)
+        self.assertEqual(self.store.verify(otp.PURPOSE_RESET, self.user.email, code), otp.VERIFIED)
+
+    def test_sent_email_is_scrubbed(self):
+        response = self.client.post('/api/send-otp/', {'email': self.user.email}, format='json')
+        self.assertEqual(response.status_code, 200)
+        outbox.Courier().drain()
+
+        self.assertEqual(len(mail.outbox), 1)
+        email = OutboundEmail.objects.get()
+        self.assertEqual(email.status, OutboundEmail.STATUS_SENT)
+        self.assertEqual((email.body, email.html), ('', ''))
+
+
+@override_settings(OTP_STORE='local')
+class LocalOTPStoreTests(OTPTests):
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(otp.reset_store)
+
+
+class AuthenticationTests(TestCase):
+    # my-bookings on an empty account: the validators' aggregate and the page
+    READ_QUERIES = 2
+
+    def setUp(self):
+        cache.clear()
+        self.user = Users.objects.create_user(username='ev', email='ev@example.com', password='pw', role='evowner')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {UserRefreshToken.for_user(self.user).access_token}')
+
+    def my_bookings(self):
+        return self.client.get('/api/bookings/my-bookings/')
+
+    def deactivate(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+
+    def test_shared_cache_reads_the_user_from_the_token(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES=shared_cache(directory)):
+            with self.assertNumQueries(self.READ_QUERIES):
+                self.assertEqual(self.my_bookings().status_code, 200)
+
+    def test_shared_cache_record_overrides_the_claims(self):
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES=shared_cache(directory)):
+            self.deactivate()
+            # Still active in the token; the cached record wins without a query
+            with self.assertNumQueries(0):
+                self.assertEqual(self.my_bookings().status_code, 401)
+
+    def test_per_process_cache_loads_the_user(self):
+        with self.assertNumQueries(self.READ_QUERIES + 1):
+            self.assertEqual(self.my_bookings().status_code, 200)
+        self.deactivate()
+        self.assertEqual(self.my_bookings().status_code, 401)
+
+
+class FakeSMTP:
+    """
+    Stands in for smtplib.SMTP under Django's SMTP backend: records each
+    connection and message, and raises the queued `failures` in turn.
+    """
+    connections = []
+    messages = []
+    failures = []
+
+    def __init__(self, host, port, **kwargs):
+        self.connections.append(self)
+
+    def starttls(self, **kwargs):
+        pass
+
+    def sendmail(self, from_email, recipients, message):
+        if self.failures:
+            raise self.failures.pop(0)
+        self.messages.append(recipients)
+
+    def quit(self):
+        pass
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+    EMAIL_HOST_USER='', EMAIL_OUTBOX_MAX_ATTEMPTS=2, EMAIL_OUTBOX_RETRY_SECONDS=30, THROTTLE_BUCKETS={},
+)
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        FakeSMTP.connections, FakeSMTP.messages, FakeSMTP.failures = [], [], []
+        patcher = mock.patch('smtplib.SMTP', FakeSMTP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = APIClient()
+
+    def enqueue(self, count=1):
+        return [outbox.enqueue('Hello', f'user{n}@example.com', body='Hi') for n in range(count)]
+
+    def make_due(self):
+        OutboundEmail.objects.update(next_attempt_at=timezone.now())
+
+    def drain_failing(self, courier=None):
+        with self.assertLogs('users.outbox', 'WARNING'):
+            return (courier or outbox.Courier()).drain()
+
+    def test_batches_reuse_one_connection(self):
+        self.enqueue(5)
+        self.assertEqual(outbox.Courier(batch_size=2).drain(), 5)
+        self.assertEqual(len(FakeSMTP.connections), 1)
+        self.assertEqual(len(FakeSMTP.messages), 5)
+        self.assertEqual(OutboundEmail.objects.filter(status=OutboundEmail.STATUS_SENT).count(), 5)
+
+    def test_failed_send_is_retried_with_backoff(self):
+        [email] = self.enqueue()
+        FakeSMTP.failures.append(smtplib.SMTPServerDisconnected('gone'))
+        courier = outbox.Courier()
+        before = timezone.now()
+        self.assertEqual(self.drain_failing(courier), 1)
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts, email.last_error), (OutboundEmail.STATUS_PENDING, 1, 'gone'))
+        delay = (email.next_attempt_at - before).total_seconds()
+        self.assertTrue(0.8 * 30 <= delay <= 1.2 * 30 + 1)
+        # Not due yet
+        self.assertEqual(courier.drain(), 0)
+
+        self.make_due()
+        courier.drain()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.STATUS_SENT, 2))
+        # The courier reconnected after the server dropped it
+        self.assertEqual(len(FakeSMTP.connections), 2)
+
+    def test_gives_up_after_max_attempts(self):
+        [email] = self.enqueue()
+        FakeSMTP.failures.extend([smtplib.SMTPRecipientsRefused({}), smtplib.SMTPRecipientsRefused({})])
+        self.drain_failing()
+        self.make_due()
+        self.drain_failing()
+
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), (OutboundEmail.STATUS_FAILED, 2))
+        self.assertEqual(email.body, '')
+        self.make_due()
+        self.assertEqual(outbox.Courier().drain(), 0)
+
+    def test_signup_only_queues_the_email(self):
+        response = self.client.post('/api/signup-send-otp/', {'email': 'new@example.com'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        email = OutboundEmail.objects.get()
+        self.assertEqual((email.status, email.to), (OutboundEmail.STATUS_PENDING, ['new@example.com']))
+        self.assertEqual(FakeSMTP.connections, [])
+
+
+@override_settings(THROTTLE_BUCKETS={})
+class AsyncOTPRouteTests(AsyncRoutesMixin, TestCase):
+
+    def setUp(self):
+        cache.clear()
+        otp.reset_store()
+        Users.objects.create_user(username='ev', email='ev@example.com', password='pw')
+        self.client = APIClient()
+
+    def post(self, path, body):
+        drf = self.client.post(path, body, format='json')
+        native = self.asgi('post', path, body, content_type='application/json')
+        self.assertEqual((native.status_code, native.json()), (drf.status_code, drf.json()))
+        return native
+
+    def test_responses_match_the_drf_views(self):
+        cases = [
+            ('/api/signup-send-otp/', {'email': 'new@example.com'}),
+            ('/api/signup-send-otp/', {'email': 'ev@example.com'}),
+            ('/api/signup-send-otp/', {}),
+            ('/api/send-otp/', {'email': 'ev@example.com'}),
+            ('/api/send-otp/', {'email': 'nobody@example.com'}),
+        ]
+        for path, body in cases:
+            with self.subTest(path=path, body=body):
+                self.post(path, body)
+
+    def test_codes_are_queued_like_the_drf_views(self):
+        for path, email in (('/api/signup-send-otp/', 'new@example.com'), ('/api/send-otp/', 'ev@example.com')):
+            with self.subTest(path=path):
+                OutboundEmail.objects.all().delete()
+                self.post(path, {'email': email})
+                drf, native = OutboundEmail.objects.order_by('id')
+                self.assertEqual((native.subject, native.to, native.status), (drf.subject, drf.to, drf.status))
+                self.assertEqual(native.status, OutboundEmail.STATUS_PENDING)
+        self.assertEqual(mail.outbox, [])
+
+    def test_get_is_not_allowed(self):
+        self.assertEqual(self.asgi('get', '/api/send-otp/').status_code, 405)
@@ -0,0 +1,21 @@
+from evfinder.throttling import WindowThrottle
+
+
+class LoginThrottle(WindowThrottle):
+    scope = 'login'
+
+
+class SignupThrottle(WindowThrottle):
+    scope = 'signup'
+
+
+class OTPSendThrottle(WindowThrottle):
+    scope = 'otp_send'
+
+
+class OTPVerifyThrottle(WindowThrottle):
+    scope = 'otp_verify'
+
+
+class PasswordResetThrottle(WindowThrottle):
+    scope = 'password_reset'
@@ -0,0 +1,91 @@
+"""
+JWTs that carry the account's role and flags.
+
+users.authentication rebuilds request.user from these claims instead of
+loading the row. Refreshing re-reads the row, so the claims in a new
+access token are never older than the refresh itself. Blacklist checks
+go through the revocation filter (users.revocation) first.
+"""
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from . import revocation
+from .models import Users
+
+# Fields copied into the token and kept in the per-user auth cache
+USER_CLAIMS = ('username', 'email', 'role', 'is_staff', 'is_superuser', 'is_active', 'is_verified')
+
+
+def set_user_claims(token, user):
+    for field in USER_CLAIMS:
+        token[field] = getattr(user, field)
+    return token
+
+
+class UserRefreshToken(RefreshToken):
+
+    @classmethod
+    def for_user(cls, user):
+        # Access tokens copy every claim of their refresh token
+        return set_user_claims(super().for_user(user), user)
+
+    def check_blacklist(self):
+        if revocation.is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def _outstanding(self, user=None):
+        # Like simplejwt's version, but the user is only looked up (when
+        # not passed in) if the outstanding row has to be created
+        jti = self.payload[api_settings.JTI_CLAIM]
+        if user is None:
+            token = OutstandingToken.objects.filter(jti=jti).first()
+            if token is not None:
+                return token, False
+            user = Users.objects.filter(**{api_settings.USER_ID_FIELD: self.payload.get(api_settings.USER_ID_CLAIM)}).first()
+        return OutstandingToken.objects.get_or_create(jti=jti, defaults={
+            "user": user,
+            "created_at": self.current_time,
+            "token": str(self),
+            "expires_at": datetime_from_epoch(self.payload["exp"]),
+        })
+
+    def outstand(self, user=None):
+        return self._outstanding(user)
+
+    def blacklist(self, user=None):
+        token, _ = self._outstanding(user)
+        result = BlacklistedToken.objects.get_or_create(token=token)
+        revocation.revoked(self.payload[api_settings.JTI_CLAIM])
+        return result
+
+
+class UserTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = UserRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+
+        user = Users.objects.filter(**{api_settings.USER_ID_FIELD: refresh.payload.get(api_settings.USER_ID_CLAIM)}).first()
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(self.error_messages["no_active_account"], "no_active_account")
+        set_user_claims(refresh, user)
+
+        data = {"access": str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist(user)
+
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            refresh.outstand(user)
+
+            data["refresh"] = str(refresh)
+
+        return data
@@ -1,13 +1,28 @@
-from django.core.mail import EmailMessage
-from django.template.loader import render_to_string
-from django.conf import settings
+from . import outbox
+
+RESET_SUBJECT = "EVLocate - Email Verification Code"
+RESET_TEMPLATE = '../templates/reset_password_email.html'
+
 
 def send_otp_email(user, otp):
-    subject = "EVLocate - Email Verification Code"
-    message = render_to_string('../templates/reset_password_email.html', {
-        'username': user.username,
-        'otp': otp,
-    })
-    email = EmailMessage(subject, message, settings.EMAIL_HOST_USER, [user.email])
-    email.content_subtype = "html"
-    email.send()
+    outbox.enqueue(
+        RESET_SUBJECT,
+        [user.email],
+        template=RESET_TEMPLATE,
+        context={
+            'username': user.username,
+            'otp': otp,
+        },
+    )
+
+
+async def asend_otp_email(user, otp):
+    await outbox.aenqueue(
+        RESET_SUBJECT,
+        [user.email],
+        template=RESET_TEMPLATE,
+        context={
+            'username': user.username,
+            'otp': otp,
+        },
+    )
@@ -1,13 +1,12 @@
 from rest_framework.permissions import AllowAny
 from rest_framework import status, permissions, views, viewsets
 from rest_framework.response import Response
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from django.template.loader import get_template
 from django.core.mail import EmailMultiAlternatives
 from django.conf import settings
 from django.db.models import Q
 from django.contrib.auth.hashers import check_password
-from rest_framework_simplejwt.tokens import RefreshToken
 from random import randint
 import random
 
@@ -19,6 +18,33 @@ from .serializers import (
     SignupOTPSerializer
 )
 from .utils import send_otp_email
+from . import otp, outbox
+from .tokens import UserRefreshToken
+from .throttling import (
+    LoginThrottle,
+    OTPSendThrottle,
+    OTPVerifyThrottle,
+    PasswordResetThrottle,
+    SignupThrottle,
+)
+
+
+def signup_otp_message(email, code):
+    return {
+        "subject": "EVLocate Signup OTP",
+        "to": [email],
+        "body": f"Your EVLocate signup OTP is {code}",
+        "template": "../templates/Signup_otp.html",
+        "context": {"otp": code, "username": email.split("@")[0]},
+    }
+
+
+def otp_error(result):
+    if result == otp.LOCKED:
+        return Response({"error": "Too many attempts. Please request a new OTP."}, status=status.HTTP_429_TOO_MANY_REQUESTS)
+    if result == otp.EXPIRED:
+        return Response({"error": "OTP expired or not found. Please request a new one."}, status=status.HTTP_400_BAD_REQUEST)
+    return Response({"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST)
 
 
 # 🧍‍♂️ User ViewSet
@@ -27,6 +53,11 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     permission_classes = [permissions.AllowAny]
 
+    def get_throttles(self):
+        if self.action == "create":
+            return [SignupThrottle()]
+        return super().get_throttles()
+
 
 from rest_framework import permissions, status, views
 from rest_framework.response import Response
@@ -38,6 +69,7 @@ import random
 
 class SignupSendOTPView(views.APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [OTPSendThrottle]
 
     def post(self, request):
         email = request.data.get("email")
@@ -49,34 +81,11 @@ class SignupSendOTPView(views.APIView):
         if Users.objects.filter(email=email).exists():
             return Response({"error": "Email already registered"}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Delete any old OTPs for same email
-        SignupOTP.objects.filter(email=email).delete()
-
-
-
-        # Generate new OTP
-        code = str(random.randint(1000, 9999))
-        otp_record = SignupOTP.objects.create(email=email, code=code)
-
-        # Send email
-        html_template = get_template("../templates/Signup_otp.html")
-        html_content = html_template.render({"otp": code, "username": email.split("@")[0]})
+        # Issuing replaces any earlier code for this email
+        code = otp.get_store().issue(otp.PURPOSE_SIGNUP, email)
 
-        subject = "EVLocate Signup OTP"
-        from_email = settings.EMAIL_HOST_USER
-        to_email = [email]
-
-        email_message = EmailMultiAlternatives(
-            subject=subject,
-            body=f"Your EVLocate signup OTP is {code}",
-            from_email=from_email,
-            to=to_email,
-        )
-        email_message.attach_alternative(html_content, "text/html")
-        try:
-            email_message.send(fail_silently=False)
-        except Exception as e:
-            return Response({"error": "Failed to send email", "details": str(e)}, status=500)
+        # Queued for the outbox courier; SMTP never runs inside the request
+        outbox.enqueue(**signup_otp_message(email, code))
 
         return Response({"message": "OTP sent successfully", "email": email}, status=status.HTTP_200_OK)
 
@@ -109,6 +118,7 @@ import pytz
 
 class SignupVerifyOTPView(views.APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [OTPVerifyThrottle]
 
     def post(self, request):
         email = request.data.get("email")
@@ -117,28 +127,16 @@ class SignupVerifyOTPView(views.APIView):
         if not email or not code:
             return Response({"error": "Email and OTP code are required"}, status=status.HTTP_400_BAD_REQUEST)
 
-        otp_record = SignupOTP.objects.filter(email=email).order_by('-created_at').first()
-        if not otp_record:
-            return Response({"error": "No OTP found for this email"}, status=status.HTTP_404_NOT_FOUND)
-        print(code,type(code))
-        print(otp_record.code,type(otp_record.code))
-        print("Created (IST):", otp_record.created_at.astimezone(pytz.timezone('Asia/Kolkata')))
-        print("Now (IST):", timezone.now().astimezone(pytz.timezone('Asia/Kolkata')))
-
-        if otp_record.is_expired():
-            return Response({"error": "OTP expired"}, status=status.HTTP_400_BAD_REQUEST)
-        
-        if int(otp_record.code) != int(code):
-            return Response({"error": "Invalid OTP"}, status=status.HTTP_400_BAD_REQUEST)
-
-        otp_record.is_verified = True
-        otp_record.save()
+        result = otp.get_store().verify(otp.PURPOSE_SIGNUP, email, code)
+        if result != otp.VERIFIED:
+            return otp_error(result)
 
         return Response({"message": "OTP verified successfully"}, status=status.HTTP_200_OK)
 
 
 class LoginView(views.APIView):
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [LoginThrottle]
 
     def post(self, request):
         serializer = LoginSerializer(data=request.data)
@@ -157,7 +155,7 @@ class LoginView(views.APIView):
             if not user.is_active:
                 return Response({"error": "Account is inactive"}, status=status.HTTP_403_FORBIDDEN)
 
-            refresh = RefreshToken.for_user(user)
+            refresh = UserRefreshToken.for_user(user)
             return Response({
                 "message": "Login successful",
                 "access": str(refresh.access_token),
@@ -175,7 +173,7 @@ class LogoutView(views.APIView):
     def post(self, request):
         try:
             refresh_token = request.data.get("refresh")
-            token = RefreshToken(refresh_token)
+            token = UserRefreshToken(refresh_token)
             token.blacklist()
             return Response({"message": "Logged out successfully"}, status=status.HTTP_200_OK)
         except Exception:
@@ -185,15 +183,13 @@ class LogoutView(views.APIView):
 # 🔁 Send OTP for existing users (e.g., forgot password)
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([OTPSendThrottle])
 def send_otp(request):
     email = request.data.get("email")
     try:
         user = Users.objects.get(email=email)
-        otp = str(randint(1000, 9999))
-
-        
-        EmailOTP.objects.create(user=user, otp=otp)
-        send_otp_email(user, otp)
+        code = otp.get_store().issue(otp.PURPOSE_RESET, user.email)
+        send_otp_email(user, code)
         return Response({"message": "OTP sent successfully to your email."}, status=200)
     except Users.DoesNotExist:
         return Response({"error": "User not found."}, status=404)
@@ -202,29 +198,27 @@ def send_otp(request):
 # 🔍 Verify OTP for existing users
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
+@throttle_classes([OTPVerifyThrottle])
 def verify_otp(request):
     email = request.data.get("email")
-    otp = request.data.get("code")
+    code = request.data.get("code")
 
     try:
         user = Users.objects.get(email=email)
-        record = EmailOTP.objects.filter(user=user, otp=otp).latest('created_at')
-
-        if record.is_expired():
-            return Response({"error": "OTP expired. Please request a new one."}, status=400)
+        result = otp.get_store().verify(otp.PURPOSE_RESET, user.email, code)
+        if result != otp.VERIFIED:
+            return otp_error(result)
 
         user.is_verified = True
-        user.save()
-        record.delete()
+        user.save(update_fields=["is_verified"])
         return Response({"message": "Email verified successfully!"}, status=200)
 
-    except EmailOTP.DoesNotExist:
-        return Response({"error": "Invalid OTP"}, status=400)
     except Users.DoesNotExist:
         return Response({"error": "User not found"}, status=404)
 
 
 @api_view(['PUT'])
+@throttle_classes([PasswordResetThrottle])
 def forgot_password(request):
     email = request.data.get("email")
     new_password = request.data.get("new_password")
@@ -232,9 +226,9 @@ def forgot_password(request):
     if not email or not new_password:
         return Response({"error": "Email and new password required"}, status=status.HTTP_400_BAD_REQUEST)
 
-    # ✅ Check OTP verification first
-    otp_record = SignupOTP.objects.filter(email=email).last()
-    if not otp_record:
+    # ✅ Check OTP verification first (the marker is single-use). Only a
+    # reset code counts: a signup code proves the email, not the account.
+    if not otp.get_store().consume_verified(otp.PURPOSE_RESET, email):
         return Response({"error": "OTP not verified for this email"}, status=status.HTTP_400_BAD_REQUEST)
 
     try:
@@ -242,10 +236,6 @@ def forgot_password(request):
         user.set_password(new_password)
         user.save()
 
-        # Mark OTP as used
-        otp_record.is_verified = False
-        otp_record.save()
-
         return Response({"message": "Password reset successfully!"}, status=status.HTTP_200_OK)
 
     except Users.DoesNotExist: